@@ -0,0 +1,14 @@
+"""ASGI app of AutoGluonService for preload-then-fork serving under gunicorn (AG_WORKERS > 1)
+
+gunicorn imports this module once in the parent process, so the predictor is loaded before the
+workers are forked. Each worker then creates its own service instance around the shared predictor.
+"""
+
+import logging
+
+from service import AutoGluonService, preload_model
+
+logging.basicConfig(level=logging.INFO)
+
+preload_model()
+app = AutoGluonService.to_asgi()
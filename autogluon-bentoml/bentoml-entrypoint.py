@@ -19,6 +19,14 @@ if __name__ == "__main__":
         print("Starting BentoML service...")
         # Change to the directory containing the service
         os.chdir("/opt/ml")
+        if int(os.environ.get("AG_WORKERS", "1")) > 1:
+            # Preload-then-fork: gunicorn loads the model once and forks AG_WORKERS workers sharing it
+            os.execv(sys.executable, [
+                sys.executable, "-m", "gunicorn",
+                "-c", "python:autogluon_serving.gunicorn_conf",
+                "--bind", "0.0.0.0:5000",
+                "asgi:app"
+            ])
         # Start BentoML service properly
         os.execv(sys.executable, [
             sys.executable, "-m", "bentoml", "serve", 
@@ -26,6 +34,9 @@ if __name__ == "__main__":
             "--host", "0.0.0.0", 
             "--port", "5000"
         ])
+    elif len(sys.argv) > 1 and sys.argv[1] == "batch":
+        # Offline batch transform, e.g. batch --input-dir /data/in --output-dir /data/out
+        os.execv(sys.executable, [sys.executable, "-m", "autogluon_serving.batch"] + sys.argv[2:])
     elif len(sys.argv) > 1:
         # For other commands (like tests), execute them directly
         subprocess.check_call(shlex.split(" ".join(sys.argv[1:])))
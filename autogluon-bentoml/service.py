@@ -1,149 +1,549 @@
 import bentoml
+from bentoml.exceptions import ServiceUnavailable
+from fastapi import FastAPI, Request, Response
 from autogluon.tabular import TabularPredictor
-from autogluon.core.utils import get_pred_from_proba_df
-from autogluon.core.constants import REGRESSION
 import pandas as pd
+import asyncio
+import contextlib
 import os
-import tarfile
-from typing import Dict, Any, Union, List
+import threading
+import time
+from typing import Dict, Any, Optional, Union, List
 from io import StringIO
 import json
+import logging
+
+from autogluon_serving.admission import AdmissionControl, Rejected
+from autogluon_serving.asgi import stream_response
+from autogluon_serving.binary import BinaryServer
+from autogluon_serving.compiled import install_compiled
+from autogluon_serving.extract import prepare_model
+from autogluon_serving.metrics import SERVER_TIMING, Timings, render
+from autogluon_serving.microbatch import MicroBatcher
+from autogluon_serving.parallel import install_parallel
+from autogluon_serving.prefork import WORKERS, memory_usage, persist_models, preloading
+from autogluon_serving.profiling import TOKEN_HEADER, ProfilingError, capture_profile
+from autogluon_serving.reload import RELOAD_TOKEN_HEADER, ModelReloader, ReloadInProgress, ReloadNotAllowed, check_reload_request
+from autogluon_serving.store import TARGET_MODEL_HEADER, TARGET_MODEL_PARAM, ModelLoading, ModelStore, ServedModel
+from autogluon_serving.formats import (
+    CONTENT_TYPE_ARROW,
+    CONTENT_TYPE_CSV,
+    CONTENT_TYPE_JSON,
+    compress,
+    decode_columnar,
+    decode_json,
+    encode_columnar,
+    encode_json,
+    is_columnar,
+    media_type,
+    negotiate_columnar,
+    negotiate_encoding,
+    negotiate_orient,
+)
+from autogluon_serving.streaming import STREAM_CONTENT_TYPES, is_streamable
+from autogluon_serving.threads import apply_thread_budget
+from autogluon_serving.warmup import warmup
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Adaptive micro-batching: concurrent requests are coalesced into a single predictor call
+# of at most AG_MAX_BATCH_SIZE rows, waiting at most AG_MAX_BATCH_DELAY_MS for company.
+# A batch size of 1 disables batching.
+MAX_BATCH_SIZE = int(os.environ.get("AG_MAX_BATCH_SIZE", "256"))
+MAX_BATCH_DELAY_MS = float(os.environ.get("AG_MAX_BATCH_DELAY_MS", "10"))
+MODEL_PATH = os.environ.get("MODEL_PATH", "/opt/ml/model")
+
+# Models of AG_MODEL_STORE_DIR served next to the container's own, see autogluon_serving.store
+model_store = ModelStore.from_env()
 
 # Model extraction and loading logic
 def load_autogluon_model():
-    """Extract and load the AutoGluon model"""
-    model_dir = os.environ.get("MODEL_PATH", "/opt/ml/model")
-    extracted_dir = os.path.join(model_dir, "extracted_model")
-    
-    # Check if model is already extracted
-    if os.path.exists(extracted_dir):
-        return TabularPredictor.load(extracted_dir, require_py_version_match=False)
-    
-    # Look for the model tar file
-    model_file = None
-    for filename in os.listdir(model_dir):
-        if filename.endswith('.tar.gz') and 'model' in filename:
-            model_file = os.path.join(model_dir, filename)
-            break
-    
-    if not model_file:
-        raise FileNotFoundError(f"No model tar.gz file found in {model_dir}. Files: {os.listdir(model_dir)}")
-    
-    # Extract the model
-    os.makedirs(extracted_dir, exist_ok=True)
-    with tarfile.open(model_file, 'r:gz') as tar:
-        tar.extractall(extracted_dir)
-    
-    # Load the AutoGluon model
-    return TabularPredictor.load(extracted_dir, require_py_version_match=False)
+    """Extract (through the content-addressed cache) and load the AutoGluon model, with its compiled tree members"""
+    model_path, _ = prepare_model(MODEL_PATH)
+    model = TabularPredictor.load(model_path, require_py_version_match=False)
+    install_compiled(model)
+    install_parallel(model)
+    return model
+
+
+# Predictor loaded by the gunicorn parent before forking workers (AG_WORKERS > 1), see asgi.py
+_preloaded_model = None
+
+
+def preload_model():
+    """Load, persist and warm up the predictor in the parent so forked workers share it copy-on-write"""
+    global _preloaded_model
+    with preloading():
+        model = load_autogluon_model()
+        persist_models(model)
+        warmup(model)
+        if model_store is not None:
+            model_store.load_pinned()
+    _preloaded_model = model
+
+
+# Routes that need the raw request (binary bodies, content negotiation) are served by FastAPI
+app = FastAPI()
 
 # Create BentoML service
 @bentoml.service(
     resources={"cpu": "2", "memory": "4Gi"},
     traffic={"timeout": 300}
 )
+@bentoml.asgi_app(app)
 class AutoGluonService:
     
     def __init__(self):
-        self.model = None
+        # Holds the served predictor, swapped for a new one when the model artifact changes
+        self._reloader = None
+        self._model_lock = threading.Lock()
+        self._ready = threading.Event()
+        self._load_error = None
+        self._batcher = None
+        # Bounded requests in flight and queue, on their own executor, see autogluon_serving.admission
+        self._admission = AdmissionControl.from_env()
+        # Streams hold a slot of their own for as long as they last
+        self._stream_admission = AdmissionControl.streams_from_env()
+        if MAX_BATCH_SIZE > 1:
+            self._batcher = MicroBatcher(self._predict_frame, MAX_BATCH_SIZE, MAX_BATCH_DELAY_MS)
+        # Binary protocol listener started in the server's event loop, see autogluon_serving.binary
+        self._binary = BinaryServer.from_env(self._predict_binary)
+        # Load and warm the model at startup instead of on the first request
+        threading.Thread(target=self._load_and_warmup, name="autogluon-warmup", daemon=True).start()
     
-    def _get_model(self):
-        """Lazy load the model when first needed"""
-        if self.model is None:
-            self.model = load_autogluon_model()
-        return self.model
-    
-    def _predict_logic(self, input_data):
-        """Core prediction logic"""
+    def _load_and_warmup(self):
+        """Load the predictor and run synthetic batches through it before reporting ready"""
         try:
-            # Handle CSV string input
-            if isinstance(input_data, str):
-                data = pd.read_csv(StringIO(input_data))
-            # Handle different JSON input formats
-            elif isinstance(input_data, list):
-                # Direct list of records (batch format)
-                data = pd.DataFrame(input_data)
-            elif "instances" in input_data:
-                # Wrapped in instances key
-                if isinstance(input_data["instances"], list):
-                    data = pd.DataFrame(input_data["instances"])
-                else:
-                    data = pd.DataFrame([input_data["instances"]])
-            elif isinstance(input_data, dict) and len(input_data) > 0:
-                # Check if it's a single record or contains batch data
-                first_value = next(iter(input_data.values()))
-                if isinstance(first_value, list) and len(first_value) > 0 and isinstance(first_value[0], (int, float, str)):
-                    # This looks like batch data where each key has a list of values
-                    data = pd.DataFrame(input_data)
-                else:
-                    # Single record
-                    data = pd.DataFrame([input_data])
+            start = time.perf_counter()
+            served = self._get_served()
+            logger.info(f"Model loaded in {time.perf_counter() - start:.2f} s")
+            start = time.perf_counter()
+            warmup(served.predictor)
+            logger.info(f"Warmup finished in {time.perf_counter() - start:.2f} s")
+            start = time.perf_counter()
+            served.selector.calibrate()
+            logger.info(f"Model latency calibration finished in {time.perf_counter() - start:.2f} s")
+            if model_store is not None:
+                # Already done by the parent when it preloaded
+                model_store.load_pinned()
+            self._reloader.start()
+            self._ready.set()
+        except Exception as e:
+            logger.error(f"Model load failed: {e}")
+            self._load_error = str(e)
+    
+    @bentoml.on_startup
+    async def _start_binary(self):
+        if self._binary is not None:
+            await self._binary.start()
+
+    @bentoml.on_shutdown
+    async def _stop_binary(self):
+        if self._binary is not None:
+            await self._binary.stop()
+    
+    def __is_ready__(self) -> bool:
+        """Gate BentoML's /readyz on the warmup phase"""
+        return self._ready.is_set()
+    
+    def _check_ready(self):
+        if not self._ready.is_set():
+            message = f"Model failed to load: {self._load_error}" if self._load_error else "Model is warming up"
+            raise ServiceUnavailable(message)
+    
+    def _admit(self, timings, deadline_ms=None):
+        """Hold an admission slot for a prediction request, raises Rejected when it is shed"""
+        if self._admission is None:
+            return contextlib.nullcontext()
+        return self._admission.admit(timings, deadline_ms)
+    
+    async def _run(self, fn, *args):
+        """Run a blocking step of a prediction request on the inference executor"""
+        if self._admission is None:
+            return await asyncio.to_thread(fn, *args)
+        return await self._admission.run(fn, *args)
+    
+    def _get_served(self):
+        """Return the container's current model, loading it if the startup warmup has not done so yet"""
+        global _preloaded_model
+        if self._reloader is None:
+            with self._model_lock:
+                if self._reloader is None:
+                    model = _preloaded_model if _preloaded_model is not None else load_autogluon_model()
+                    # Only the ServedModel may hold the predictor, so that a reload can release it
+                    _preloaded_model = None
+                    apply_thread_budget(model, WORKERS)
+                    self._reloader = ModelReloader(MODEL_PATH, ServedModel(model, MODEL_PATH))
+        return self._reloader.served
+    
+    def _served_model(self, target_model=None):
+        """The model serving a request: the store model it targets, or the container's current model"""
+        if not target_model:
+            return self._get_served()
+        if model_store is None:
+            raise ValueError(f"Unknown target model '{target_model}', no model store configured (AG_MODEL_STORE_DIR)")
+        return model_store.get(target_model)
+    
+    def _to_frame(self, input_data, served):
+        """Convert any of the supported request payloads to a DataFrame"""
+        decoder = served.decoder
+        if decoder is not None:
+            # Typed columns straight from the payload, see autogluon_serving.decoding
+            if isinstance(input_data, (str, bytes)):
+                return decoder.decode_csv(input_data)
+            if isinstance(input_data, dict) and "instances" in input_data:
+                input_data = input_data["instances"]
+            return decoder.decode_json(input_data)
+        # Handle CSV string input
+        if isinstance(input_data, bytes):
+            input_data = input_data.decode("utf-8")
+        if isinstance(input_data, str):
+            return pd.read_csv(StringIO(input_data))
+        # Handle different JSON input formats
+        elif isinstance(input_data, list):
+            # Direct list of records (batch format)
+            return pd.DataFrame(input_data)
+        elif "instances" in input_data:
+            # Wrapped in instances key
+            if isinstance(input_data["instances"], list):
+                return pd.DataFrame(input_data["instances"])
             else:
-                data = pd.DataFrame([input_data])
-            
-            # Get the model (lazy loading)
-            model = self._get_model()
-            
-            # Make predictions
-            if model.problem_type != REGRESSION:
-                pred_proba = model.predict_proba(data, as_pandas=True)
-                pred = get_pred_from_proba_df(pred_proba, problem_type=model.problem_type)
-                pred_proba.columns = [str(c) + "_proba" for c in pred_proba.columns]
-                pred.name = str(pred.name) + "_pred" if pred.name is not None else "pred"
-                prediction = pd.concat([pred, pred_proba], axis=1)
+                return pd.DataFrame([input_data["instances"]])
+        elif isinstance(input_data, dict) and len(input_data) > 0:
+            # Check if it's a single record or contains batch data
+            first_value = next(iter(input_data.values()))
+            if isinstance(first_value, list) and len(first_value) > 0 and isinstance(first_value[0], (int, float, str)):
+                # This looks like batch data where each key has a list of values
+                return pd.DataFrame(input_data)
             else:
-                prediction = model.predict(data, as_pandas=True)
-                
-            if isinstance(prediction, pd.Series):
-                prediction = prediction.to_frame()
-            
-            # Convert to JSON-serializable format
-            result = prediction.to_dict(orient='records')
-            
-            return {
-                "predictions": result,
-                "model_info": {
-                    "problem_type": str(model.problem_type),
-                    "num_features": len(model.feature_metadata_in.get_features()),
-                    "feature_names": model.feature_metadata_in.get_features(),
-                    "batch_size": len(data)
-                }
-            }
+                # Single record
+                return pd.DataFrame([input_data])
+        else:
+            return pd.DataFrame([input_data])
+    
+    def _predict_frame(self, data, model_name=None, timings=None, served=None):
+        """Run the predictor (or one of its models) on a DataFrame and return predictions (and probabilities) as a DataFrame"""
+        served = served if served is not None else self._get_served()
+        return served.predict_frame(data, model_name, timings)
+    
+    def _batched(self, served):
+        """Whether requests for served go through the micro-batcher, store models predict on their own"""
+        return self._batcher is not None and served.name is None
+    
+    def _select_model(self, data, model=None, tier=None, deadline_ms=None, started=None, served=None):
+        """Name of the model serving a request selected by model name, latency tier or deadline"""
+        served = served if served is not None else self._get_served()
+        elapsed_ms = (time.perf_counter() - started) * 1000 if started is not None else 0.0
+        if self._batched(served):
+            # A request may wait up to the batching delay before it reaches the predictor
+            elapsed_ms += MAX_BATCH_DELAY_MS
+        return served.selector.select(len(data), model=model, tier=tier, deadline_ms=deadline_ms, elapsed_ms=elapsed_ms)
+    
+    async def _predict(self, data, model_name, timings, served):
+        """Predict a DataFrame, serving repeated rows from the prediction cache when it is enabled"""
+        if not self._batched(served):
+            return await self._run(served.predict, data, model_name, timings)
+        # Cached rows are predictions of the default model
+        cache = served.cache
+        if cache is None or model_name not in (None, served.selector.best):
+            return await self._predict_uncached(data, model_name, timings, served)
+        keys, rows = await self._run(cache.lookup, data)
+        missing = [i for i, row in enumerate(rows) if row is None]
+        # Only the cache misses go to the predictor, as one sub-batch
+        prediction = await self._predict_uncached(data.iloc[missing], model_name, timings, served) if missing or data.empty else None
+        return await self._run(cache.complete, data, keys, rows, missing, prediction)
+    
+    async def _predict_uncached(self, data, model_name, timings, served):
+        """Predict a DataFrame, sharing a single predictor call with concurrent requests through the batcher"""
+        return await asyncio.wrap_future(self._batcher.submit(data, model_name, timings, served))
+    
+    def _model_info(self, data, model_name, served):
+        """Model information returned alongside the predictions"""
+        model = served.predictor
+        info = {
+            "problem_type": str(model.problem_type),
+            "model": model_name or served.selector.best,
+            "num_features": len(model.feature_metadata_in.get_features()),
+            "feature_names": model.feature_metadata_in.get_features(),
+            "batch_size": len(data)
+        }
+        if served.name is not None:
+            info["target_model"] = served.name
+        return info
+    
+    def _format_response(self, prediction, data, model_name, served):
+        """Wrap predictions and model information in the JSON response body"""
+        # Convert to JSON-serializable format
+        result = prediction.to_dict(orient='records')
+        
+        return {
+            "predictions": result,
+            "model_info": self._model_info(data, model_name, served)
+        }
+    
+    async def _predict_logic(self, input_data, model=None, tier=None, deadline_ms=None, started=None, timings=None, target_model=None):
+        """Core prediction logic, timed stage by stage"""
+        timings = timings if timings is not None else Timings()
+        data = None
+        try:
+            served = await self._run(self._served_model, target_model)
+            with timings.stage("decode"):
+                data = await self._run(self._to_frame, input_data, served)
+            model_name = self._select_model(data, model, tier, deadline_ms, started, served)
+            prediction = await self._predict(data, model_name, timings, served)
+            with timings.stage("encode"):
+                response = self._format_response(prediction, data, model_name, served)
+            timings.finish(len(data))
+            return response
             
+        except ModelLoading as e:
+            timings.finish(None, failed=True)
+            return {"error": str(e), "predictions": [], "retry_after": e.retry_after}
         except Exception as e:
+            timings.finish(len(data) if data is not None else None, failed=True)
             return {"error": str(e), "predictions": []}
     
+    async def _predict_binary(self, body, selection, timings):
+        """Predict the Arrow IPC stream of a binary protocol request like an Arrow /invocations request"""
+        deadline_ms = float(selection["deadline_ms"]) if selection.get("deadline_ms") is not None else None
+        async with self._admit(timings, deadline_ms):
+            served = await self._run(self._served_model, selection.get("target_model"))
+            with timings.stage("decode"):
+                data = await self._run(decode_columnar, body, CONTENT_TYPE_ARROW)
+            model_name = self._select_model(data, selection.get("model"), selection.get("tier"), deadline_ms, timings.started, served)
+            prediction = await self._predict(data, model_name, timings, served)
+            with timings.stage("encode"):
+                content = await self._run(encode_columnar, prediction, CONTENT_TYPE_ARROW)
+        metadata = {"model": model_name}
+        if served.name is not None:
+            metadata["target_model"] = served.name
+        return content, len(data), metadata
+    
     @bentoml.api
-    def predict(self, input_data: Union[Dict[str, Any], List[Dict[str, Any]], str]) -> Dict[str, Any]:
-        """Standard BentoML prediction endpoint"""
-        return self._predict_logic(input_data)
+    async def predict(
+        self,
+        input_data: Union[Dict[str, Any], List[Dict[str, Any]], str],
+        model: Optional[str] = None,
+        tier: Optional[str] = None,
+        deadline_ms: Optional[float] = None,
+        target_model: Optional[str] = None,
+        ctx: bentoml.Context = None,
+    ) -> Dict[str, Any]:
+        """Standard BentoML prediction endpoint, optionally served by a given model, latency tier or deadline,
+        or by a model of the model store; 429 or 503 with Retry-After when the request is shed or its model is loading"""
+        timings = Timings()
+        status_code = 503
+        try:
+            async with self._admit(timings, deadline_ms):
+                response = await self._predict_logic(input_data, model, tier, deadline_ms, timings.started, timings, target_model)
+        except Rejected as e:
+            timings.finish(None, failed=True)
+            response = {"error": str(e), "predictions": [], "retry_after": e.retry_after}
+            status_code = e.status_code
+        if "retry_after" in response and ctx is not None:
+            ctx.response.status_code = status_code
+            ctx.response.headers["Retry-After"] = str(response["retry_after"])
+        if SERVER_TIMING and ctx is not None:
+            ctx.response.headers["Server-Timing"] = timings.server_timing()
+        return response
 
     @bentoml.api
     def health(self) -> Dict[str, Union[str, bool]]:
-        """Health check endpoint"""
+        """Health check endpoint, not ready until the model is loaded and warmed up"""
+        self._check_ready()
         return {"status": "healthy"}
 
     @bentoml.api
     def model_info(self) -> Dict[str, Any]:
         """Get model information"""
         try:
-            model = self._get_model()
+            served = self._get_served()
+            model = served.predictor
             return {
                 "problem_type": str(model.problem_type),
                 "num_features": len(model.feature_metadata_in.get_features()),
                 "feature_names": model.feature_metadata_in.get_features(),
-                "model_path": os.environ.get("MODEL_PATH", "/opt/ml/model")
+                "model_path": MODEL_PATH,
+                "model_best": served.selector.best,
+                "models": served.selector.stats(),
+                "memory": memory_usage(),
+                "prediction_cache": served.cache.stats() if served.cache is not None else None,
+                "reload": self._reloader.stats(),
+                "admission": self._admission.stats() if self._admission is not None else None,
+                "stream_admission": self._stream_admission.stats() if self._stream_admission is not None else None,
+                "binary": self._binary.stats() if self._binary is not None else None,
+                "model_store": model_store.stats() if model_store is not None else None
             }
         except Exception as e:
             return {"error": str(e), "model_loaded": False}
 
+    def __metrics__(self, content: str) -> str:
+        """Append the prediction path metrics to BentoML's own on /metrics"""
+        return content + render()
+
     # Additional endpoints for SageMaker compatibility
     @bentoml.api
     def ping(self) -> Dict[str, str]:
-        """SageMaker health check endpoint (accessible at /ping)"""
+        """SageMaker health check endpoint (accessible at /ping), not ready until the model is loaded and warmed up"""
+        self._check_ready()
         return {"status": "healthy"}
 
-    @bentoml.api  
-    def invocations(self, input_data: Union[Dict[str, Any], List[Dict[str, Any]], str]) -> Dict[str, Any]:
-        """SageMaker prediction endpoint (accessible at /invocations)"""
-        return self._predict_logic(input_data)
\ No newline at end of file
+    @app.post("/invocations")
+    async def invocations(self, request: Request) -> Response:
+        """SageMaker prediction endpoint (accessible at /invocations)
+
+        Accepts JSON, CSV, Arrow IPC stream and Parquet bodies. Predictions are returned as Arrow
+        or Parquet when the Accept header asks for it, and as JSON otherwise, in the layout given by
+        its orient parameter (records, split or values). Responses are compressed with zstd or gzip
+        when Accept-Encoding allows it. The serving model is selected with the model, tier or
+        deadline_ms query parameters or the matching X-AG-Model, X-AG-Tier and X-AG-Deadline-Ms headers.
+        The target_model query parameter or X-AG-Target-Model header routes the request to a model of
+        the model store; 503 with Retry-After answers it while that model is loading. Requests over
+        the admission limits are answered with 429 or 503 and Retry-After, see autogluon_serving.admission.
+        With AG_SERVER_TIMING=true the response's Server-Timing header breaks its latency down by stage.
+        """
+        started = time.perf_counter()
+        timings = Timings()
+        content_type = media_type(request.headers.get("content-type"))
+        accept = request.headers.get("accept")
+        response_type = negotiate_columnar(accept)
+        body = await request.body()
+        model_name = None
+        served = None
+        target_model = None
+        data = None
+        status_code = 200
+        retry_after = None
+        try:
+            target_model = request.query_params.get(TARGET_MODEL_PARAM) or request.headers.get(TARGET_MODEL_HEADER)
+            selection = {
+                name: request.query_params.get(name) or request.headers.get(header)
+                for name, header in (("model", "x-ag-model"), ("tier", "x-ag-tier"), ("deadline_ms", "x-ag-deadline-ms"))
+            }
+            if selection["deadline_ms"] is not None:
+                selection["deadline_ms"] = float(selection["deadline_ms"])
+            async with self._admit(timings, selection["deadline_ms"]):
+                served = await self._run(self._served_model, target_model)
+                orient = negotiate_orient(accept)
+                with timings.stage("decode"):
+                    if is_columnar(content_type):
+                        data = await self._run(decode_columnar, body, content_type)
+                    elif content_type == CONTENT_TYPE_CSV:
+                        data = await self._run(self._to_frame, body, served)
+                    else:
+                        input_data = decode_json(body)
+                        # Accept the {"input_data": ...} envelope used by the BentoML /predict endpoint
+                        if isinstance(input_data, dict) and list(input_data) == ["input_data"]:
+                            input_data = input_data["input_data"]
+                        data = await self._run(self._to_frame, input_data, served)
+                model_name = self._select_model(data, started=started, served=served, **selection)
+                prediction = await self._predict(data, model_name, timings, served)
+                with timings.stage("encode"):
+                    if response_type is not None:
+                        content = await self._run(encode_columnar, prediction, response_type)
+                    else:
+                        response_type = CONTENT_TYPE_JSON
+                        content = await self._run(encode_json, prediction, orient, {"model_info": self._model_info(data, model_name, served)})
+            failed = False
+        except Rejected as e:
+            response_type = CONTENT_TYPE_JSON
+            content = json.dumps({"error": str(e), "predictions": []}).encode("utf-8")
+            failed = True
+            status_code = e.status_code
+            retry_after = e.retry_after
+        except ModelLoading as e:
+            response_type = CONTENT_TYPE_JSON
+            content = json.dumps({"error": str(e), "predictions": []}).encode("utf-8")
+            failed = True
+            status_code = 503
+            retry_after = e.retry_after
+        except Exception as e:
+            response_type = CONTENT_TYPE_JSON
+            content = json.dumps({"error": str(e), "predictions": []}).encode("utf-8")
+            failed = True
+        
+        encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+        with timings.stage("compress"):
+            content, encoding = await asyncio.to_thread(compress, content, encoding)
+        timings.finish(len(data) if data is not None else None, failed=failed)
+        headers = {"Vary": "Accept, Accept-Encoding"}
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+        if model_name is not None:
+            headers["X-AG-Model"] = model_name
+        if served is not None and served.name is not None:
+            headers["X-AG-Target-Model"] = served.name
+        if retry_after is not None:
+            headers["Retry-After"] = str(retry_after)
+        if SERVER_TIMING:
+            headers["Server-Timing"] = timings.server_timing()
+        return Response(content, status_code=status_code, media_type=response_type, headers=headers)
+
+    @app.post("/invocations/stream")
+    async def invocations_stream(self, request: Request) -> Response:
+        """Streaming prediction endpoint for CSV and JSON Lines bodies of any size
+
+        The body is parsed, predicted and serialized in fixed-size row chunks while it is being
+        received, and predictions are sent back with chunked transfer encoding as soon as each
+        chunk is done. The response is CSV or JSON Lines as requested by the Accept header, in the
+        request's format by default. A failure after the first chunk ends the stream early. The
+        target_model query parameter or X-AG-Target-Model header selects a model of the model store.
+        Beyond AG_MAX_STREAMS streams in flight, requests are answered with 429 and Retry-After.
+        """
+        content_type = media_type(request.headers.get("content-type"))
+        if not is_streamable(content_type):
+            content = json.dumps({"error": f"{content_type} input content type not supported for streaming, expected one of {STREAM_CONTENT_TYPES}"})
+            return Response(content, status_code=415, media_type=CONTENT_TYPE_JSON)
+        accept = media_type(request.headers.get("accept"))
+        response_type = accept if accept in STREAM_CONTENT_TYPES else content_type
+        target_model = request.query_params.get(TARGET_MODEL_PARAM) or request.headers.get(TARGET_MODEL_HEADER)
+        try:
+            served = await asyncio.to_thread(self._served_model, target_model)
+        except ModelLoading as e:
+            content = json.dumps({"error": str(e)})
+            return Response(content, status_code=503, media_type=CONTENT_TYPE_JSON, headers={"Retry-After": str(e.retry_after)})
+        except ValueError as e:
+            return Response(json.dumps({"error": str(e)}), status_code=400, media_type=CONTENT_TYPE_JSON)
+        # Chunks already hold many rows, so they bypass the micro-batcher and the prediction cache
+        try:
+            return await stream_response(request, content_type, served.predict_frame, response_type, self._stream_admission)
+        except Rejected as e:
+            content = json.dumps({"error": str(e)})
+            return Response(content, status_code=e.status_code, media_type=CONTENT_TYPE_JSON, headers={"Retry-After": str(e.retry_after)})
+
+    @app.post("/reload")
+    async def reload(self, request: Request) -> Response:
+        """Load the model under MODEL_PATH again and swap it in once warmed up, requests are served by the previous one meanwhile
+
+        Answers with the new model generation once it serves, 409 while another reload is running and
+        500 if the new model fails to load, in which case the previous one keeps serving. With several
+        workers only the worker answering reloads, the others pick the model up through the watcher.
+        404 unless AG_RELOAD_ENDPOINT is enabled, 403 without the AG_RELOAD_TOKEN token if one is set.
+        """
+        try:
+            check_reload_request(request.headers.get(RELOAD_TOKEN_HEADER))
+        except ReloadNotAllowed as e:
+            return Response(json.dumps({"error": str(e)}), status_code=e.status_code, media_type=CONTENT_TYPE_JSON)
+        await asyncio.to_thread(self._get_served)
+        try:
+            stats = await asyncio.to_thread(self._reloader.reload)
+        except ReloadInProgress as e:
+            return Response(json.dumps({"error": str(e)}), status_code=409, media_type=CONTENT_TYPE_JSON)
+        except Exception as e:
+            logger.error(f"Model reload failed: {e}")
+            return Response(json.dumps({"error": str(e), **self._reloader.stats()}), status_code=500, media_type=CONTENT_TYPE_JSON)
+        return Response(json.dumps(stats), media_type=CONTENT_TYPE_JSON)
+
+    @app.get("/profile")
+    async def profile(self, request: Request) -> Response:
+        """CPU or allocation profile of this worker over the next seconds, 404 unless AG_PROFILING is enabled
+
+        The kind (cpu or memory), seconds, format, thread and idle query parameters are described in
+        autogluon_serving.profiling. The capture runs off the inference executor, requests keep being served.
+        """
+        try:
+            content, content_type, headers = await asyncio.to_thread(capture_profile, request.query_params, request.headers.get(TOKEN_HEADER))
+        except ProfilingError as e:
+            return Response(json.dumps({"error": str(e)}), status_code=e.status_code, media_type=CONTENT_TYPE_JSON)
+        return Response(content, media_type=content_type, headers=headers)
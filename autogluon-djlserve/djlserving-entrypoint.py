@@ -22,6 +22,9 @@ if __name__ == "__main__":
     if len(sys.argv) > 1 and sys.argv[1] == "serve":
         subprocess.check_call(["/usr/local/bin/setup_model.sh"])
         os.execv("/usr/bin/djl-serving", ["djl-serving", "-f", "/home/model-server/serving.properties"])
+    elif len(sys.argv) > 1 and sys.argv[1] == "batch":
+        # Offline batch transform, e.g. batch --input-dir /data/in --output-dir /data/out
+        os.execv(sys.executable, [sys.executable, "-m", "autogluon_serving.batch", "--model-dir", "/opt/ml/model"] + sys.argv[2:])
     elif len(sys.argv) > 1:
         subprocess.check_call(shlex.split(" ".join(sys.argv[1:])))
     else:
@@ -1,24 +1,95 @@
 from djl_python import Input
 from djl_python import Output
 from autogluon.tabular import TabularPredictor
-from autogluon.core.utils import get_pred_from_proba_df
-from autogluon.core.constants import REGRESSION
 from io import BytesIO, StringIO
 import pandas as pd
+import json
+import logging
 import os
+import time
 
-# Model loading
+from autogluon_serving.admission import AdmissionControl
+from autogluon_serving.binary import BINARY_THREADS, BinaryServer
+from autogluon_serving.compiled import install_compiled
+from autogluon_serving.formats import (
+    CONTENT_TYPE_ARROW,
+    compress,
+    decode_columnar,
+    decode_json,
+    encode_columnar,
+    encode_json,
+    is_columnar,
+    media_type,
+    negotiate_columnar,
+    negotiate_encoding,
+    negotiate_orient,
+)
+from autogluon_serving.metrics import SERVER_TIMING, Timings, share
+from autogluon_serving.parallel import install_parallel
+from autogluon_serving.prefork import WORKERS, persist_models
+from autogluon_serving.reload import ModelReloader
+from autogluon_serving.store import TARGET_MODEL_HEADER, ModelLoading, ModelStore, ServedModel
+from autogluon_serving.streaming import JSONL_CONTENT_TYPES, STREAM_CONTENT_TYPES, stream_predictions
+from autogluon_serving.threads import apply_thread_budget
+from autogluon_serving.warmup import warmup
+
+logger = logging.getLogger(__name__)
+
+# Prometheus metrics of all Python workers are served on this port by one of them, 0 disables it
+METRICS_PORT = int(os.environ.get("AG_METRICS_PORT", "8082"))
+# Watched for new model artifacts, which are loaded and swapped in without restarting the worker
+MODEL_PATH = os.environ.get("MODEL_PATH", "/opt/ml/model")
+
+# Model loading and warmup, DJL only marks the model ready once this module has been imported
+start = time.perf_counter()
 current_file_path = os.sep.join(os.path.realpath(__file__).split(os.sep)[:-1])
 model = TabularPredictor.load(current_file_path, require_py_version_match=False)
-column_names = model.feature_metadata_in.get_features()
+logger.info(f"Model loaded in {time.perf_counter() - start:.2f} s")
+if WORKERS > 1:
+    # AG_WORKERS Python workers share the cores, keep the models (and their thread settings) in memory
+    persist_models(model)
+install_compiled(model)
+apply_thread_budget(model, WORKERS)
+install_parallel(model)
+start = time.perf_counter()
+warmup(model)
+logger.info(f"Warmup finished in {time.perf_counter() - start:.2f} s")
+# Requests read reloader.served once, a reload swaps in a new ServedModel between requests
+reloader = ModelReloader(MODEL_PATH, ServedModel(model, current_file_path))
+# Only the ServedModel may hold the predictor, so that a reload can release it
+del model
+start = time.perf_counter()
+reloader.served.selector.calibrate()
+logger.info(f"Model latency calibration finished in {time.perf_counter() - start:.2f} s")
+reloader.start()
+# Models of AG_MODEL_STORE_DIR served next to this one, see autogluon_serving.store
+model_store = ModelStore.from_env()
+if model_store is not None:
+    model_store.load_pinned()
+if METRICS_PORT:
+    share(port=METRICS_PORT)
 
-def handle(inputs: Input) -> Output:
-    if inputs.is_empty():
-        return None
-    content_type = inputs.get_property("content-type")
-    if content_type == "application/x-parquet":
-        data = BytesIO(inputs.get_as_bytes())
-        data = pd.read_parquet(data)
+def served_model(inputs: Input) -> ServedModel:
+    """The store model named by the request's X-AG-Target-Model header, or this container's current model"""
+    return served_target(inputs.get_property(TARGET_MODEL_HEADER))
+
+def served_target(target_model: str = None) -> ServedModel:
+    if not target_model:
+        return reloader.served
+    if model_store is None:
+        raise ValueError(f"Unknown target model '{target_model}', no model store configured (AG_MODEL_STORE_DIR)")
+    return model_store.get(target_model)
+
+def decode_input(inputs: Input, served: ServedModel) -> pd.DataFrame:
+    content_type = media_type(inputs.get_property("content-type"))
+    decoder = served.decoder
+    if is_columnar(content_type):
+        # Arrow IPC stream or Parquet, decoded without going through row-wise Python objects
+        data = decode_columnar(inputs.get_as_bytes(), content_type)
+    elif decoder is not None and content_type == "text/csv":
+        data = decoder.decode_csv(inputs.get_as_bytes())
+    elif decoder is not None and content_type == "application/json":
+        data = decoder.decode_json(decode_json(inputs.get_as_bytes()))
     elif content_type == "text/csv":
         data = StringIO(inputs.get_as_string())
         data = pd.read_csv(data)
@@ -28,17 +99,216 @@ def handle(inputs: Input) -> Output:
         data = pd.DataFrame(data)
     else:
         raise ValueError(f"{content_type} input content type not supported.")
-    
-    if model.problem_type != REGRESSION:
-        pred_proba = model.predict_proba(data, as_pandas=True)
-        pred = get_pred_from_proba_df(pred_proba, problem_type=model.problem_type)
-        pred_proba.columns = [str(c) + "_proba" for c in pred_proba.columns]
-        pred.name = str(pred.name) + "_pred" if pred.name is not None else "pred"
-        prediction = pd.concat([pred, pred_proba], axis=1)
-    else:
-        prediction = model.predict(data, as_pandas=True)
-    if isinstance(prediction, pd.Series):
-        prediction = prediction.to_frame()
-    
-    output = prediction.to_json()
-    return Output().add(output).add_property("content-type", "application/json")
\ No newline at end of file
+    return data
+
+def select_model(inputs: Input, data: pd.DataFrame, started: float, served: ServedModel) -> str:
+    """Model selected by the request's X-AG-Model, X-AG-Tier or X-AG-Deadline-Ms header"""
+    deadline_ms = inputs.get_property("x-ag-deadline-ms")
+    return served.selector.select(
+        len(data),
+        model=inputs.get_property("x-ag-model"),
+        tier=inputs.get_property("x-ag-tier"),
+        deadline_ms=float(deadline_ms) if deadline_ms is not None else None,
+        elapsed_ms=(time.perf_counter() - started) * 1000,
+    )
+
+def predict(data: pd.DataFrame, model_name: str = None, timings: Timings = None, served: ServedModel = None) -> pd.DataFrame:
+    """Predict data, serving repeated rows of the default model from the prediction cache when it is enabled"""
+    served = served if served is not None else reloader.served
+    return served.predict(data, model_name, timings)
+
+def predict_binary_request(body: bytes, selection: dict, timings: Timings):
+    """Predict the Arrow IPC stream of a binary protocol request, selected like a request with X-AG-* headers"""
+    served = served_target(selection.get("target_model"))
+    with timings.stage("decode"):
+        data = decode_columnar(body, CONTENT_TYPE_ARROW)
+    deadline_ms = selection.get("deadline_ms")
+    model_name = served.selector.select(
+        len(data),
+        model=selection.get("model"),
+        tier=selection.get("tier"),
+        deadline_ms=float(deadline_ms) if deadline_ms is not None else None,
+        elapsed_ms=(time.perf_counter() - timings.started) * 1000,
+    )
+    prediction = predict(data, model_name, timings, served)
+    with timings.stage("encode"):
+        content = encode_columnar(prediction, CONTENT_TYPE_ARROW)
+    metadata = {"model": model_name}
+    if served.name is not None:
+        metadata["target_model"] = served.name
+    return content, len(data), metadata
+
+# Binary protocol requests do not go through DJL's job queue, so they are admitted on their own:
+# AG_BINARY_THREADS in flight and AG_MAX_QUEUE_DEPTH queued, the rest shed, see autogluon_serving.admission
+binary_admission = AdmissionControl(BINARY_THREADS)
+
+async def predict_binary(body: bytes, selection: dict, timings: Timings):
+    deadline_ms = selection.get("deadline_ms")
+    async with binary_admission.admit(timings, float(deadline_ms) if deadline_ms is not None else None):
+        return await binary_admission.run(predict_binary_request, body, selection, timings)
+
+def predict_batch(frames: dict, models: dict, timings: dict, targets: dict) -> dict:
+    """Predict {batch_index: DataFrame} with one predictor call per model and input schema, isolating failures per request"""
+    # Only frames with identical columns and dtypes are merged so that one request
+    # cannot change how its neighbours' features are interpreted
+    groups = {}
+    for index, data in frames.items():
+        key = (targets[index], models[index], tuple(zip(data.columns, data.dtypes.astype(str))))
+        groups.setdefault(key, []).append(index)
+
+    results = {}
+    for (served, model_name, _), indices in groups.items():
+        batch_timings = Timings(count_errors=False)
+        try:
+            combined = pd.concat([frames[i] for i in indices], ignore_index=True)
+            prediction = predict(combined, model_name, batch_timings, served)
+        except Exception:
+            # Predict each request on its own so the failure stays with the request that caused it
+            for i in indices:
+                try:
+                    results[i] = predict(frames[i], model_name, timings[i], served)
+                except Exception as e:
+                    results[i] = e
+            continue
+        offset = 0
+        for i in indices:
+            # Every request in the group waited for the whole predictor call
+            timings[i].merge(batch_timings)
+            rows = len(frames[i])
+            results[i] = prediction.iloc[offset:offset + rows].reset_index(drop=True)
+            offset += rows
+    return results
+
+def encode_output(prediction: pd.DataFrame, inputs: Input):
+    """Encode predictions as Arrow/Parquet or JSON in the orient requested by the Accept header"""
+    accept = inputs.get_property("accept")
+    response_type = negotiate_columnar(accept)
+    if response_type is not None:
+        return encode_columnar(prediction, response_type), response_type
+    orient = negotiate_orient(accept)
+    if orient is None:
+        return prediction.to_json(), "application/json"
+    return encode_json(prediction, orient), "application/json"
+
+def add_output(outputs: Output, output, content_type: str, inputs: Input, timings: Timings, prefix: str = "", **kwargs):
+    """Add an encoded response, compressed when the request's Accept-Encoding allows it"""
+    if isinstance(output, str):
+        output = output.encode("utf-8")
+    with timings.stage("compress"):
+        output, encoding = compress(output, negotiate_encoding(inputs.get_property("accept-encoding")))
+    outputs.add(output, **kwargs)
+    outputs.add_property(f"{prefix}content-type", content_type)
+    if encoding is not None:
+        outputs.add_property(f"{prefix}content-encoding", encoding)
+    if SERVER_TIMING:
+        outputs.add_property(f"{prefix}server-timing", timings.server_timing())
+    return outputs
+
+def wants_stream(inputs: Input) -> bool:
+    """JSON Lines bodies, and CSV bodies sent with X-AG-Stream: true, are predicted in row chunks"""
+    content_type = media_type(inputs.get_property("content-type"))
+    if content_type in JSONL_CONTENT_TYPES:
+        return True
+    return content_type in STREAM_CONTENT_TYPES and (inputs.get_property("x-ag-stream") or "").lower() == "true"
+
+def predict_stream(inputs: Input, served: ServedModel):
+    """Parse, predict and serialize a large body chunk by chunk, never holding it all as a DataFrame"""
+    # The DJL frontend hands over the complete body, only the DataFrames and results are bounded
+    content_type = media_type(inputs.get_property("content-type"))
+    accept = media_type(inputs.get_property("accept"))
+    response_type = accept if accept in STREAM_CONTENT_TYPES else content_type
+    return b"".join(stream_predictions(BytesIO(inputs.get_as_bytes()), content_type, served.predict, response_type)), response_type
+
+def loading_output(error: ModelLoading) -> Output:
+    """503 response asking the client to retry once the target model has loaded"""
+    outputs = Output()
+    outputs.set_code(503)
+    outputs.set_message(str(error))
+    outputs.add(json.dumps({"error": str(error)}).encode("utf-8"))
+    outputs.add_property("content-type", "application/json")
+    outputs.add_property("retry-after", str(error.retry_after))
+    return outputs
+
+def handle(inputs: Input) -> Output:
+    if inputs.is_empty():
+        return None
+    started = time.perf_counter()
+    if not inputs.is_batch():
+        timings = Timings()
+        data = None
+        try:
+            served = served_model(inputs)
+            if wants_stream(inputs):
+                output, content_type = predict_stream(inputs, served)
+                outputs = add_output(Output(), output, content_type, inputs, timings)
+            else:
+                with timings.stage("decode"):
+                    data = decode_input(inputs, served)
+                model_name = select_model(inputs, data, started, served)
+                prediction = predict(data, model_name, timings, served)
+                with timings.stage("encode"):
+                    output, content_type = encode_output(prediction, inputs)
+                outputs = add_output(Output(), output, content_type, inputs, timings).add_property("x-ag-model", model_name)
+            if served.name is not None:
+                outputs.add_property("x-ag-target-model", served.name)
+        except ModelLoading as e:
+            timings.finish(None, failed=True)
+            return loading_output(e)
+        except Exception:
+            timings.finish(len(data) if data is not None else None, failed=True)
+            raise
+        timings.finish(len(data) if data is not None else None)
+        return outputs
+
+    # DJL dynamic batching: one Output entry per request, keyed by its batch index
+    frames = {}
+    models = {}
+    targets = {}
+    results = {}
+    streamed = {}
+    batches = inputs.get_batches()
+    timings = {i: Timings() for i in range(len(batches))}
+    for i, item in enumerate(batches):
+        try:
+            served = served_model(item)
+            if wants_stream(item):
+                streamed[i] = predict_stream(item, served)
+                continue
+            with timings[i].stage("decode"):
+                frames[i] = decode_input(item, served)
+            models[i] = select_model(item, frames[i], started, served)
+            targets[i] = served
+        except Exception as e:
+            frames.pop(i, None)
+            results[i] = e
+    results.update(predict_batch(frames, models, timings, targets))
+
+    outputs = Output()
+    for i in sorted(results.keys() | streamed.keys()):
+        result = results.get(i)
+        rows = len(frames[i]) if i in frames else None
+        if i in streamed:
+            output, content_type = streamed[i]
+        elif isinstance(result, Exception):
+            output, content_type = json.dumps({"error": str(result)}), "application/json"
+            if isinstance(result, ModelLoading):
+                outputs.add_property(f"batch_{i}_code", "503")
+                outputs.add_property(f"batch_{i}_retry-after", str(result.retry_after))
+            else:
+                outputs.add_property(f"batch_{i}_code", "400")
+            timings[i].finish(rows, failed=True)
+        else:
+            with timings[i].stage("encode"):
+                output, content_type = encode_output(result, batches[i])
+            outputs.add_property(f"batch_{i}_x-ag-model", models[i])
+            if targets[i].name is not None:
+                outputs.add_property(f"batch_{i}_x-ag-target-model", targets[i].name)
+        add_output(outputs, output, content_type, batches[i], timings[i], prefix=f"batch_{i}_", batch_index=i)
+        if not isinstance(result, Exception):
+            timings[i].finish(rows)
+    return outputs
+
+# Binary protocol requests are predicted on binary_admission's threads next to DJL's, see autogluon_serving.binary
+binary = BinaryServer.from_env(predict_binary)
+if binary is not None:
+    binary.start_in_thread()
@@ -1,56 +1,140 @@
 import mlflow
 import pandas as pd
-from autogluon.tabular import TabularPredictor
-from autogluon.core.utils import get_pred_from_proba_df
-from autogluon.core.constants import REGRESSION
+import pyarrow as pa
 import os
 import logging
+import time
+
+from autogluon_serving.metrics import current_timings
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# The container's model directory, watched for new model artifacts (the MLflow model's copy never changes)
+MODEL_PATH = os.environ.get("MODEL_PATH", "/opt/ml/model")
+
 class AutoGluonMLflowModel(mlflow.pyfunc.PythonModel):
     """MLflow wrapper for AutoGluon TabularPredictor"""
     
     def load_context(self, context):
-        """Load the AutoGluon model"""
-        model_path = context.artifacts["model"]
+        """Load and warm up the AutoGluon model, MLflow's /ping only succeeds once this returns"""
+        # AutoGluon (and torch) are imported here rather than with this module, which setup_mlflow_model.py
+        # imports to build the MLflow model without loading the predictor
+        start = time.perf_counter()
+        from autogluon.tabular import TabularPredictor
+        from autogluon_serving.compiled import install_compiled
+        from autogluon_serving.parallel import install_parallel
+        from autogluon_serving.prefork import WORKERS, persist_models
+        from autogluon_serving.reload import ModelReloader
+        from autogluon_serving.store import ModelStore, ServedModel
+        from autogluon_serving.threads import apply_thread_budget, configure_models
+        from autogluon_serving.warmup import warmup
+        timings = {"import": time.perf_counter() - start}
+
+        # Models built by setup_mlflow_model.py reference the extracted predictor, older ones copied it into their artifacts
+        model_path = (context.model_config or {}).get("model_path") or context.artifacts["model"]
         logger.info(f"Loading AutoGluon model from {model_path}")
-        self.model = TabularPredictor.load(model_path, require_py_version_match=False)
-        logger.info(f"Model loaded successfully. Problem type: {self.model.problem_type}")
-        logger.info(f"Features: {self.model.feature_metadata_in.get_features()}")
+        start = time.perf_counter()
+        model = TabularPredictor.load(model_path, require_py_version_match=False)
+        timings["load"] = time.perf_counter() - start
+        logger.info(f"Model loaded successfully in {timings['load']:.2f} s. Problem type: {model.problem_type}")
+        logger.info(f"Features: {model.feature_metadata_in.get_features()}")
+        start = time.perf_counter()
+        if WORKERS > 1:
+            # Loaded in the gunicorn parent, the forked workers share the persisted models
+            persist_models(model)
+        # Compiled on the first start with this model, and stored with the predictor for the next ones
+        install_compiled(model, save=True)
+        if WORKERS > 1:
+            # The warmup below runs in the gunicorn parent, where no thread pool may be started that the
+            # forked workers would not have: each worker applies its budget on startup, see worker_started
+            configure_models(model, 1)
+        else:
+            apply_thread_budget(model, WORKERS)
+        install_parallel(model)
+        timings["prepare"] = time.perf_counter() - start
+        start = time.perf_counter()
+        warmup(model)
+        timings["warmup"] = time.perf_counter() - start
+        logger.info(f"Warmup finished in {timings['warmup']:.2f} s")
+        # Requests read reloader.served once, a reload swaps in a new ServedModel between requests
+        self.reloader = ModelReloader(MODEL_PATH, ServedModel(model, model_path))
+        start = time.perf_counter()
+        self.reloader.served.selector.calibrate()
+        timings["calibrate"] = time.perf_counter() - start
+        logger.info(f"Model latency calibration finished in {timings['calibrate']:.2f} s")
+        if WORKERS <= 1:
+            # Under gunicorn every forked worker starts its own watcher, see autogluon_serving.gunicorn_conf
+            self.reloader.start()
+        # Models of AG_MODEL_STORE_DIR served next to this one, see autogluon_serving.store
+        self.store = ModelStore.from_env()
+        if self.store is not None:
+            self.store.load_pinned()
+        logger.info(f"Model ready, startup timings: {', '.join(f'{phase} {seconds:.2f} s' for phase, seconds in timings.items())}")
+    
+    def worker_started(self):
+        """Apply the thread budget of a gunicorn worker to the predictor loaded in its parent"""
+        from autogluon_serving.prefork import WORKERS
+        from autogluon_serving.threads import apply_thread_budget
+        apply_thread_budget(self.model, WORKERS)
+    
+    @property
+    def model(self):
+        """The AutoGluon predictor currently served"""
+        return self.reloader.served.predictor
     
-    def predict(self, context, model_input):
-        """Make predictions using the AutoGluon model"""
+    def served_model(self, params=None):
+        """The store model named by the target_model param, or the current model"""
+        target_model = (params or {}).get("target_model")
+        if not target_model:
+            return self.reloader.served
+        if self.store is None:
+            raise ValueError(f"Unknown target model '{target_model}', no model store configured (AG_MODEL_STORE_DIR)")
+        return self.store.get(target_model)
+    
+    def select_model(self, rows, params=None, elapsed_ms=0.0, served=None):
+        """Model selected by the model, tier or deadline_ms params"""
+        params = params or {}
+        deadline_ms = params.get("deadline_ms")
+        served = served if served is not None else self.reloader.served
+        return served.selector.select(
+            rows,
+            model=params.get("model"),
+            tier=params.get("tier"),
+            deadline_ms=float(deadline_ms) if deadline_ms is not None else None,
+            elapsed_ms=elapsed_ms,
+        )
+    
+    def predict(self, context, model_input, params=None):
+        """Make predictions using the AutoGluon model, or the member or store model selected by params"""
         try:
+            served = self.served_model(params)
             # Convert input to DataFrame if it's not already
             if not isinstance(model_input, pd.DataFrame):
-                if isinstance(model_input, dict):
-                    model_input = pd.DataFrame([model_input])
-                elif isinstance(model_input, list):
-                    model_input = pd.DataFrame(model_input)
-                else:
-                    model_input = pd.DataFrame(model_input)
+                with current_timings().stage("decode"):
+                    model_input = self._to_frame(model_input, served)
             
-            # Make predictions based on problem type
-            if self.model.problem_type != REGRESSION:
-                # Classification: return both predictions and probabilities
-                pred_proba = self.model.predict_proba(model_input, as_pandas=True)
-                pred = get_pred_from_proba_df(pred_proba, problem_type=self.model.problem_type)
-                
-                # Combine predictions and probabilities
-                pred_proba.columns = [str(c) + "_proba" for c in pred_proba.columns]
-                pred.name = str(pred.name) + "_pred" if pred.name is not None else "pred"
-                result = pd.concat([pred, pred_proba], axis=1)
-            else:
-                # Regression: return predictions only
-                result = self.model.predict(model_input, as_pandas=True)
-                if isinstance(result, pd.Series):
-                    result = result.to_frame()
-            
-            return result
+            model_name = self.select_model(len(model_input), params, served=served)
+            # Rows seen recently are served from the prediction cache, only the rest reach the predictor
+            return served.predict(model_input, model_name)
             
         except Exception as e:
             logger.error(f"Prediction error: {str(e)}")
-            raise e
\ No newline at end of file
+            raise e
+    
+    def _to_frame(self, model_input, served):
+        """DataFrame of any other input MLflow passes to predict"""
+        decoder = served.decoder
+        if isinstance(model_input, (pa.Table, pa.RecordBatch)):
+            # Arrow data converts column-wise without per-row Python objects
+            return model_input.to_pandas(split_blocks=True)
+        elif decoder is not None and isinstance(model_input, (dict, list)):
+            # Typed columns straight from the records, see autogluon_serving.decoding
+            return decoder.decode_json(model_input)
+        elif isinstance(model_input, dict):
+            return pd.DataFrame([model_input])
+        elif isinstance(model_input, list):
+            return pd.DataFrame(model_input)
+        else:
+            return pd.DataFrame(model_input)
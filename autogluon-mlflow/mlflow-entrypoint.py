@@ -18,6 +18,34 @@ import sys
 import os
 
 
+def scoring_server_command():
+    """MLflow's scoring server (wrapped to add Arrow/Parquet support) for the MLflow model"""
+    if int(os.environ.get("AG_WORKERS", "1")) > 1:
+        # Preload-then-fork: gunicorn loads the model once and forks AG_WORKERS workers sharing it
+        return [
+            "/opt/conda/bin/python", "-m", "gunicorn",
+            "-c", "python:autogluon_serving.gunicorn_conf",
+            "--pythonpath", "/opt/ml",
+            "--bind", "0.0.0.0:5000",
+            "scoring_app:app"
+        ]
+    return [
+        "/opt/conda/bin/python", "-m", "uvicorn", "scoring_app:app",
+        "--app-dir", "/opt/ml",
+        "--host", "0.0.0.0",
+        "--port", "5000"
+    ]
+
+
+def setup_mlflow_model():
+    """Extract the model and build (or reuse) its MLflow model, returning the MLflow model's path
+
+    The predictor itself is only loaded once, by the scoring server.
+    """
+    output = subprocess.check_output(["/opt/conda/bin/python", "/opt/ml/setup_mlflow_model.py"])
+    return output.decode("utf-8").strip().splitlines()[-1]
+
+
 if __name__ == "__main__":
     if len(sys.argv) > 1 and sys.argv[1] == "serve":
         # Change to the model directory for serving
@@ -28,19 +56,16 @@ if __name__ == "__main__":
         sys.path.insert(0, "/opt/ml/model")
         
         # Setup the MLflow model structure first
-        subprocess.check_call(["/opt/conda/bin/python", "/opt/ml/setup_mlflow_model.py"])
+        os.environ["AG_MLFLOW_MODEL_URI"] = setup_mlflow_model()
         
         # Set environment variable for MLflow to find the model
         os.environ["PYTHONPATH"] = "/opt/ml/model:" + os.environ.get("PYTHONPATH", "")
         
-        # Start MLflow model server using the native mlflow models serve command
-        os.execv("/opt/conda/bin/python", [
-            "/opt/conda/bin/python", "-m", "mlflow", "models", "serve",
-            "--model-uri", "/opt/ml/model/mlflow_model",
-            "--host", "0.0.0.0",
-            "--port", "5000",
-            "--no-conda"
-        ])
+        # Start MLflow's scoring server (wrapped to add Arrow/Parquet support) for the MLflow model
+        os.execv("/opt/conda/bin/python", scoring_server_command())
+    elif len(sys.argv) > 1 and sys.argv[1] == "batch":
+        # Offline batch transform straight from the AutoGluon model, e.g. batch --input-dir /data/in --output-dir /data/out
+        os.execv("/opt/conda/bin/python", ["/opt/conda/bin/python", "-m", "autogluon_serving.batch", "--model-dir", "/opt/ml/model"] + sys.argv[2:])
     elif len(sys.argv) > 1:
         # For other commands (like tests), don't change directory
         # This allows the test runner to work from the mounted directory
@@ -54,15 +79,9 @@ if __name__ == "__main__":
         import sys
         sys.path.insert(0, "/opt/ml/model")
         
-        subprocess.check_call(["/opt/conda/bin/python", "/opt/ml/setup_mlflow_model.py"])
+        os.environ["AG_MLFLOW_MODEL_URI"] = setup_mlflow_model()
         
         # Set environment variable for MLflow to find the model
         os.environ["PYTHONPATH"] = "/opt/ml/model:" + os.environ.get("PYTHONPATH", "")
         
-        os.execv("/opt/conda/bin/python", [
-            "/opt/conda/bin/python", "-m", "mlflow", "models", "serve",
-            "--model-uri", "/opt/ml/model/mlflow_model",
-            "--host", "0.0.0.0",
-            "--port", "5000",
-            "--no-conda"
-        ])
\ No newline at end of file
+        os.execv("/opt/conda/bin/python", scoring_server_command())
\ No newline at end of file
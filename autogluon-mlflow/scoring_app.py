@@ -0,0 +1,292 @@
+"""
+MLflow scoring server with Arrow IPC / Parquet support and negotiated response encoding on /invocations
+
+Wraps the app built by mlflow.pyfunc.scoring_server. CSV bodies and the dataframe_records and dataframe_split
+JSON envelopes are decoded into the predictor's feature types by autogluon_serving.decoding (other JSON
+envelopes are parsed by MLflow); with AG_SCHEMA_DECODING=false plain JSON and CSV requests are handled by
+MLflow unchanged. Arrow IPC stream and Parquet bodies are decoded straight into a DataFrame, predictions are
+returned as Arrow or Parquet when the Accept header asks for it, JSON predictions use the layout given by
+the Accept header's orient parameter, and responses are compressed when Accept-Encoding allows it.
+POST /invocations/stream predicts CSV and JSON Lines bodies of any size chunk by chunk while they are
+received and streams the predictions back. Requests that select a model with the model, tier or deadline_ms query parameters (or the X-AG-Model,
+X-AG-Tier and X-AG-Deadline-Ms headers) are predicted by that model, and requests naming a model of the model store
+with the target_model query parameter (or the X-AG-Target-Model header) by that one, or answered with 503 and
+Retry-After while it loads. GET /models lists the store's models with their memory use and load and hit counts.
+With AG_RELOAD_ENDPOINT=true, POST /reload loads the model directory's model again and swaps it in without dropping requests.
+/invocations requests over the admission limits (AG_MAX_IN_FLIGHT, AG_MAX_QUEUE_DEPTH) are answered with 429 or 503
+and Retry-After straight away, as are /invocations/stream requests beyond AG_MAX_STREAMS, see autogluon_serving.admission.
+GET /metrics serves per-stage latency, row count and error metrics in the Prometheus format, and with
+AG_SERVER_TIMING=true every /invocations response carries a Server-Timing header. With AG_PROFILING=true,
+GET /profile returns a CPU or allocation profile of the worker, see autogluon_serving.profiling.
+With AG_BINARY_PORT or AG_BINARY_SOCKET set, each worker also serves the length-prefixed Arrow protocol of
+autogluon_serving.binary on persistent connections, predicting like an Arrow /invocations request.
+"""
+
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import time
+
+import mlflow.pyfunc
+from mlflow.pyfunc import scoring_server
+from starlette.requests import Request
+from starlette.responses import Response
+
+from autogluon_serving.admission import AdmissionControl, Rejected
+from autogluon_serving.asgi import stream_response
+from autogluon_serving.binary import BinaryServer
+from autogluon_serving.decoding import SCHEMA_DECODING
+from autogluon_serving.metrics import CONTENT_TYPE_METRICS, SERVER_TIMING, Timings, render
+from autogluon_serving.formats import (
+    CONTENT_TYPE_ARROW,
+    CONTENT_TYPE_CSV,
+    CONTENT_TYPE_JSON,
+    compress,
+    decode_columnar,
+    decode_json,
+    encode_columnar,
+    encode_json,
+    is_columnar,
+    media_type,
+    negotiate_columnar,
+    negotiate_encoding,
+    negotiate_orient,
+)
+from autogluon_serving.prefork import WORKERS, preloading
+from autogluon_serving.profiling import TOKEN_HEADER, ProfilingError, capture_profile
+from autogluon_serving.reload import RELOAD_TOKEN_HEADER, ReloadInProgress, ReloadNotAllowed, check_reload_request
+from autogluon_serving.store import TARGET_MODEL_HEADER, TARGET_MODEL_PARAM, ModelLoading
+from autogluon_serving.streaming import STREAM_CONTENT_TYPES, is_streamable
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MODEL_URI = os.environ.get("AG_MLFLOW_MODEL_URI", "/opt/ml/model/mlflow_model")
+
+# Under gunicorn (AG_WORKERS > 1) this runs once in the parent, before the workers are forked
+with preloading():
+    model = mlflow.pyfunc.load_model(MODEL_URI)
+input_schema = model.metadata.get_input_schema()
+python_model = model.unwrap_python_model()
+app = scoring_server.init(model)
+if WORKERS > 1:
+    app.router.on_startup.append(python_model.worker_started)
+# Bounded /invocations requests in flight and queue, on their own executor, see autogluon_serving.admission
+admission = AdmissionControl.from_env()
+# Streams hold a slot of their own for as long as they last
+stream_admission = AdmissionControl.streams_from_env()
+
+SELECTION_PARAMS = (
+    ("model", "x-ag-model"),
+    ("tier", "x-ag-tier"),
+    ("deadline_ms", "x-ag-deadline-ms"),
+    (TARGET_MODEL_PARAM, TARGET_MODEL_HEADER),
+)
+
+
+def _admit(timings: Timings, selection: dict):
+    if admission is None:
+        return contextlib.nullcontext()
+    deadline_ms = selection.get("deadline_ms")
+    return admission.admit(timings, float(deadline_ms) if deadline_ms is not None else None)
+
+
+async def _run(fn, *args):
+    if admission is None:
+        return await asyncio.to_thread(fn, *args)
+    return await admission.run(fn, *args)
+
+
+def _decode_json(body: bytes, decoder):
+    payload = decode_json(body)
+    if decoder is not None and isinstance(payload, dict):
+        if "dataframe_records" in payload:
+            return decoder.records(payload["dataframe_records"])
+        if "dataframe_split" in payload:
+            split = payload["dataframe_split"]
+            return decoder.split(split["columns"], split["data"])
+    # MLflow's other JSON envelopes (instances, inputs)
+    return scoring_server.infer_and_parse_data(payload, input_schema)
+
+
+def _predict_encoded(body: bytes, content_type: str, response_type: str, orient: str, selection: dict, timings: Timings):
+    # The store model the request targets, or the current model, for the whole request
+    served = python_model.served_model(selection)
+    with timings.stage("decode"):
+        if is_columnar(content_type):
+            data = decode_columnar(body, content_type)
+        elif content_type == CONTENT_TYPE_CSV:
+            if served.decoder is not None:
+                data = served.decoder.decode_csv(body)
+            else:
+                data = scoring_server.parse_csv_input(io.StringIO(body.decode("utf-8")), schema=input_schema)
+        else:
+            data = _decode_json(body, served.decoder)
+    model_name = python_model.select_model(len(data), selection, (time.perf_counter() - timings.started) * 1000, served)
+    with timings.activate():
+        prediction = served.predict(data, model_name)
+    with timings.stage("encode"):
+        if response_type is None:
+            content = encode_json(prediction, orient, envelope={})
+        else:
+            content = encode_columnar(prediction, response_type)
+    return content, response_type or CONTENT_TYPE_JSON, model_name, served, len(data)
+
+
+@app.middleware("http")
+async def columnar_invocations(request: Request, call_next):
+    if request.url.path != "/invocations" or request.method != "POST":
+        return await call_next(request)
+    timings = Timings()
+    selection = {
+        name: request.query_params.get(name) or request.headers.get(header)
+        for name, header in SELECTION_PARAMS
+        if request.query_params.get(name) or request.headers.get(header)
+    }
+    content_type = media_type(request.headers.get("content-type"))
+    accept = request.headers.get("accept")
+    response_type = negotiate_columnar(accept)
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+    try:
+        orient = negotiate_orient(accept)
+    except ValueError as e:
+        return Response(json.dumps({"error_code": "BAD_REQUEST", "message": str(e)}), status_code=400, media_type=CONTENT_TYPE_JSON)
+    decoded = SCHEMA_DECODING and content_type in (CONTENT_TYPE_CSV, CONTENT_TYPE_JSON)
+    plain = not is_columnar(content_type) and not decoded and response_type is None and orient is None and encoding is None and not selection
+    body = None if plain else await request.body()
+    try:
+        async with _admit(timings, selection):
+            if plain:
+                # Plain requests without schema decoding keep MLflow's own handling, its predict call still records the
+                # prediction stages (the context, and with it the timings, is copied to its worker thread)
+                with timings.activate():
+                    response = await call_next(request)
+            else:
+                content, result_type, model_name, served, rows = await _run(
+                    _predict_encoded, body, content_type, response_type, orient, selection, timings
+                )
+    except Rejected as e:
+        timings.finish(None, failed=True)
+        content = json.dumps({"error_code": "TEMPORARILY_UNAVAILABLE" if e.status_code == 503 else "REQUEST_LIMIT_EXCEEDED", "message": str(e)})
+        return Response(content, status_code=e.status_code, media_type=CONTENT_TYPE_JSON, headers={"Retry-After": str(e.retry_after)})
+    except ModelLoading as e:
+        timings.finish(None, failed=True)
+        content = json.dumps({"error_code": "TEMPORARILY_UNAVAILABLE", "message": str(e)})
+        return Response(content, status_code=503, media_type=CONTENT_TYPE_JSON, headers={"Retry-After": str(e.retry_after)})
+    except Exception as e:
+        logger.error(f"Prediction error: {e}")
+        timings.finish(None, failed=True)
+        return Response(json.dumps({"error_code": "BAD_REQUEST", "message": str(e)}), status_code=400, media_type=CONTENT_TYPE_JSON)
+    if plain:
+        timings.finish(None, failed=response.status_code >= 400)
+        if SERVER_TIMING:
+            response.headers["Server-Timing"] = timings.server_timing()
+        return response
+    with timings.stage("compress"):
+        content, encoding = await asyncio.to_thread(compress, content, encoding)
+    timings.finish(rows)
+    headers = {"Vary": "Accept, Accept-Encoding", "X-AG-Model": model_name}
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    if served.name is not None:
+        headers["X-AG-Target-Model"] = served.name
+    if SERVER_TIMING:
+        headers["Server-Timing"] = timings.server_timing()
+    return Response(content, media_type=result_type, headers=headers)
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prediction path metrics in the Prometheus text format, summed over all workers"""
+    return Response(await asyncio.to_thread(render), media_type=CONTENT_TYPE_METRICS)
+
+
+@app.get("/models")
+async def models():
+    """Models of the model store with their state, memory use and load, hit and eviction counts"""
+    store = python_model.store
+    if store is None:
+        message = "No model store configured (AG_MODEL_STORE_DIR)"
+        return Response(json.dumps({"error_code": "RESOURCE_DOES_NOT_EXIST", "message": message}), status_code=404, media_type=CONTENT_TYPE_JSON)
+    return Response(json.dumps(await asyncio.to_thread(store.stats)), media_type=CONTENT_TYPE_JSON)
+
+
+@app.post("/invocations/stream")
+async def invocations_stream(request: Request):
+    """Predict a CSV or JSON Lines body in row chunks, returning CSV or JSON Lines (per Accept) with chunked encoding"""
+    content_type = media_type(request.headers.get("content-type"))
+    if not is_streamable(content_type):
+        message = f"{content_type} input content type not supported for streaming, expected one of {STREAM_CONTENT_TYPES}"
+        return Response(json.dumps({"error_code": "BAD_REQUEST", "message": message}), status_code=415, media_type=CONTENT_TYPE_JSON)
+    accept = media_type(request.headers.get("accept"))
+    response_type = accept if accept in STREAM_CONTENT_TYPES else content_type
+    target_model = request.query_params.get(TARGET_MODEL_PARAM) or request.headers.get(TARGET_MODEL_HEADER)
+    try:
+        served = await asyncio.to_thread(python_model.served_model, {TARGET_MODEL_PARAM: target_model})
+    except ModelLoading as e:
+        content = json.dumps({"error_code": "TEMPORARILY_UNAVAILABLE", "message": str(e)})
+        return Response(content, status_code=503, media_type=CONTENT_TYPE_JSON, headers={"Retry-After": str(e.retry_after)})
+    except ValueError as e:
+        return Response(json.dumps({"error_code": "BAD_REQUEST", "message": str(e)}), status_code=400, media_type=CONTENT_TYPE_JSON)
+    try:
+        return await stream_response(request, content_type, served.predict, response_type, stream_admission)
+    except Rejected as e:
+        content = json.dumps({"error_code": "REQUEST_LIMIT_EXCEEDED", "message": str(e)})
+        return Response(content, status_code=e.status_code, media_type=CONTENT_TYPE_JSON, headers={"Retry-After": str(e.retry_after)})
+
+
+# MLflow error codes of the statuses /reload and /profile refuse requests with
+_ERROR_CODES = {400: "BAD_REQUEST", 403: "PERMISSION_DENIED", 404: "ENDPOINT_NOT_FOUND", 409: "RESOURCE_CONFLICT"}
+
+
+@app.post("/reload")
+async def reload(request: Request):
+    """Load the model directory's model again and swap it in once warmed up, requests are served by the previous one meanwhile
+
+    With several workers only the worker answering reloads, the others pick the model up through the watcher.
+    404 unless AG_RELOAD_ENDPOINT is enabled, 403 without the AG_RELOAD_TOKEN token if one is set.
+    """
+    try:
+        check_reload_request(request.headers.get(RELOAD_TOKEN_HEADER))
+    except ReloadNotAllowed as e:
+        content = json.dumps({"error_code": _ERROR_CODES[e.status_code], "message": str(e)})
+        return Response(content, status_code=e.status_code, media_type=CONTENT_TYPE_JSON)
+    try:
+        stats = await asyncio.to_thread(python_model.reloader.reload)
+    except ReloadInProgress as e:
+        return Response(json.dumps({"error_code": "RESOURCE_CONFLICT", "message": str(e)}), status_code=409, media_type=CONTENT_TYPE_JSON)
+    except Exception as e:
+        logger.error(f"Model reload failed: {e}")
+        content = json.dumps({"error_code": "INTERNAL_ERROR", "message": str(e), **python_model.reloader.stats()})
+        return Response(content, status_code=500, media_type=CONTENT_TYPE_JSON)
+    return Response(json.dumps(stats), media_type=CONTENT_TYPE_JSON)
+
+
+@app.get("/profile")
+async def profile(request: Request):
+    """CPU or allocation profile of this worker over the next seconds, 404 unless AG_PROFILING is enabled"""
+    try:
+        content, content_type, headers = await asyncio.to_thread(capture_profile, request.query_params, request.headers.get(TOKEN_HEADER))
+    except ProfilingError as e:
+        content = json.dumps({"error_code": _ERROR_CODES.get(e.status_code, "INTERNAL_ERROR"), "message": str(e)})
+        return Response(content, status_code=e.status_code, media_type=CONTENT_TYPE_JSON)
+    return Response(content, media_type=content_type, headers=headers)
+
+
+async def _predict_binary(body, selection: dict, timings: Timings):
+    async with _admit(timings, selection):
+        content, _, model_name, served, rows = await _run(_predict_encoded, body, CONTENT_TYPE_ARROW, CONTENT_TYPE_ARROW, None, selection, timings)
+    metadata = {"model": model_name}
+    if served.name is not None:
+        metadata["target_model"] = served.name
+    return content, rows, metadata
+
+
+# Listens in each worker's event loop, see autogluon_serving.binary
+binary = BinaryServer.from_env(_predict_binary)
+if binary is not None:
+    app.router.on_startup.append(binary.start)
+    app.router.on_shutdown.append(binary.stop)
@@ -1,154 +1,71 @@
 #!/usr/bin/env python3
 """
 Setup script to prepare AutoGluon model for MLflow serving
+
+The MLflow model only wraps the predictor, so building it needs neither the predictor nor AutoGluon:
+the predictor is extracted through the model cache, its AutoGluon version is read from version.txt,
+and the MLflow model references the extracted predictor through its model_config instead of copying
+it into its artifacts. MLflow models are kept in AG_MODEL_CACHE_DIR/mlflow, keyed by the predictor's
+files and the wrapper's code, so a restart with the same model reuses the one built before. The
+scoring server's load_context is then the only place the predictor is loaded (and its tree members
+compiled, see autogluon_serving.compiled).
+
+Prints the MLflow model's path on stdout and logs the time taken by each phase.
 """
 
+import hashlib
+import json
+import logging
 import os
-import tarfile
 import shutil
-import mlflow
-import mlflow.pyfunc
-import pandas as pd
-from autogluon.tabular import TabularPredictor
-import logging
+import sys
+import time
+
+from autogluon_serving.extract import MODEL_CACHE_DIR, PREDICTOR_FILES, is_extracted_model, prepare_model
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def extract_and_setup_model():
-    """Extract AutoGluon model and create MLflow model structure"""
-    
-    # Ensure imports are available (defensive programming)
-    import shutil
-    import os
-    
-    model_dir = "/opt/ml/model"
-    extracted_dir = "/opt/ml/model/extracted_model"
-    mlflow_model_dir = "/opt/ml/model/mlflow_model"
-    
-    # Check if MLflow model is already set up and valid
-    if os.path.exists(mlflow_model_dir):
-        mlmodel_file = os.path.join(mlflow_model_dir, "MLmodel")
-        if os.path.exists(mlmodel_file):
-            logger.info("Valid MLflow model already exists, skipping setup")
-            return
-        else:
-            logger.info("MLflow model directory exists but is incomplete, attempting cleanup...")
-            try:
-                # Try to remove the directory
-                shutil.rmtree(mlflow_model_dir)
-                logger.info("Cleanup successful")
-            except (OSError, PermissionError) as e:
-                logger.warning(f"Cannot cleanup directory (read-only filesystem?): {e}")
-                logger.info("Continuing with setup in a different location...")
-                # Use a different directory name to avoid conflicts
-                import time
-                mlflow_model_dir = f"/opt/ml/model/mlflow_model_{int(time.time())}"
-    
-    # Check if model is already extracted
-    if not os.path.exists(extracted_dir):
-        # Look for the model tar file in various locations
-        model_file = None
-        
-        # First, check for direct tar.gz files
-        for filename in os.listdir(model_dir):
-            if filename.endswith('.tar.gz') and 'model' in filename:
-                model_file = os.path.join(model_dir, filename)
-                break
-        
-        # If not found, check inside subdirectories (nested structure)
-        if not model_file:
-            for item in os.listdir(model_dir):
-                item_path = os.path.join(model_dir, item)
-                if os.path.isdir(item_path) and not item.startswith('.'):
-                    # Look inside subdirectories
-                    try:
-                        for subfile in os.listdir(item_path):
-                            if subfile.endswith('.tar.gz') and 'model' in subfile:
-                                model_file = os.path.join(item_path, subfile)
-                                logger.info(f"Found model file in subdirectory: {model_file}")
-                                break
-                        if model_file:
-                            break
-                    except (OSError, PermissionError):
-                        continue
-        
-        if not model_file:
-            logger.error(f"No model tar.gz file found in {model_dir}")
-            logger.error(f"Directory contents: {os.listdir(model_dir)}")
-            # Try to list subdirectory contents for debugging
-            for item in os.listdir(model_dir):
-                item_path = os.path.join(model_dir, item)
-                if os.path.isdir(item_path):
-                    try:
-                        logger.error(f"Contents of {item}: {os.listdir(item_path)}")
-                    except:
-                        pass
-            raise FileNotFoundError(f"No model tar.gz file found in {model_dir}. Files: {os.listdir(model_dir)}")
-        
-        logger.info(f"Extracting model from {model_file}")
-        
-        # Extract the model
-        os.makedirs(extracted_dir, exist_ok=True)
-        with tarfile.open(model_file, 'r:gz') as tar:
-            tar.extractall(extracted_dir)
-        
-        # Try to remove the tar file to save space (skip if read-only)
-        try:
-            os.remove(model_file)
-            logger.info("Removed original tar file to save space")
-        except (OSError, PermissionError):
-            logger.info("Cannot remove tar file (read-only filesystem) - continuing")
-    
-    # Load the model to get metadata
-    logger.info(f"Loading AutoGluon model from {extracted_dir}")
-    
-    # Find the actual model directory (might be nested)
-    model_path = extracted_dir
-    if os.path.exists(os.path.join(extracted_dir, "mlflow_model")):
-        # If there's already an mlflow_model directory, look for the actual model
-        for item in os.listdir(extracted_dir):
-            item_path = os.path.join(extracted_dir, item)
-            if os.path.isdir(item_path) and item != "mlflow_model":
-                # Check if this looks like an AutoGluon model directory
-                if any(f.endswith('.pkl') or f == 'predictor.pkl' for f in os.listdir(item_path)):
-                    model_path = item_path
-                    break
-    
-    logger.info(f"Loading model from: {model_path}")
-    logger.info(f"Contents: {os.listdir(model_path)}")
-    
+MODEL_DIR = "/opt/ml/model"
+MODEL_CODE = "/opt/ml/autogluon_model.py"
+MLFLOW_CACHE_DIR = os.path.join(MODEL_CACHE_DIR, "mlflow")
+
+
+def autogluon_version(model_path):
+    """AutoGluon version the predictor was saved with, without loading it"""
+    try:
+        with open(os.path.join(model_path, "version.txt")) as f:
+            return f.read().strip()
+    except OSError:
+        pass
     try:
-        model = TabularPredictor.load(model_path, require_py_version_match=False)
-    except Exception as e:
-        logger.error(f"Failed to load model from {model_path}: {e}")
-        # Try to find the model in subdirectories
-        for root, dirs, files in os.walk(extracted_dir):
-            if 'predictor.pkl' in files or any(f.endswith('.pkl') for f in files):
-                logger.info(f"Found potential model directory: {root}")
-                try:
-                    model = TabularPredictor.load(root, require_py_version_match=False)
-                    model_path = root
-                    break
-                except:
-                    continue
-        else:
-            raise e
-    
-    # Create MLflow model
-    logger.info("Creating MLflow model structure")
-    
-    # Copy the autogluon_model.py to the model directory so MLflow can find it
-    import shutil
-    shutil.copy("/opt/ml/autogluon_model.py", "/opt/ml/model/autogluon_model.py")
-    
-    # Import the custom model class
-    import sys
-    sys.path.append('/opt/ml/model')
+        with open(os.path.join(model_path, "metadata.json")) as f:
+            return json.load(f)["version"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def mlflow_model_key(model_path, code_path):
+    """Key of the MLflow model wrapping model_path: the predictor's location and files, and the wrapper's code"""
+    digest = hashlib.sha256(os.path.realpath(model_path).encode("utf-8"))
+    for name in PREDICTOR_FILES:
+        stat = os.stat(os.path.join(model_path, name))
+        digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+    with open(code_path, "rb") as f:
+        digest.update(f.read())
+    return digest.hexdigest()
+
+
+def build_mlflow_model(model_path, target, code_path):
+    """Save an MLflow pyfunc model serving the predictor in model_path to target"""
+    # Only imported when a model is built, a cache hit starts the server without them
+    import mlflow.pyfunc
+
+    sys.path.insert(0, os.path.dirname(code_path))
     from autogluon_model import AutoGluonMLflowModel
-    
-    # Create conda environment specification
+
+    version = autogluon_version(model_path)
     conda_env = {
         'channels': ['defaults', 'conda-forge'],
         'dependencies': [
@@ -157,7 +74,7 @@ def extract_and_setup_model():
             {
                 'pip': [
                     'mlflow',
-                    f'autogluon=={model._trainer.version}' if hasattr(model._trainer, 'version') else 'autogluon>=1.3.1',
+                    f'autogluon=={version}' if version else 'autogluon>=1.3.1',
                     'pandas',
                     'numpy',
                     'scikit-learn'
@@ -166,57 +83,55 @@ def extract_and_setup_model():
         ],
         'name': 'autogluon_env'
     }
-    
-    # Create sample input for signature inference
+    # Saved next to target and renamed, so that a concurrent or interrupted build is never picked up
+    staging = f"{target}.tmp-{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    mlflow.pyfunc.save_model(
+        path=staging,
+        python_model=AutoGluonMLflowModel(),
+        model_config={"model_path": model_path},
+        conda_env=conda_env,
+        code_paths=[code_path],
+    )
     try:
-        feature_names = model.feature_metadata_in.get_features()
-        logger.info(f"Model features: {feature_names}")
-        
-        # Create a more realistic sample input based on feature types
-        sample_input = {}
-        for feature in feature_names:
-            # Use a simple default value - MLflow will handle type inference
-            sample_input[feature] = 0
-        
-        sample_df = pd.DataFrame([sample_input])
-        logger.info(f"Sample input created: {sample_df.dtypes}")
-        
-        # Save the MLflow model without signature first (to avoid inference issues)
-        logger.info("Saving MLflow model...")
-        mlflow.pyfunc.save_model(
-            path=mlflow_model_dir,
-            python_model=AutoGluonMLflowModel(),
-            artifacts={"model": model_path},
-            conda_env=conda_env,
-            code_paths=["/opt/ml/model/autogluon_model.py"]
-            # Skip signature for now to avoid issues
-        )
-        
-    except Exception as e:
-        logger.error(f"Error during model saving: {e}")
-        # Try saving without signature as fallback
-        logger.info("Attempting fallback model save without signature...")
-        mlflow.pyfunc.save_model(
-            path=mlflow_model_dir,
-            python_model=AutoGluonMLflowModel(),
-            artifacts={"model": model_path},
-            conda_env=conda_env,
-            code_paths=["/opt/ml/model/autogluon_model.py"]
-        )
-    
-    logger.info(f"MLflow model saved to {mlflow_model_dir}")
-    logger.info(f"Model features: {feature_names}")
-    logger.info(f"Problem type: {model.problem_type}")
-    
-    # Validate the MLflow model was created correctly
-    mlmodel_file = os.path.join(mlflow_model_dir, "MLmodel")
-    if os.path.exists(mlmodel_file):
-        logger.info("✅ MLflow model validation successful - MLmodel file exists")
-        with open(mlmodel_file, 'r') as f:
-            logger.info(f"MLmodel contents preview: {f.read()[:200]}...")
+        os.rename(staging, target)
+    except OSError:
+        # Another process built the same model first
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def extract_and_setup_model():
+    """Extract the AutoGluon model and return the path of an MLflow model serving it"""
+    start = time.perf_counter()
+    timings = {}
+
+    # An MLflow model shipped with the model artifact is served as is
+    shipped = os.path.join(MODEL_DIR, "mlflow_model")
+    if os.path.exists(os.path.join(shipped, "MLmodel")):
+        logger.info(f"Serving the MLflow model in {shipped}")
+        return shipped
+
+    # Reuse a model extracted by a previous version of this script, otherwise go through
+    # the content-addressed extraction cache (which also handles pre-extracted models)
+    model_path = os.path.join(MODEL_DIR, "extracted_model")
+    if not is_extracted_model(model_path):
+        model_path, timings = prepare_model(MODEL_DIR)
+    logger.info(f"AutoGluon {autogluon_version(model_path)} model in {model_path}")
+
+    key = mlflow_model_key(model_path, MODEL_CODE)
+    target = os.path.join(MLFLOW_CACHE_DIR, key)
+    if os.path.exists(os.path.join(target, "MLmodel")):
+        logger.info(f"Reusing the MLflow model in {target}")
     else:
-        logger.error("❌ MLflow model validation failed - MLmodel file missing")
-        raise FileNotFoundError(f"MLmodel file not created at {mlmodel_file}")
+        build_start = time.perf_counter()
+        os.makedirs(MLFLOW_CACHE_DIR, exist_ok=True)
+        build_mlflow_model(model_path, target, MODEL_CODE)
+        timings["build"] = time.perf_counter() - build_start
+        logger.info(f"MLflow model saved to {target}")
+    timings["total"] = time.perf_counter() - start
+    logger.info(f"MLflow model setup timings: {', '.join(f'{phase} {seconds:.2f} s' for phase, seconds in timings.items())}")
+    return target
+
 
 if __name__ == "__main__":
-    extract_and_setup_model()
\ No newline at end of file
+    print(extract_and_setup_model())
@@ -0,0 +1 @@
+"""Serving helpers shared by the BentoML, DJLServing and MLflow AutoGluon runtimes"""
@@ -0,0 +1,167 @@
+"""Admission control for the async runtimes: a bounded number of requests in flight and a bounded queue
+
+Without it, every request accepted by the server is decoded and predicted right away, so under
+overload all of them slow down together until they hit the server's timeout. Here each worker
+process serves at most ``AG_MAX_IN_FLIGHT`` prediction requests at a time, on an executor of as
+many threads kept for them. Up to ``AG_MAX_QUEUE_DEPTH`` more wait for a slot, in arrival order, and
+the rest are shed straight away instead of timing out:
+
+- a full queue is answered with ``429``
+- a request whose deadline (``deadline_ms`` / ``X-AG-Deadline-Ms``, or ``AG_DEFAULT_DEADLINE_MS``)
+  cannot be met given the requests ahead of it is answered with ``503`` without queueing, and one
+  still waiting when its deadline or ``AG_MAX_QUEUE_WAIT_MS`` has passed is answered with ``503``
+
+Both carry a ``Retry-After`` of the time the queue is expected to take to drain, from the average
+time a request holds its slot. ``AG_MAX_IN_FLIGHT=0`` disables admission control.
+
+Streaming requests hold their slot until their last chunk is sent, which can take minutes, so they
+are admitted separately: at most ``AG_MAX_STREAMS`` per worker process, without a queue. Further
+streams are answered with ``429`` straight away. ``AG_MAX_STREAMS=0`` disables the limit.
+"""
+
+import asyncio
+import contextvars
+import functools
+import logging
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+from autogluon_serving.metrics import REJECTED, Timings
+from autogluon_serving.selection import DEFAULT_DEADLINE_MS
+
+logger = logging.getLogger(__name__)
+
+# Prediction requests served at once by a worker process, 0 disables admission control
+MAX_IN_FLIGHT = int(os.environ.get("AG_MAX_IN_FLIGHT", "64"))
+MAX_QUEUE_DEPTH = int(os.environ.get("AG_MAX_QUEUE_DEPTH", "128"))
+MAX_QUEUE_WAIT_MS = float(os.environ.get("AG_MAX_QUEUE_WAIT_MS", "5000"))
+# Streaming requests served at once by a worker process, 0 disables the limit
+MAX_STREAMS = int(os.environ.get("AG_MAX_STREAMS", "4"))
+# Weight of the latest request in the average time a slot is held
+_SERVICE_TIME_WEIGHT = 0.1
+
+
+class Rejected(RuntimeError):
+    """A request shed by admission control, answered with status_code and a Retry-After of retry_after seconds"""
+
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AdmissionControl:
+    """Slots for the requests a worker serves at once, a bounded queue for them and the executor they run on"""
+
+    def __init__(self, max_in_flight: int, max_queue_depth: int = MAX_QUEUE_DEPTH, max_queue_wait_ms: float = MAX_QUEUE_WAIT_MS):
+        self.max_in_flight = max_in_flight
+        self.max_queue_depth = max_queue_depth
+        self.max_queue_wait_s = max_queue_wait_ms / 1000
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = {"queue_full": 0, "deadline": 0, "queue_timeout": 0}
+        # Average time a request holds its slot, unknown until the first one finishes
+        self.service_s: Optional[float] = None
+        self._semaphore = None
+        self._executor = None
+        self._pid = None
+
+    @classmethod
+    def from_env(cls) -> Optional["AdmissionControl"]:
+        """Admission control configured by AG_MAX_IN_FLIGHT, None when it is disabled"""
+        if MAX_IN_FLIGHT <= 0:
+            return None
+        logger.info(f"Admission control: {MAX_IN_FLIGHT} requests in flight, {MAX_QUEUE_DEPTH} queued for at most {MAX_QUEUE_WAIT_MS:g} ms")
+        return cls(MAX_IN_FLIGHT)
+
+    @classmethod
+    def streams_from_env(cls) -> Optional["AdmissionControl"]:
+        """Admission control of streaming requests configured by AG_MAX_STREAMS, None when it is disabled"""
+        if MAX_STREAMS <= 0:
+            return None
+        logger.info(f"Stream admission control: {MAX_STREAMS} streams in flight")
+        return cls(MAX_STREAMS, max_queue_depth=0)
+
+    def _setup(self):
+        # Created in the worker serving requests, a preloading parent's threads do not survive the fork
+        if self._pid != os.getpid():
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+            self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="autogluon-inference")
+            self._pid = os.getpid()
+
+    def expected_wait(self, position: int) -> float:
+        """Seconds until the request at position in the queue (1 for the first) gets a slot"""
+        service_s = self.service_s if self.service_s is not None else 0.0
+        return math.ceil(position / self.max_in_flight) * service_s
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.expected_wait(self.waiting + 1)))
+
+    def _reject(self, reason: str, message: str, status_code: int):
+        self.rejected[reason] += 1
+        REJECTED.inc(reason)
+        raise Rejected(message, status_code, self.retry_after())
+
+    async def _acquire(self, deadline_ms: Optional[float], started: float):
+        if not self._semaphore.locked():
+            await self._semaphore.acquire()
+            return
+        if self.waiting >= self.max_queue_depth:
+            self._reject("queue_full", f"Too many requests, {self.waiting} already queued", 429)
+        timeout = self.max_queue_wait_s
+        if deadline_ms is not None:
+            remaining = deadline_ms / 1000 - (time.perf_counter() - started)
+            if self.expected_wait(self.waiting + 1) > remaining:
+                self._reject("deadline", f"Deadline of {deadline_ms:g} ms cannot be met behind {self.waiting} queued requests", 503)
+            timeout = min(timeout, remaining)
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), max(timeout, 0.0))
+        except asyncio.TimeoutError:
+            self._reject("queue_timeout", f"No capacity within {timeout * 1000:.0f} ms", 503)
+        finally:
+            self.waiting -= 1
+
+    @asynccontextmanager
+    async def admit(self, timings: Timings, deadline_ms: Optional[float] = None):
+        """Hold a slot for the request while the block runs; raises Rejected when it is shed
+
+        The wait for a slot is timed as the request's ``queue`` stage, deadline_ms counts from the
+        start of timings.
+        """
+        self._setup()
+        deadline_ms = deadline_ms if deadline_ms is not None else DEFAULT_DEADLINE_MS
+        with timings.stage("queue"):
+            await self._acquire(deadline_ms, timings.started)
+        self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+            elapsed = time.perf_counter() - start
+            if self.service_s is None:
+                self.service_s = elapsed
+            else:
+                self.service_s += _SERVICE_TIME_WEIGHT * (elapsed - self.service_s)
+
+    async def run(self, fn, *args):
+        """Run fn(*args) on the inference executor, in the caller's context like asyncio.to_thread"""
+        self._setup()
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(context.run, fn, *args))
+
+    def stats(self) -> Dict:
+        return {
+            "max_in_flight": self.max_in_flight,
+            "max_queue_depth": self.max_queue_depth,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "service_ms": self.service_s * 1000 if self.service_s is not None else None,
+            "rejected": dict(self.rejected),
+        }
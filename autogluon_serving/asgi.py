@@ -0,0 +1,54 @@
+"""Starlette helpers shared by the ASGI runtimes (BentoML, MLflow)"""
+
+import asyncio
+import contextlib
+from typing import Callable, Optional
+
+import pandas as pd
+from starlette.requests import Request
+from starlette.responses import StreamingResponse
+
+from autogluon_serving.admission import AdmissionControl
+from autogluon_serving.metrics import Timings
+from autogluon_serving.streaming import QueueReader, feed_async, stream_predictions
+
+
+class RequestStreamingResponse(StreamingResponse):
+    """StreamingResponse sent while the request body is still being read"""
+
+    def __init__(self, content, reading: asyncio.Task, slot: contextlib.AsyncExitStack, **kwargs):
+        super().__init__(content, **kwargs)
+        self._reading = reading
+        self._slot = slot
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self._slot.aclose()
+
+    async def listen_for_disconnect(self, receive):
+        # receive() belongs to the body reader until the whole body is in, a concurrent
+        # disconnect listener would swallow its chunks
+        await asyncio.wait({self._reading})
+        await super().listen_for_disconnect(receive)
+
+
+async def stream_response(
+    request: Request,
+    content_type: str,
+    predict_fn: Callable[[pd.DataFrame], pd.DataFrame],
+    response_type: str,
+    admission: Optional[AdmissionControl] = None,
+) -> StreamingResponse:
+    """Predict a CSV or JSON Lines request body chunk by chunk while it is received, streaming the predictions back
+
+    With admission, the stream holds one of its slots until the response ends, raises Rejected when it is shed.
+    """
+    slot = contextlib.AsyncExitStack()
+    if admission is not None:
+        await slot.enter_async_context(admission.admit(Timings()))
+    reader = QueueReader()
+    reading = asyncio.create_task(feed_async(request.stream(), reader))
+    chunks = stream_predictions(reader, content_type, predict_fn, response_type)
+    return RequestStreamingResponse(chunks, reading, slot, media_type=response_type)
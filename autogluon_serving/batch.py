@@ -0,0 +1,222 @@
+"""Offline batch transform: score every CSV, Parquet and JSON Lines file under a directory
+
+    python -m autogluon_serving.batch --input-dir /data/in --output-dir /data/out
+
+Each input file gets an output file of the same format and relative path holding the predictions.
+Files are scored in a pool of worker processes forked from a parent that loaded the predictor once,
+and read in chunks of ``--chunk-rows`` rows (Parquet through a memory map). Outputs are written to a
+temporary file and renamed when complete, so a restarted run skips the files that are already
+done. A throughput summary is printed at the end.
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from typing import Dict, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from autogluon.tabular import TabularPredictor
+
+from autogluon_serving.compiled import install_compiled
+from autogluon_serving.extract import prepare_model
+from autogluon_serving.formats import CONTENT_TYPE_CSV
+from autogluon_serving.predict import predict_frame
+from autogluon_serving.prefork import after_fork, before_fork, persist_models, preloading
+from autogluon_serving.streaming import CONTENT_TYPE_JSONL, read_frames
+from autogluon_serving.threads import apply_thread_budget, available_cpus
+
+logger = logging.getLogger(__name__)
+
+BATCH_CHUNK_ROWS = int(os.environ.get("AG_BATCH_CHUNK_ROWS", "50000"))
+_PARTIAL_SUFFIX = ".partial"
+_FORMATS = {".csv": "csv", ".parquet": "parquet", ".pq": "parquet", ".jsonl": "jsonl", ".ndjson": "jsonl"}
+
+# Set in the parent before the pool forks, so every worker shares the same loaded predictor
+_predictor = None
+_model_name: Optional[str] = None
+
+
+def find_inputs(input_dir: str) -> List[str]:
+    """Relative paths of the supported files under input_dir, largest first for better load balancing"""
+    paths = []
+    for root, _, files in os.walk(input_dir):
+        for filename in files:
+            if os.path.splitext(filename)[1].lower() in _FORMATS:
+                paths.append(os.path.relpath(os.path.join(root, filename), input_dir))
+    return sorted(paths, key=lambda p: -os.path.getsize(os.path.join(input_dir, p)))
+
+
+def is_done(input_path: str, output_path: str) -> bool:
+    """An output renamed into place after the input was last modified is complete"""
+    return os.path.exists(output_path) and os.path.getmtime(output_path) >= os.path.getmtime(input_path)
+
+
+def _predict(data: pd.DataFrame) -> pd.DataFrame:
+    return predict_frame(_predictor, data, _model_name)
+
+
+def _read_chunks(path: str, file_format: str, chunk_rows: int):
+    if file_format == "parquet":
+        # Memory-mapped, decoded one record batch at a time
+        parquet_file = pq.ParquetFile(path, memory_map=True)
+        empty = True
+        for batch in parquet_file.iter_batches(batch_size=chunk_rows):
+            empty = False
+            yield batch.to_pandas(split_blocks=True)
+        if empty:
+            # A single empty chunk, so that the output is a Parquet file with the predictions' schema
+            yield parquet_file.schema_arrow.empty_table().to_pandas()
+        return
+    content_type = CONTENT_TYPE_JSONL if file_format == "jsonl" else CONTENT_TYPE_CSV
+    with open(path, "rb") as f:
+        yield from read_frames(f, content_type, chunk_rows)
+
+
+def score_file(input_path: str, output_path: str, chunk_rows: int, keep_columns: List[str] = ()) -> Dict:
+    """Score one file chunk by chunk into output_path, returning rows and timings
+
+    keep_columns (e.g. an id) are copied from the input in front of the predictions.
+    """
+    file_format = _FORMATS[os.path.splitext(input_path)[1].lower()]
+    partial_path = output_path + _PARTIAL_SUFFIX
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    start = time.perf_counter()
+    rows = 0
+    writer = None
+    try:
+        with open(partial_path, "wb") as f:
+            for data in _read_chunks(input_path, file_format, chunk_rows):
+                prediction = _predict(data)
+                if keep_columns:
+                    prediction = pd.concat(
+                        [data[list(keep_columns)].reset_index(drop=True), prediction.reset_index(drop=True)], axis=1
+                    )
+                if file_format == "parquet":
+                    table = pa.Table.from_pandas(prediction, preserve_index=False)
+                    if writer is None:
+                        writer = pq.ParquetWriter(f, table.schema)
+                    writer.write_table(table)
+                elif file_format == "jsonl":
+                    f.write(prediction.to_json(orient="records", lines=True, double_precision=15).rstrip("\n").encode("utf-8") + b"\n")
+                else:
+                    f.write(prediction.to_csv(index=False, header=rows == 0).encode("utf-8"))
+                rows += len(data)
+            if writer is not None:
+                writer.close()
+        os.replace(partial_path, output_path)
+    except BaseException:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+    return {"rows": rows, "bytes": os.path.getsize(input_path), "seconds": time.perf_counter() - start}
+
+
+def _score_task(task):
+    input_path, output_path, chunk_rows, keep_columns = task
+    try:
+        return input_path, score_file(input_path, output_path, chunk_rows, keep_columns), None
+    except Exception as e:
+        return input_path, None, f"{type(e).__name__}: {e}"
+
+
+def _init_worker(workers: int):
+    after_fork(workers)
+
+
+def run(input_dir: str, output_dir: str, model_dir: str, chunk_rows: int = BATCH_CHUNK_ROWS,
+        workers: Optional[int] = None, model: Optional[str] = None, keep_columns: List[str] = ()) -> Dict:
+    """Score all files under input_dir into output_dir, skipping outputs already complete"""
+    global _predictor, _model_name
+    start = time.perf_counter()
+    inputs = find_inputs(input_dir)
+    tasks = []
+    skipped = 0
+    for relative in inputs:
+        input_path = os.path.join(input_dir, relative)
+        output_path = os.path.join(output_dir, relative)
+        if is_done(input_path, output_path):
+            skipped += 1
+            continue
+        tasks.append((input_path, output_path, chunk_rows, list(keep_columns)))
+    logger.info(f"{len(inputs)} input files, {skipped} already scored, {len(tasks)} to score")
+
+    workers = max(1, min(workers or available_cpus(), len(tasks)))
+    rows = scored_bytes = 0
+    failed = []
+    if tasks:
+        with preloading(workers):
+            model_path, _ = prepare_model(model_dir)
+            _predictor = TabularPredictor.load(model_path, require_py_version_match=False)
+            persist_models(_predictor)
+            install_compiled(_predictor)
+            apply_thread_budget(_predictor, workers)
+        _model_name = model
+        if workers > 1:
+            before_fork()
+            with multiprocessing.get_context("fork").Pool(workers, initializer=_init_worker, initargs=(workers,)) as pool:
+                results = list(_log_progress(pool.imap_unordered(_score_task, tasks), len(tasks)))
+        else:
+            results = list(_log_progress(map(_score_task, tasks), len(tasks)))
+        for input_path, stats, error in results:
+            if error is not None:
+                failed.append(input_path)
+                continue
+            rows += stats["rows"]
+            scored_bytes += stats["bytes"]
+
+    elapsed = time.perf_counter() - start
+    return {
+        "files": len(tasks) - len(failed),
+        "skipped": skipped,
+        "failed": failed,
+        "rows": rows,
+        "bytes": scored_bytes,
+        "seconds": elapsed,
+        "workers": workers,
+    }
+
+
+def _log_progress(results, total: int):
+    for done, (input_path, stats, error) in enumerate(results, 1):
+        if error is not None:
+            logger.error(f"[{done}/{total}] {input_path} failed: {error}")
+        else:
+            logger.info(
+                f"[{done}/{total}] {input_path}: {stats['rows']} rows in {stats['seconds']:.2f} s "
+                f"({stats['rows'] / max(stats['seconds'], 1e-9):,.0f} rows/s)"
+            )
+        yield input_path, stats, error
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score every CSV, Parquet and JSON Lines file under a directory")
+    parser.add_argument("--input-dir", required=True)
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("--model-dir", default=os.environ.get("MODEL_PATH", "/opt/ml/model"))
+    parser.add_argument("--chunk-rows", type=int, default=BATCH_CHUNK_ROWS)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes, defaults to the available cores")
+    parser.add_argument("--model", default=None, help="Model to predict with instead of the predictor's best model")
+    parser.add_argument("--keep-columns", default="", help="Comma-separated input columns (e.g. ids) copied to the output")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    keep_columns = [c for c in args.keep_columns.split(",") if c]
+    summary = run(args.input_dir, args.output_dir, args.model_dir, args.chunk_rows, args.workers, args.model, keep_columns)
+    seconds = max(summary["seconds"], 1e-9)
+    print(
+        f"Scored {summary['files']} files ({summary['skipped']} skipped, {len(summary['failed'])} failed): "
+        f"{summary['rows']} rows, {summary['bytes'] / 2**20:.1f} MiB in {summary['seconds']:.2f} s "
+        f"with {summary['workers']} workers, {summary['rows'] / seconds:,.0f} rows/s, "
+        f"{summary['bytes'] / 2**20 / seconds:.1f} MiB/s"
+    )
+    if summary["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
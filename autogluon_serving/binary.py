@@ -0,0 +1,329 @@
+"""Binary inference protocol: length-prefixed Arrow IPC frames over persistent TCP or Unix socket connections
+
+Every HTTP/JSON call to ``/invocations`` pays for a request line, headers, a JSON body parsed row by
+row and a JSON response. With ``AG_BINARY_PORT`` (or ``AG_BINARY_SOCKET``) set, each runtime also
+listens for a compact protocol in which a connection stays open and carries any number of requests::
+
+    request:  u32 length | u32 request id | u16 metadata length | metadata | Arrow IPC stream of the rows
+    response: u32 length | u32 request id | u8 status | u16 metadata length | metadata | Arrow IPC stream of the predictions
+
+Integers are big-endian and length counts the bytes after it. Metadata is optional UTF-8 JSON: a
+request's ``model``, ``tier``, ``deadline_ms`` and ``target_model``, as the HTTP query parameters,
+and a response's ``model``, or for a failed request its ``error`` and ``retry_after``. A response
+has one of the statuses below and, unless it is ``STATUS_OK``, no predictions.
+
+Requests are pipelined: a client may send many without waiting for their responses. Up to
+``AG_BINARY_MAX_PIPELINE`` requests per connection are predicted at the same time (reading stops
+beyond that), and each is answered as soon as it completes, so responses are matched to requests
+by their id rather than their order. Rows and predictions are decoded and encoded by Arrow without
+per-row Python objects. BentoML and MLflow predict them through the same path as an Arrow
+``/invocations`` request, admission control included. DJL's frontend and job queue do not see them,
+so DJL workers admit them with an admission control of their own, of ``AG_BINARY_THREADS`` requests
+in flight. :class:`BinaryClient` is a blocking client.
+"""
+
+import asyncio
+import contextlib
+import functools
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple, Union
+
+import pandas as pd
+
+from autogluon_serving.formats import CONTENT_TYPE_ARROW, decode_columnar, encode_columnar
+from autogluon_serving.metrics import Timings
+
+logger = logging.getLogger(__name__)
+
+# TCP port of the binary protocol, 0 disables it; every worker process accepts on it (SO_REUSEPORT)
+BINARY_PORT = int(os.environ.get("AG_BINARY_PORT", "0"))
+BINARY_HOST = os.environ.get("AG_BINARY_HOST", "0.0.0.0")
+# Unix socket path of the binary protocol, served by the first worker process to bind it
+BINARY_SOCKET = os.environ.get("AG_BINARY_SOCKET", "")
+BINARY_MAX_PIPELINE = int(os.environ.get("AG_BINARY_MAX_PIPELINE", "64"))
+BINARY_MAX_FRAME_MB = float(os.environ.get("AG_BINARY_MAX_FRAME_MB", "64"))
+# Binary requests predicted at once by runtimes without an inference executor of their own (DJL)
+BINARY_THREADS = int(os.environ.get("AG_BINARY_THREADS", "1"))
+
+STATUS_OK = 0
+STATUS_BAD_REQUEST = 1
+# Shed by admission control or waiting for its model to load, retry after retry_after seconds
+STATUS_UNAVAILABLE = 2
+STATUS_ERROR = 3
+
+_LENGTH = struct.Struct(">I")
+_REQUEST = struct.Struct(">IH")
+_RESPONSE = struct.Struct(">IBH")
+
+
+def _metadata(metadata: Optional[Dict]) -> bytes:
+    return json.dumps(metadata).encode("utf-8") if metadata else b""
+
+
+def encode_request(request_id: int, data: pd.DataFrame, selection: Optional[Dict] = None) -> bytes:
+    metadata = _metadata(selection)
+    body = encode_columnar(data, CONTENT_TYPE_ARROW)
+    return _LENGTH.pack(_REQUEST.size + len(metadata) + len(body)) + _REQUEST.pack(request_id, len(metadata)) + metadata + body
+
+
+def _status(error: Exception) -> int:
+    if getattr(error, "retry_after", None) is not None:
+        # admission.Rejected and store.ModelLoading
+        return STATUS_UNAVAILABLE
+    if isinstance(error, (ValueError, KeyError)):
+        # Including pyarrow's ArrowInvalid, a body that is not an Arrow IPC stream
+        return STATUS_BAD_REQUEST
+    return STATUS_ERROR
+
+
+class BinaryServer:
+    """Listener of the binary protocol, answering requests with handler
+
+    handler(body, selection, timings) predicts the Arrow IPC stream body with the model selection
+    of the request's metadata, recording its stages in timings, and returns the predictions as an
+    Arrow IPC stream, the number of rows and the response metadata. It is awaited when it is a
+    coroutine function, and run on threads of the server otherwise.
+    """
+
+    def __init__(
+        self,
+        handler,
+        port: int = BINARY_PORT,
+        socket_path: str = BINARY_SOCKET,
+        max_pipeline: int = BINARY_MAX_PIPELINE,
+        max_frame_mb: float = BINARY_MAX_FRAME_MB,
+        threads: int = BINARY_THREADS,
+    ):
+        self.handler = handler
+        self.port = port
+        self.socket_path = socket_path
+        self.max_pipeline = max_pipeline
+        self.max_frame_bytes = int(max_frame_mb * 2**20)
+        self.threads = threads
+        self.connections = 0
+        self.requests = 0
+        self._servers = []
+        self._executor = None
+
+    @classmethod
+    def from_env(cls, handler) -> Optional["BinaryServer"]:
+        """Listener configured by AG_BINARY_PORT and AG_BINARY_SOCKET, None when neither is set"""
+        if not BINARY_PORT and not BINARY_SOCKET:
+            return None
+        return cls(handler)
+
+    async def start(self):
+        """Listen on the running event loop"""
+        if self.port:
+            self._servers.append(await asyncio.start_server(self._serve, BINARY_HOST, self.port, reuse_port=True))
+            logger.info(f"Binary protocol listening on {BINARY_HOST}:{self.port}")
+        if self.socket_path:
+            if self._socket_in_use():
+                logger.info(f"Binary protocol socket {self.socket_path} is served by another worker")
+            else:
+                self._servers.append(await asyncio.start_unix_server(self._serve, self.socket_path))
+                logger.info(f"Binary protocol listening on {self.socket_path}")
+
+    def start_in_thread(self):
+        """Listen on an event loop of its own, for runtimes that do not run one"""
+        started = threading.Event()
+
+        def run():
+            loop = asyncio.new_event_loop()
+            try:
+                loop.run_until_complete(self.start())
+            except OSError as e:
+                logger.error(f"Binary protocol cannot listen: {e}")
+                return
+            finally:
+                started.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, name="autogluon-binary", daemon=True).start()
+        started.wait()
+
+    async def stop(self):
+        for server in self._servers:
+            server.close()
+            await server.wait_closed()
+        self._servers = []
+
+    def _socket_in_use(self) -> bool:
+        """Whether a live process accepts on socket_path, asyncio replaces the file of a stale one"""
+        if not os.path.exists(self.socket_path):
+            return False
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(self.socket_path)
+                return True
+            except OSError:
+                return False
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        slots = asyncio.Semaphore(self.max_pipeline)
+        pending = set()
+        try:
+            while True:
+                try:
+                    (length,) = _LENGTH.unpack(await reader.readexactly(_LENGTH.size))
+                except asyncio.IncompleteReadError:
+                    # Closed by the client between requests
+                    break
+                if not _REQUEST.size <= length <= self.max_frame_bytes:
+                    logger.warning(f"Closing a binary protocol connection sending a frame of {length} bytes")
+                    break
+                frame = await reader.readexactly(length)
+                # Reading stops while max_pipeline requests of the connection are being predicted
+                await slots.acquire()
+                task = asyncio.ensure_future(self._respond(frame, writer, slots))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            # Requests already read are still answered when the client only closed its side
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+            self.connections -= 1
+
+    async def _call(self, body: memoryview, selection: Dict, timings: Timings):
+        if asyncio.iscoroutinefunction(self.handler):
+            return await self.handler(body, selection, timings)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="autogluon-binary")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(self.handler, body, selection, timings))
+
+    async def _respond(self, frame: bytes, writer: asyncio.StreamWriter, slots: asyncio.Semaphore):
+        try:
+            self.requests += 1
+            request_id, metadata_length = _REQUEST.unpack_from(frame)
+            timings = Timings()
+            content, rows = b"", None
+            try:
+                selection = json.loads(frame[_REQUEST.size : _REQUEST.size + metadata_length]) if metadata_length else {}
+                body = memoryview(frame)[_REQUEST.size + metadata_length :]
+                content, rows, metadata = await self._call(body, selection, timings)
+                status = STATUS_OK
+            except Exception as e:
+                status = _status(e)
+                metadata = {"error": str(e)}
+                if status == STATUS_UNAVAILABLE:
+                    metadata["retry_after"] = e.retry_after
+                elif status == STATUS_ERROR:
+                    logger.error(f"Binary protocol request failed: {e}")
+            timings.finish(rows, failed=status != STATUS_OK)
+            metadata = _metadata(metadata)
+            header = _LENGTH.pack(_RESPONSE.size + len(metadata) + len(content)) + _RESPONSE.pack(request_id, status, len(metadata))
+            # Both writes complete before another response can be written
+            writer.write(header + metadata)
+            writer.write(content)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            slots.release()
+
+    def stats(self) -> Dict:
+        return {"port": self.port or None, "socket": self.socket_path or None, "connections": self.connections, "requests": self.requests}
+
+
+class BinaryError(RuntimeError):
+    """A request answered with a status other than STATUS_OK"""
+
+    def __init__(self, message: str, status: int, retry_after: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class BinaryClient:
+    """Blocking client of the binary protocol on a TCP (host, port) or Unix socket path address"""
+
+    def __init__(self, address: Union[str, Tuple[str, int]], timeout: Optional[float] = None):
+        if isinstance(address, str):
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.settimeout(timeout)
+            self._socket.connect(address)
+        else:
+            self._socket = socket.create_connection(address, timeout)
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self._socket.makefile("rb")
+        self._next_id = 0
+
+    def close(self):
+        self._reader.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def send(self, data: pd.DataFrame, **selection) -> int:
+        """Send a request without waiting for its response, returning its id"""
+        request_id = self._next_id
+        self._next_id = (self._next_id + 1) % 2**32
+        self._socket.sendall(encode_request(request_id, data, {k: v for k, v in selection.items() if v is not None}))
+        return request_id
+
+    def _read(self, size: int) -> bytes:
+        content = self._reader.read(size)
+        if len(content) != size:
+            raise ConnectionError("Connection closed by the server")
+        return content
+
+    def receive(self) -> Tuple[int, int, Dict, bytes]:
+        """Next response: request id, status, metadata and the predictions' Arrow IPC stream"""
+        (length,) = _LENGTH.unpack(self._read(_LENGTH.size))
+        frame = self._read(length)
+        request_id, status, metadata_length = _RESPONSE.unpack_from(frame)
+        metadata = json.loads(frame[_RESPONSE.size : _RESPONSE.size + metadata_length]) if metadata_length else {}
+        return request_id, status, metadata, frame[_RESPONSE.size + metadata_length :]
+
+    @staticmethod
+    def _predictions(status: int, metadata: Dict, content: bytes) -> pd.DataFrame:
+        if status != STATUS_OK:
+            raise BinaryError(metadata.get("error", f"status {status}"), status, metadata.get("retry_after"))
+        return decode_columnar(content, CONTENT_TYPE_ARROW)
+
+    def predict(self, data: pd.DataFrame, **selection) -> pd.DataFrame:
+        """Predictions for data, raises BinaryError when the request fails"""
+        self.send(data, **selection)
+        _, status, metadata, content = self.receive()
+        return self._predictions(status, metadata, content)
+
+    def predict_many(self, frames: List[pd.DataFrame], pipeline: int = BINARY_MAX_PIPELINE, **selection) -> List[Union[pd.DataFrame, BinaryError]]:
+        """Predictions for each frame, with up to pipeline requests sent ahead of their responses
+
+        Responses are read as soon as pipeline requests are outstanding, so that neither side
+        blocks writing to the other. pipeline must not exceed the server's AG_BINARY_MAX_PIPELINE,
+        beyond which it stops reading. A request that failed has its BinaryError in place of its
+        predictions.
+        """
+        ids = []
+        responses = {}
+        for frame in frames:
+            if len(ids) - len(responses) >= max(pipeline, 1):
+                self._receive_into(responses)
+            ids.append(self.send(frame, **selection))
+        while len(responses) < len(ids):
+            self._receive_into(responses)
+        return [responses[request_id] for request_id in ids]
+
+    def _receive_into(self, responses: Dict):
+        request_id, status, metadata, content = self.receive()
+        try:
+            responses[request_id] = self._predictions(status, metadata, content)
+        except BinaryError as e:
+            responses[request_id] = e
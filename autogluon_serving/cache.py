@@ -0,0 +1,193 @@
+"""Row-level prediction cache for AutoGluon predictors
+
+Each input row is keyed by a 128-bit hash of its features in ``feature_metadata_in`` order, so
+requests that repeat rows (retries, entities re-scored within minutes) only send the rows that
+are not cached to the predictor, in a single sub-batch. Entries are evicted least recently used
+once the memory budget is reached, expire after a TTL and are dropped when the model artifact
+on disk changes.
+"""
+
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from autogluon_serving.extract import PREDICTOR_FILES, find_model_archive
+
+logger = logging.getLogger(__name__)
+
+# Memory budget in MB, 0 disables the cache
+PREDICTION_CACHE_MB = float(os.environ.get("AG_PREDICTION_CACHE_MB", "0"))
+PREDICTION_CACHE_TTL_S = float(os.environ.get("AG_PREDICTION_CACHE_TTL_S", "600"))
+# How often the model artifact is stat'ed for changes
+_ARTIFACT_CHECK_INTERVAL_S = 1.0
+# Two independent 64-bit row hashes, hash_pandas_object requires 16 byte keys
+_HASH_KEYS = ("ag-serving-row-1", "ag-serving-row-2")
+# Approximate per-entry overhead of the OrderedDict slot, key tuple and bookkeeping
+_ENTRY_OVERHEAD_BYTES = 200
+
+
+def artifact_fingerprint(model_path: str) -> Optional[Tuple]:
+    """Size and mtime of the predictor files, or of the model archive, under model_path"""
+    paths = [os.path.join(model_path, f) for f in PREDICTOR_FILES]
+    if not all(os.path.isfile(p) for p in paths):
+        archive = find_model_archive(model_path) if os.path.isdir(model_path) else model_path
+        if archive is None:
+            return None
+        paths = [archive]
+    try:
+        return tuple((p, s.st_size, s.st_mtime_ns) for p, s in ((p, os.stat(p)) for p in paths))
+    except OSError:
+        return None
+
+
+class PredictionCache:
+    """Thread-safe LRU of per-row predictions with a memory budget and TTL"""
+
+    def __init__(
+        self,
+        features: List[str],
+        model_path: Optional[str] = None,
+        max_bytes: int = int(PREDICTION_CACHE_MB * 1024 * 1024),
+        ttl_s: float = PREDICTION_CACHE_TTL_S,
+    ):
+        self.features = list(features)
+        self.model_path = model_path
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self._entries = OrderedDict()  # key -> (expires_at, size, row)
+        self._columns = None
+        self._dtypes = None
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._fingerprint = artifact_fingerprint(model_path) if model_path else None
+        self._checked_at = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @classmethod
+    def from_env(cls, predictor, model_path: Optional[str] = None) -> Optional["PredictionCache"]:
+        """Build a cache for predictor from AG_PREDICTION_CACHE_*, None when the cache is disabled"""
+        if PREDICTION_CACHE_MB <= 0:
+            return None
+        logger.info(f"Prediction cache enabled: {PREDICTION_CACHE_MB:g} MB, TTL {PREDICTION_CACHE_TTL_S:g} s")
+        return cls(predictor.feature_metadata_in.get_features(), model_path)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+    def _check_artifact(self):
+        """Drop all entries when the model artifact changed on disk"""
+        now = time.monotonic()
+        if self.model_path is None or now - self._checked_at < _ARTIFACT_CHECK_INTERVAL_S:
+            return
+        self._checked_at = now
+        fingerprint = artifact_fingerprint(self.model_path)
+        if fingerprint != self._fingerprint:
+            logger.info(f"Model artifact under {self.model_path} changed, clearing prediction cache")
+            self._fingerprint = fingerprint
+            self.clear()
+
+    def row_keys(self, data: pd.DataFrame) -> Optional[List]:
+        """Hash each row's features in canonical column order, None when a feature is missing"""
+        if not set(self.features).issubset(data.columns):
+            return None
+        features = data[self.features]
+        # The dtypes are part of the key so that e.g. 1 and "1" never share an entry
+        schema = hash(tuple(features.dtypes.astype(str)))
+        high, low = (
+            pd.util.hash_pandas_object(features, index=False, hash_key=key).to_numpy(dtype=np.uint64)
+            for key in _HASH_KEYS
+        )
+        return [(schema, h, l) for h, l in zip(high.tolist(), low.tolist())]
+
+    def lookup(self, data: pd.DataFrame) -> Tuple[Optional[List], List]:
+        """Return (row keys, cached rows), with None for each row that must be predicted"""
+        self._check_artifact()
+        keys = self.row_keys(data)
+        if keys is None:
+            return None, [None] * len(data)
+        now = time.monotonic()
+        rows = []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] <= now:
+                    self._drop(key)
+                    self.expirations += 1
+                    entry = None
+                if entry is None:
+                    rows.append(None)
+                    self.misses += 1
+                else:
+                    self._entries.move_to_end(key)
+                    rows.append(entry[2])
+                    self.hits += 1
+        return keys, rows
+
+    def store(self, keys: List, prediction: pd.DataFrame):
+        """Cache one prediction row per key"""
+        expires_at = time.monotonic() + self.ttl_s
+        with self._lock:
+            self._columns = list(prediction.columns)
+            self._dtypes = prediction.dtypes.to_dict()
+            for key, row in zip(keys, prediction.itertuples(index=False, name=None)):
+                size = _ENTRY_OVERHEAD_BYTES + sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row)
+                if key in self._entries:
+                    self._drop(key)
+                self._entries[key] = (expires_at, size, row)
+                self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        self._bytes -= self._entries.pop(key)[1]
+
+    def predict(self, data: pd.DataFrame, predict_fn: Callable[[pd.DataFrame], pd.DataFrame]) -> pd.DataFrame:
+        """Predict data, sending only the rows that are not cached to predict_fn"""
+        keys, rows = self.lookup(data)
+        missing = [i for i, row in enumerate(rows) if row is None]
+        prediction = predict_fn(data.iloc[missing]) if missing or data.empty else None
+        return self.complete(data, keys, rows, missing, prediction)
+
+    def complete(self, data: pd.DataFrame, keys: Optional[List], rows: List, missing: List[int],
+                 prediction: Optional[pd.DataFrame]) -> pd.DataFrame:
+        """Cache the predicted rows and merge them with the cached ones in input order"""
+        if keys is not None and prediction is not None:
+            self.store([keys[i] for i in missing], prediction)
+        if len(missing) == len(data):
+            return prediction
+        for i, row in zip(missing, prediction.itertuples(index=False, name=None) if missing else ()):
+            rows[i] = row
+        with self._lock:
+            columns, dtypes = self._columns, self._dtypes
+        merged = pd.DataFrame.from_records(rows, columns=columns, index=data.index)
+        return merged.astype(dtypes)
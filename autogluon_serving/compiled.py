@@ -0,0 +1,400 @@
+"""Compiled inference for the LightGBM and XGBoost members of a predictor
+
+Every tree member is otherwise predicted through its AutoGluon wrapper: per-model column selection,
+pandas conversions inside LightGBM, and for XGBoost a one-hot encoding into a sparse matrix. On
+small requests this Python dispatch costs several times the tree arithmetic. Here each LightGBM and
+XGBoost member is converted into a Treelite model, predicted natively by Treelite, and fed a
+float matrix built straight from the transformed features:
+
+- LightGBM category columns become their codes in the categories the booster was trained with
+- XGBoost's one-hot encoding is compiled into one lookup table per category column, probed from
+  the member's own encoder, and absent sparse entries become missing values as in XGBoost
+
+A compiled member replaces only the member's ``_predict_proba`` in memory, so AutoGluon still
+normalizes its output, weighs it into the ensembles that use it and post-processes the result.
+Members that cannot be converted (CatBoost, neural networks, other problem types) and members
+whose compiled predictions differ from their own ``predict_proba`` by more than
+``AG_COMPILED_TOLERANCE`` keep predicting through AutoGluon.
+
+Run ``python -m autogluon_serving.compiled --model-dir /opt/ml/model`` when preparing the model to
+convert and verify the members once and store them in the predictor's ``compiled`` directory,
+otherwise this happens when the model is loaded. A stored member is checked again when it is loaded
+unless the SHA-256 of its member's model file and the tolerance are those it was verified with.
+``AG_COMPILED_INFERENCE=false`` disables it.
+"""
+
+import abc
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from autogluon.core.constants import BINARY, MULTICLASS, REGRESSION
+from autogluon.tabular.models import LGBModel, XGBoostModel
+
+from autogluon_serving.extract import prepare_model
+from autogluon_serving.warmup import synthetic_rows
+
+try:
+    import treelite
+    import treelite.gtil
+except ImportError:
+    treelite = None
+
+logger = logging.getLogger(__name__)
+
+COMPILED_INFERENCE = os.environ.get("AG_COMPILED_INFERENCE", "true").lower() == "true"
+# Largest absolute difference from a member's own predict_proba accepted for its compiled model
+COMPILED_TOLERANCE = float(os.environ.get("AG_COMPILED_TOLERANCE", "1e-5"))
+COMPILED_DIR = "compiled"
+_MANIFEST = "manifest.json"
+_PROBLEM_TYPES = (BINARY, MULTICLASS, REGRESSION)
+# Rows of the internal training data cached with the predictor used in the equivalence check
+_CHECK_ROWS = 1000
+
+
+class CompiledMember(abc.ABC):
+    """A member's trees as a Treelite model, and the encoding of its features into Treelite's input matrix"""
+
+    def __init__(self, member, model):
+        self.name = member.name
+        self.model = model
+        self.dtype = np.float32 if model.input_type == "float32" else np.float64
+
+    @abc.abstractmethod
+    def matrix(self, X: pd.DataFrame) -> np.ndarray:
+        """Treelite's input matrix for X, in self.dtype"""
+
+    def predict_proba(self, X: pd.DataFrame, **kwargs) -> np.ndarray:
+        """Predictions in AutoGluon's unified form, a drop-in for the member's _predict_proba"""
+        # Treelite's default number of threads is OpenMP's, which follows the thread budget
+        y = treelite.gtil.predict(self.model, self.matrix(X)).reshape(len(X), -1)
+        return y[:, 0] if y.shape[1] == 1 else y
+
+
+def _codes(column: pd.Series, categories: pd.Index) -> np.ndarray:
+    """Codes of a category column in categories, -1 for missing and unknown values"""
+    if not column.dtype.categories.equals(categories):
+        column = column.cat.set_categories(categories)
+    return column.array.codes
+
+
+def _values(column: pd.Series, dtype) -> np.ndarray:
+    """Values of a numeric column, NaN for missing values"""
+    if column.dtype.kind in "biuf":
+        # Cast on assignment, to_numpy with na_value is several times slower
+        return column.to_numpy()
+    return column.to_numpy(dtype=dtype, na_value=np.nan)
+
+
+class LightGBMMember(CompiledMember):
+    """LightGBM booster, category columns encoded as their codes in the booster's pandas_categorical"""
+
+    def __init__(self, member, model):
+        super().__init__(member, model)
+        booster = member.model
+        # The booster was trained on X[member._features], its features are positional
+        self.features = list(member._features)
+        if len(self.features) != booster.num_feature():
+            raise ValueError(f"{len(self.features)} features for a booster of {booster.num_feature()}")
+        categorical = booster.pandas_categorical or []
+        categorical_features = [f for f in self.features if f in member.feature_metadata.get_features(valid_raw_types=["category"])]
+        if len(categorical) != len(categorical_features):
+            raise ValueError(f"{len(categorical_features)} category features for {len(categorical)} booster categories")
+        self.categories = {f: pd.Index(c) for f, c in zip(categorical_features, categorical)}
+
+    @staticmethod
+    def convert(member):
+        return treelite.frontend.from_lightgbm(member.model)
+
+    def matrix(self, X: pd.DataFrame) -> np.ndarray:
+        matrix = np.empty((len(X), len(self.features)), dtype=self.dtype)
+        for j, feature in enumerate(self.features):
+            categories = self.categories.get(feature)
+            if categories is None:
+                matrix[:, j] = _values(X[feature], self.dtype)
+            else:
+                codes = _codes(X[feature], categories)
+                matrix[:, j] = np.where(codes < 0, np.nan, codes)
+        return matrix
+
+
+class XGBoostMember(CompiledMember):
+    """XGBoost booster, with the member's one-hot encoding compiled into per-column lookup tables"""
+
+    def __init__(self, member, model, template: Optional[pd.DataFrame] = None):
+        super().__init__(member, model)
+        encoder = getattr(member, "_ohe_generator", None)
+        if not getattr(member, "_ohe", False) or encoder is None or template is None:
+            raise ValueError("only one-hot encoded XGBoost members are supported")
+        self.category_features = list(encoder.cat_cols)
+        self.numeric_features = list(encoder.other_cols)
+        self.categories = {f: template[f].cat.categories for f in self.category_features}
+        # The encoded row with every category missing, and per column the change for each of its codes
+        # (row 0 for missing values): the encoding is one block of columns per category column, so a
+        # row's encoding is the base plus the changes for each of its values
+        probes = []
+        for feature in self.category_features:
+            probe = pd.DataFrame(
+                {f: pd.Categorical([np.nan] * (len(self.categories[feature]) + 1), categories=self.categories[f]) for f in self.category_features}
+            )
+            probe[feature] = pd.Categorical.from_codes(np.arange(-1, len(self.categories[feature])), categories=self.categories[feature])
+            for f in self.numeric_features:
+                probe[f] = 0.0
+            probes.append(encoder.transform(probe).toarray()[:, : -len(self.numeric_features) or None])
+        self.base = probes[0][0] if probes else np.empty(0)
+        self.tables = [(probe - self.base).astype(self.dtype) for probe in probes]
+        self.width = len(self.base) + len(self.numeric_features)
+        if self.width != member.model.get_booster().num_features():
+            raise ValueError(f"Encoding of {self.width} columns for a booster of {member.model.get_booster().num_features()} features")
+
+    @staticmethod
+    def convert(member):
+        return treelite.frontend.from_xgboost(member.model.get_booster())
+
+    def matrix(self, X: pd.DataFrame) -> np.ndarray:
+        matrix = np.empty((len(X), self.width), dtype=self.dtype)
+        encoded = matrix[:, : len(self.base)]
+        encoded[:] = self.base
+        for feature, table in zip(self.category_features, self.tables):
+            encoded += table[_codes(X[feature], self.categories[feature]) + 1]
+        for j, feature in enumerate(self.numeric_features, start=len(self.base)):
+            matrix[:, j] = _values(X[feature], self.dtype)
+        # XGBoost reads the encoded sparse matrix, in which zeros are absent and so missing
+        matrix[matrix == 0] = np.nan
+        return matrix
+
+
+_MEMBER_TYPES = ((LGBModel, LightGBMMember), (XGBoostModel, XGBoostMember))
+
+
+def _member_type(model_type):
+    return next((compiled for ag_type, compiled in _MEMBER_TYPES if issubclass(model_type, ag_type)), None)
+
+
+def _members(model, key: str):
+    """(key, member) of a model and its children, children of bagged models keyed as model/child"""
+    yield key, model
+    for child in getattr(model, "models", None) or ():
+        if not isinstance(child, str):
+            yield from _members(child, f"{key}/{child.name}")
+
+
+def candidates(predictor) -> List[str]:
+    """Models of the predictor whose members can be compiled"""
+    if predictor.problem_type not in _PROBLEM_TYPES:
+        return []
+    trainer = predictor._trainer
+    return [name for name in trainer.get_model_names() if _member_type(trainer.get_model_attribute(name, "type_inner")) is not None]
+
+
+def _persist(predictor, names: List[str]):
+    """Keep the models in memory, where their members can be replaced"""
+    missing = [name for name in names if name not in predictor._trainer.models]
+    if missing:
+        predictor.persist(models=missing, with_ancestors=False, max_memory=None)
+
+
+def _check_frames(predictor, template: pd.DataFrame) -> List[pd.DataFrame]:
+    """Transformed rows to compare compiled and AutoGluon predictions on"""
+    frames = [template]
+    # Every category of every column in random combinations, and missing values
+    rng = np.random.default_rng(0)
+    size = max([len(template[c].cat.categories) + 1 for c in template.columns if template[c].dtype == "category"] + [64])
+    probe = predictor.transform_features(synthetic_rows(predictor, size))
+    for column in probe.columns:
+        if probe[column].dtype == "category":
+            categories = probe[column].cat.categories
+            probe[column] = pd.Categorical.from_codes(rng.permutation(np.arange(size) % (len(categories) + 1)) - 1, categories=categories)
+    frames.append(probe)
+    # Rows of the internal training data, when the artifact keeps them
+    for load in ("load_X_val", "load_X"):
+        try:
+            frames.append(getattr(predictor._trainer, load)().head(_CHECK_ROWS))
+            break
+        except Exception:
+            continue
+    return frames
+
+
+def _max_difference(member, compiled: CompiledMember, frames: List[pd.DataFrame]) -> float:
+    difference = 0.0
+    for frame in frames:
+        expected = member.predict_proba(frame)
+        actual = compiled.predict_proba(frame).astype(np.float32)
+        if expected.shape != actual.shape:
+            return float("inf")
+        difference = max(difference, float(np.nanmax(np.abs(expected - actual), initial=0.0)))
+        if not np.array_equal(np.isnan(expected), np.isnan(actual)):
+            return float("inf")
+    return difference
+
+
+def _digest(member) -> Optional[str]:
+    """SHA-256 of the member's model file, None when it has none on disk"""
+    sha = hashlib.sha256()
+    try:
+        with open(os.path.join(member.path, member.model_file_name), "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha.update(block)
+    except (OSError, TypeError):
+        return None
+    return sha.hexdigest()
+
+
+def _compile(predictor, models: Optional[Dict[str, object]] = None, verified: Optional[Dict[str, Dict]] = None) -> Tuple[Dict[str, CompiledMember], Dict[str, Dict]]:
+    """Convert (or take from models) and verify the members of the predictor's candidate models
+
+    Members of models whose entry in verified (a stored report) has the digest of their member's
+    model file are used without verifying them again.
+    """
+    names = candidates(predictor)
+    _persist(predictor, names)
+    template = predictor.transform_features(synthetic_rows(predictor, 64))
+    frames = None
+    compiled, report = {}, {}
+    for name in names:
+        for key, member in _members(predictor._trainer.models[name], name):
+            member_type = _member_type(type(member))
+            if member_type is None:
+                continue
+            if models is not None and key not in models:
+                report[key] = {"compiled": False, "reason": "not among the compiled members"}
+                continue
+            digest = _digest(member)
+            try:
+                model = models[key] if models is not None else member_type.convert(member)
+                kwargs = {"template": template} if member_type is XGBoostMember else {}
+                candidate = member_type(member, model, **kwargs)
+                entry = (verified or {}).get(key, {})
+                if digest is not None and entry.get("digest") == digest:
+                    difference = entry["max_abs_diff"]
+                else:
+                    if frames is None:
+                        frames = _check_frames(predictor, template)
+                    difference = _max_difference(member, candidate, frames)
+            except Exception as e:
+                report[key] = {"compiled": False, "reason": str(e)}
+                continue
+            report[key] = {"compiled": difference <= COMPILED_TOLERANCE, "max_abs_diff": difference, "digest": digest}
+            if difference <= COMPILED_TOLERANCE:
+                compiled[key] = candidate
+            else:
+                report[key]["reason"] = f"differs from predict_proba by {difference:.3g}"
+    return compiled, report
+
+
+def _file_name(key: str) -> str:
+    return key.replace("/", "__") + ".tl"
+
+
+def save_compiled(path: str, compiled: Dict[str, CompiledMember], report: Dict[str, Dict]) -> str:
+    """Write the compiled members and their verification report to path/compiled"""
+    target = os.path.join(path, COMPILED_DIR)
+    staging = f"{target}.tmp-{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    for key, member in compiled.items():
+        member.model.serialize(os.path.join(staging, _file_name(key)))
+    manifest = {"treelite": treelite.__version__, "tolerance": COMPILED_TOLERANCE, "members": report}
+    with open(os.path.join(staging, _MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+    shutil.rmtree(target, ignore_errors=True)
+    os.rename(staging, target)
+    return target
+
+
+def _load_models(path: str) -> Tuple[Optional[Dict[str, object]], Dict[str, Dict]]:
+    """Treelite models stored in path/compiled, None when there are none or they are stale, and their report
+
+    The report only counts as verified when it was made with the current tolerance.
+    """
+    directory = os.path.join(path, COMPILED_DIR)
+    try:
+        with open(os.path.join(directory, _MANIFEST)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None, {}
+    if manifest.get("treelite") != treelite.__version__:
+        return None, {}
+    models = {}
+    for key, entry in manifest.get("members", {}).items():
+        if entry.get("compiled"):
+            try:
+                models[key] = treelite.Model.deserialize(os.path.join(directory, _file_name(key)))
+            except Exception as e:
+                logger.warning(f"Cannot load the compiled model of {key}: {e}")
+    verified = manifest.get("members", {}) if manifest.get("tolerance") == COMPILED_TOLERANCE else {}
+    return models, verified
+
+
+def compile_predictor(predictor) -> Dict[str, Dict]:
+    """Convert and verify the predictor's tree members and store them with the predictor, returning the report"""
+    compiled, report = _compile(predictor)
+    try:
+        target = save_compiled(predictor.path, compiled, report)
+        logger.info(f"Compiled members {sorted(compiled)} written to {target}")
+    except OSError as e:
+        logger.warning(f"Cannot write compiled members to {predictor.path}: {e}")
+    return report
+
+
+def install_compiled(predictor, save: bool = False) -> List[str]:
+    """Predict the predictor's supported tree members with Treelite, returning the members replaced
+
+    Members are loaded from the predictor's compiled directory, or converted when there is none (and
+    with save, written there for the next start), and are only used when they match the member's own
+    predictions. Their models are kept in memory.
+    """
+    if not COMPILED_INFERENCE or not candidates(predictor):
+        return []
+    if treelite is None:
+        logger.info("treelite is not installed, tree members predict through AutoGluon")
+        return []
+    start = time.perf_counter()
+    stored, verified = _load_models(predictor.path)
+    compiled, report = _compile(predictor, stored, verified)
+    if save and stored is None:
+        try:
+            save_compiled(predictor.path, compiled, report)
+        except OSError as e:
+            logger.warning(f"Cannot write compiled members to {predictor.path}: {e}")
+    for key, member in compiled.items():
+        model = predictor._trainer.models[key.split("/")[0]]
+        target = dict(_members(model, model.name))[key]
+        # AutoGluon still normalizes, casts and weighs what the member's _predict_proba returns
+        target._predict_proba = member.predict_proba
+    fallback = {key: entry["reason"] for key, entry in report.items() if not entry["compiled"]}
+    if fallback:
+        logger.warning(f"Members predicting through AutoGluon: {fallback}")
+    logger.info(f"Compiled members {sorted(compiled)} installed in {time.perf_counter() - start:.2f} s")
+    return sorted(compiled)
+
+
+def main():
+    from autogluon.tabular import TabularPredictor
+
+    parser = argparse.ArgumentParser(description="Compile and verify the tree members of an AutoGluon predictor")
+    parser.add_argument("--model-dir", default=os.environ.get("MODEL_PATH", "/opt/ml/model"))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if treelite is None:
+        logger.warning("treelite is not installed, nothing to compile")
+        return
+
+    model_path, _ = prepare_model(args.model_dir)
+    predictor = TabularPredictor.load(model_path, require_py_version_match=False)
+    report = compile_predictor(predictor)
+    for key, entry in report.items():
+        status = f"max abs diff {entry['max_abs_diff']:.3g}" if entry["compiled"] else f"not compiled, {entry['reason']}"
+        print(f"{key}: {status}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""Request decoding compiled from a predictor's ``feature_metadata_in``
+
+:class:`InputDecoder` knows the predictor's features, their order and their raw types, and turns JSON
+records, column dicts and CSV bodies straight into typed NumPy columns instead of letting pandas
+infer the types of every request. Numeric features become ``int64`` (``float64`` when values are
+missing) or ``float64`` columns, numeric strings are converted and other values are rejected with the
+feature and row at fault. Values of ``object`` and ``category`` features are passed as strings, so
+that a number matches the string category seen in training. Features the predictor does not use are
+dropped, and features missing from the request are an error. Single-row requests skip the column
+transposition.
+
+``AG_SCHEMA_DECODING=false`` goes back to pandas type inference.
+"""
+
+import io
+import operator
+import os
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+from autogluon.common.features.types import R_CATEGORY, R_FLOAT, R_INT, R_OBJECT
+
+SCHEMA_DECODING = os.environ.get("AG_SCHEMA_DECODING", "true").lower() == "true"
+
+_NUMERIC_TYPES = (R_INT, R_FLOAT)
+_STRING_TYPES = (R_OBJECT, R_CATEGORY)
+# Smaller CSV bodies are parsed faster on the calling thread than on Arrow's thread pool
+_CSV_THREADS_MIN_BYTES = 1 << 20
+
+
+class InputDecoder:
+    """Decoder of request payloads into the DataFrame a predictor expects"""
+
+    def __init__(self, feature_types: Dict[str, str]):
+        self.features = list(feature_types)
+        self.feature_types = dict(feature_types)
+        getter = operator.itemgetter(*self.features)
+        # itemgetter of a single key returns the value itself instead of a 1-tuple
+        self._values = getter if len(self.features) > 1 else lambda record: (getter(record),)
+        # Empty fields are missing values, as with pandas
+        self._csv_options = pa_csv.ConvertOptions(
+            column_types={f: pa.string() for f, t in self.feature_types.items() if t in _STRING_TYPES},
+            strings_can_be_null=True,
+        )
+
+    @classmethod
+    def from_predictor(cls, predictor) -> "InputDecoder":
+        metadata = predictor.feature_metadata_in
+        return cls({feature: metadata.get_feature_type_raw(feature) for feature in metadata.get_features()})
+
+    @classmethod
+    def from_env(cls, predictor) -> Optional["InputDecoder"]:
+        """Decoder for the predictor, or None when AG_SCHEMA_DECODING is disabled"""
+        return cls.from_predictor(predictor) if SCHEMA_DECODING else None
+
+    def decode_json(self, payload: Any) -> pd.DataFrame:
+        """Decode a list of records, a {feature: [values]} dict (values may be arrays) or a single record"""
+        if isinstance(payload, list):
+            return self.records(payload)
+        if isinstance(payload, dict):
+            if payload and all(isinstance(v, (list, tuple, np.ndarray)) for v in payload.values()):
+                return self.columns(payload)
+            return self.record(payload)
+        raise ValueError(f"Expected a JSON object or a list of objects, got {type(payload).__name__}")
+
+    def record(self, record: Dict[str, Any]) -> pd.DataFrame:
+        """Decode one record, the single-row fast path"""
+        try:
+            values = self._values(record)
+        except KeyError:
+            self._check_features(record)
+            raise
+        except TypeError:
+            raise ValueError(f"Expected a JSON object per row, got {type(record).__name__}")
+        return self._frame([self._column(feature, [value]) for feature, value in zip(self.features, values)])
+
+    def records(self, records: List[Dict[str, Any]]) -> pd.DataFrame:
+        """Decode a list of records; a feature missing from some of them is a missing value"""
+        if len(records) == 1:
+            return self.record(records[0])
+        try:
+            columns = [[record[feature] for record in records] for feature in self.features]
+        except (KeyError, TypeError):
+            bad = next((r for r in records if not isinstance(r, dict)), None)
+            if bad is not None:
+                raise ValueError(f"Expected a JSON object per row, got {type(bad).__name__}")
+            self._check_features(set().union(*(r.keys() for r in records)))
+            columns = [[record.get(feature) for record in records] for feature in self.features]
+        return self._frame([self._column(feature, values) for feature, values in zip(self.features, columns)])
+
+    def columns(self, columns: Dict[str, Sequence]) -> pd.DataFrame:
+        """Decode a {feature: [values]} dict"""
+        self._check_features(columns)
+        lengths = {len(columns[feature]) for feature in self.features}
+        if len(lengths) > 1:
+            raise ValueError(f"Features have different numbers of values: {sorted(lengths)}")
+        return self._frame([self._column(feature, columns[feature]) for feature in self.features])
+
+    def split(self, columns: List[str], data: List[List[Any]]) -> pd.DataFrame:
+        """Decode rows of values with their column names, e.g. MLflow's dataframe_split"""
+        transposed = list(zip(*data)) if data else [()] * len(columns)
+        if len(transposed) != len(columns):
+            raise ValueError(f"Rows have {len(transposed)} values for {len(columns)} columns")
+        return self.columns(dict(zip(columns, transposed)))
+
+    def decode_csv(self, body) -> pd.DataFrame:
+        """Decode a CSV body with a header row with Arrow's CSV reader, parsing string features as strings"""
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        read_options = pa_csv.ReadOptions(use_threads=len(body) >= _CSV_THREADS_MIN_BYTES)
+        table = pa_csv.read_csv(io.BytesIO(body), read_options=read_options, convert_options=self._csv_options)
+        self._check_features(table.column_names)
+        data = table.select(self.features).to_pandas()
+        columns = []
+        for feature in self.features:
+            column = data[feature]
+            if self.feature_types[feature] in _NUMERIC_TYPES:
+                # Cast to the feature's dtype as for JSON, e.g. a float feature read as integers. A column
+                # of another kind has a value the CSV parser could not read as a number
+                values = column.to_numpy() if column.dtype.kind in "iuf" else column.to_numpy(dtype=object)
+                columns.append(self._numeric(feature, values, self.feature_types[feature] == R_INT))
+            else:
+                columns.append(column.to_numpy())
+        return self._frame(columns)
+
+    def _check_features(self, present):
+        missing = [feature for feature in self.features if feature not in present]
+        if missing:
+            raise ValueError(f"Missing features: {missing}")
+
+    def _frame(self, columns: List[np.ndarray]) -> pd.DataFrame:
+        return pd.DataFrame(dict(zip(self.features, columns)), copy=False)
+
+    def _column(self, feature: str, values: Sequence) -> np.ndarray:
+        feature_type = self.feature_types[feature]
+        if feature_type in _NUMERIC_TYPES:
+            return self._numeric(feature, values, feature_type == R_INT)
+        if feature_type in _STRING_TYPES:
+            return self._strings(values)
+        column = np.empty(len(values), dtype=object)
+        column[:] = values
+        return column
+
+    @staticmethod
+    def _numeric(feature: str, values: Sequence, integer: bool) -> np.ndarray:
+        column = values if isinstance(values, np.ndarray) else np.asarray(values)
+        if column.dtype.kind in "iub" or (integer and len(column) == 0):
+            return column.astype(np.int64 if integer else np.float64, copy=False)
+        if column.dtype.kind == "f":
+            return column.astype(np.float64, copy=False)
+        # Strings or missing values: numeric strings are converted, None, NaN and "" are missing
+        raw = pd.Series(values, dtype=object)
+        column = pd.to_numeric(raw, errors="coerce").to_numpy(dtype=np.float64)
+        invalid = np.isnan(column) & raw.notna().to_numpy() & (raw != "").to_numpy()
+        if invalid.any():
+            row = int(np.argmax(invalid))
+            raise ValueError(f"Feature '{feature}' expects a number, got {raw.iloc[row]!r} in row {row}")
+        if integer and not np.isnan(column).any() and (column == np.floor(column)).all():
+            return column.astype(np.int64)
+        return column
+
+    @staticmethod
+    def _strings(values: Sequence) -> np.ndarray:
+        column = np.empty(len(values), dtype=object)
+        if set(map(type, values)) <= {str, type(None)}:
+            column[:] = values
+        else:
+            column[:] = [v if v is None or isinstance(v, str) else (None if v != v else str(v)) for v in values]
+        return column
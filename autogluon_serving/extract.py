@@ -0,0 +1,186 @@
+"""Content-addressed extraction cache for AutoGluon model archives
+
+Archives are keyed by the SHA-256 of their content and extracted once into
+``AG_MODEL_CACHE_DIR/<digest>``; later starts with the same archive reuse that directory.
+Pre-extracted models (e.g. unpacked by SageMaker) are linked rather than copied.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tarfile
+import time
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MODEL_CACHE_DIR = os.environ.get("AG_MODEL_CACHE_DIR", "/tmp/autogluon-model-cache")
+# Files that mark a directory as an already extracted TabularPredictor
+PREDICTOR_FILES = ("predictor.pkl", "learner.pkl")
+_COMPLETE_MARKER = ".complete"
+_DIGEST_INDEX = "digests.json"
+
+
+def is_extracted_model(path: str) -> bool:
+    return all(os.path.isfile(os.path.join(path, f)) for f in PREDICTOR_FILES)
+
+
+def find_model_archive(model_dir: str) -> Optional[str]:
+    """Return the first *.tar.gz containing 'model' in model_dir or one of its subdirectories"""
+    candidates = sorted(os.listdir(model_dir))
+    for filename in candidates:
+        if filename.endswith(".tar.gz") and "model" in filename:
+            return os.path.join(model_dir, filename)
+    for item in candidates:
+        item_path = os.path.join(model_dir, item)
+        if not os.path.isdir(item_path) or item.startswith("."):
+            continue
+        try:
+            for subfile in sorted(os.listdir(item_path)):
+                if subfile.endswith(".tar.gz") and "model" in subfile:
+                    return os.path.join(item_path, subfile)
+        except (OSError, PermissionError):
+            continue
+    return None
+
+
+def archive_digest(archive: str, cache_dir: str = MODEL_CACHE_DIR) -> str:
+    """SHA-256 of the archive, memoized by (path, size, mtime) so unchanged archives are hashed once"""
+    stat = os.stat(archive)
+    stamp = [stat.st_size, stat.st_mtime_ns]
+    index_path = os.path.join(cache_dir, _DIGEST_INDEX)
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        index = {}
+    key = os.path.realpath(archive)
+    entry = index.get(key)
+    if entry is not None and entry["stamp"] == stamp:
+        return entry["digest"]
+
+    with open(archive, "rb") as f:
+        digest = hashlib.file_digest(f, "sha256").hexdigest()
+    index[key] = {"stamp": stamp, "digest": digest}
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{index_path}.{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, index_path)
+    except OSError as e:
+        logger.warning(f"Cannot update digest index {index_path}: {e}")
+    return digest
+
+
+def _open_gzip_stream(archive: str):
+    """Open the archive as a decompressed byte stream, using parallel decompression when available"""
+    try:
+        import rapidgzip
+    except ImportError:
+        return None
+    return rapidgzip.open(archive, parallelization=os.cpu_count() or 1)
+
+
+def extract_archive(archive: str, dest: str):
+    """Stream-extract a .tar.gz archive into dest"""
+    extract_kwargs = {"filter": "data"} if hasattr(tarfile, "data_filter") else {}
+    stream = _open_gzip_stream(archive)
+    if stream is not None:
+        with stream, tarfile.open(fileobj=stream, mode="r|") as tar:
+            tar.extractall(dest, **extract_kwargs)
+    else:
+        with tarfile.open(archive, mode="r|gz") as tar:
+            tar.extractall(dest, **extract_kwargs)
+
+
+def link_tree(src: str, dest: str, exclude=()):
+    """Populate dest with links to the top-level entries of src: hardlinks for files, symlinks otherwise"""
+    os.makedirs(dest, exist_ok=True)
+    for item in os.listdir(src):
+        if item == _COMPLETE_MARKER or item in exclude:
+            continue
+        src_path = os.path.join(src, item)
+        dest_path = os.path.join(dest, item)
+        if os.path.lexists(dest_path):
+            if os.path.isdir(dest_path) and not os.path.islink(dest_path):
+                shutil.rmtree(dest_path)
+            else:
+                os.remove(dest_path)
+        if os.path.isfile(src_path):
+            try:
+                os.link(src_path, dest_path)
+                continue
+            except OSError:
+                pass
+        os.symlink(os.path.abspath(src_path), dest_path)
+
+
+def extract_model(model_dir: str, cache_dir: str = MODEL_CACHE_DIR) -> Tuple[str, Dict[str, float]]:
+    """Return a directory holding the extracted predictor for model_dir, and per-phase timings in seconds"""
+    timings = {}
+    if is_extracted_model(model_dir):
+        logger.info(f"Using pre-extracted model in {model_dir}")
+        return model_dir, timings
+
+    archive = find_model_archive(model_dir)
+    if archive is None:
+        raise FileNotFoundError(f"No model tar.gz file found in {model_dir}. Files: {os.listdir(model_dir)}")
+
+    start = time.perf_counter()
+    digest = archive_digest(archive, cache_dir)
+    timings["hash"] = time.perf_counter() - start
+    target = os.path.join(cache_dir, digest)
+
+    if os.path.exists(os.path.join(target, _COMPLETE_MARKER)):
+        logger.info(f"Model cache hit for {archive} ({digest[:12]}), hash {timings['hash']:.2f} s")
+        return target, timings
+
+    start = time.perf_counter()
+    staging = f"{target}.tmp-{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    extract_archive(archive, staging)
+    open(os.path.join(staging, _COMPLETE_MARKER), "w").close()
+    try:
+        os.rename(staging, target)
+    except OSError:
+        # Another process finished extracting the same archive first
+        shutil.rmtree(staging, ignore_errors=True)
+    timings["extract"] = time.perf_counter() - start
+    logger.info(f"Model cache miss for {archive} ({digest[:12]}), hash {timings['hash']:.2f} s, extract {timings['extract']:.2f} s")
+    return target, timings
+
+
+def prepare_model(model_dir: str, cache_dir: str = MODEL_CACHE_DIR) -> Tuple[str, Dict[str, float]]:
+    """Return a directory holding the predictor to serve for model_dir, and per-phase timings in seconds
+
+    The extracted predictor, or with AG_SLIM_MODEL its slim artifact (see autogluon_serving.slim).
+    """
+    path, timings = extract_model(model_dir, cache_dir)
+    # Imported here, as it imports this module
+    from autogluon_serving import slim
+
+    if slim.SLIM_MODEL:
+        path = slim.slim_model(path, timings, cache_dir)
+    return path, timings
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Extract an AutoGluon model archive through the content-addressed cache")
+    parser.add_argument("--model-dir", default="/opt/ml/model")
+    parser.add_argument("--cache-dir", default=MODEL_CACHE_DIR)
+    parser.add_argument("--link-to", help="Directory to populate with links to the extracted model")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    path, _ = prepare_model(args.model_dir, args.cache_dir)
+    if args.link_to:
+        link_tree(path, args.link_to)
+        path = args.link_to
+    logger.info(f"Model ready in {path} after {time.perf_counter() - start:.2f} s")
+    print(path)
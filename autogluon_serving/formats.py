@@ -0,0 +1,187 @@
+"""Content negotiation, columnar (Arrow IPC / Parquet) payloads and JSON response encoding"""
+
+import gzip
+import json
+import os
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CONTENT_TYPE_JSON = "application/json"
+CONTENT_TYPE_CSV = "text/csv"
+CONTENT_TYPE_ARROW = "application/vnd.apache.arrow.stream"
+CONTENT_TYPE_PARQUET = "application/x-parquet"
+CONTENT_TYPE_PARQUET_IANA = "application/vnd.apache.parquet"
+
+COLUMNAR_CONTENT_TYPES = (CONTENT_TYPE_ARROW, CONTENT_TYPE_PARQUET, CONTENT_TYPE_PARQUET_IANA)
+
+# JSON layouts for predictions:
+#   records - [{"col": value, ...}, ...]
+#   split   - {"columns": [...], "data": [[row 0 values], [row 1 values], ...]}, as pandas and MLflow's dataframe_split
+#   values  - [[column 0 values], [column 1 values], ...]
+# AG_JSON_ORIENT sets the deployment default; unset keeps each runtime's historical layout
+JSON_ORIENTS = ("records", "split", "values")
+DEFAULT_JSON_ORIENT = os.environ.get("AG_JSON_ORIENT")
+
+# Responses smaller than this are not worth compressing
+COMPRESSION_MIN_BYTES = int(os.environ.get("AG_COMPRESSION_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.environ.get("AG_GZIP_LEVEL", "5"))
+ZSTD_LEVEL = int(os.environ.get("AG_ZSTD_LEVEL", "3"))
+
+
+def media_type(header: Optional[str], default: str = CONTENT_TYPE_JSON) -> str:
+    """Strip parameters (e.g. charset) from a Content-Type header value"""
+    if not header:
+        return default
+    return header.split(";")[0].strip().lower()
+
+
+def is_columnar(content_type: str) -> bool:
+    return media_type(content_type) in COLUMNAR_CONTENT_TYPES
+
+
+def negotiate_columnar(accept: Optional[str]) -> Optional[str]:
+    """Return the first columnar media type listed in an Accept header, or None if JSON should be used"""
+    if not accept:
+        return None
+    for item in accept.split(","):
+        candidate = media_type(item)
+        if candidate in COLUMNAR_CONTENT_TYPES:
+            return candidate
+    return None
+
+
+def decode_columnar(body, content_type: str) -> pd.DataFrame:
+    """Decode an Arrow IPC stream or Parquet body straight into a DataFrame"""
+    # py_buffer wraps the request body without copying it
+    buffer = pa.py_buffer(body)
+    if media_type(content_type) == CONTENT_TYPE_ARROW:
+        table = pa.ipc.open_stream(buffer).read_all()
+    else:
+        table = pq.read_table(pa.BufferReader(buffer))
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def encode_columnar(frame: pd.DataFrame, content_type: str) -> bytes:
+    """Encode a DataFrame as an Arrow IPC stream or Parquet file"""
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    if media_type(content_type) == CONTENT_TYPE_ARROW:
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        pq.write_table(table, sink)
+    return sink.getvalue().to_pybytes()
+
+
+def negotiate_orient(accept: Optional[str], default: Optional[str] = DEFAULT_JSON_ORIENT) -> Optional[str]:
+    """Read the JSON layout from an "orient" parameter of the Accept header, e.g. application/json; orient=split"""
+    if accept:
+        for item in accept.split(","):
+            for param in item.split(";")[1:]:
+                key, _, value = param.partition("=")
+                if key.strip().lower() == "orient":
+                    orient = value.strip().strip('"').lower()
+                    if orient not in JSON_ORIENTS:
+                        raise ValueError(f"Unsupported orient '{orient}', expected one of {JSON_ORIENTS}")
+                    return orient
+    return default
+
+
+def _column_values(column: pd.Series):
+    """Return a column as a contiguous NumPy array when it is numeric, as a list of Python values otherwise"""
+    if column.dtype.kind in "biuf":
+        return np.ascontiguousarray(column.to_numpy())
+    return column.astype(object).where(column.notna(), None).tolist()
+
+
+def _to_jsonable(prediction: pd.DataFrame, orient: Optional[str]):
+    if orient is None or orient == "records":
+        return prediction.to_dict(orient="records")
+    columns = [_column_values(prediction[c]) for c in prediction.columns]
+    if orient == "values":
+        return columns
+    rows = list(zip(*(c.tolist() if isinstance(c, np.ndarray) else c for c in columns)))
+    return {"columns": [str(c) for c in prediction.columns], "data": rows}
+
+
+def _nan_to_none(value):
+    """value with NaN replaced by None, the standard library would write it as bare NaN, which is not JSON"""
+    if isinstance(value, np.ndarray):
+        value = value.tolist()
+    if isinstance(value, float):
+        return None if value != value else value
+    if isinstance(value, dict):
+        return {k: _nan_to_none(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_nan_to_none(v) for v in value]
+    return value
+
+
+def encode_json(prediction: pd.DataFrame, orient: Optional[str] = DEFAULT_JSON_ORIENT, envelope: Optional[Dict[str, Any]] = None, key: str = "predictions") -> bytes:
+    """Encode predictions as JSON in the given orient, optionally as envelope[key] of a response object
+
+    Numeric columns are written straight from their NumPy buffers when orjson is installed; NaN is written as null.
+    """
+    body = _to_jsonable(prediction, orient)
+    if envelope is not None:
+        body = {key: body, **envelope}
+    if orjson is not None:
+        return orjson.dumps(body, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(_nan_to_none(body), default=str).encode("utf-8")
+
+
+def decode_json(body):
+    """Parse a JSON request body, with orjson when it is installed"""
+    if orjson is not None:
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError:
+            # orjson is strict JSON, the standard library also accepts NaN and Infinity
+            pass
+    return json.loads(body)
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Pick zstd (when available) or gzip from an Accept-Encoding header, honouring q=0"""
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    for coding in ("zstd", "gzip"):
+        if coding == "zstd" and zstandard is None:
+            continue
+        if accepted.get(coding, accepted.get("*", 0.0)) > 0:
+            return coding
+    return None
+
+
+def compress(body: bytes, encoding: Optional[str]):
+    """Compress a response body, returning (body, Content-Encoding or None)"""
+    if encoding is None or len(body) < COMPRESSION_MIN_BYTES:
+        return body, None
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body), "zstd"
+    return gzip.compress(body, compresslevel=GZIP_LEVEL), "gzip"
@@ -0,0 +1,32 @@
+"""gunicorn settings for preload-then-fork serving of an ASGI app
+
+Used as ``gunicorn -c python:autogluon_serving.gunicorn_conf <module>:<app>``. The app module is
+imported (and the predictor loaded) once in the parent, which then forks AG_WORKERS workers.
+"""
+
+from autogluon_serving import metrics, prefork, reload
+
+preload_app = True
+workers = prefork.WORKERS
+worker_class = "uvicorn.workers.UvicornWorker"
+timeout = 300
+
+
+def when_ready(server):
+    prefork.log_memory("Parent")
+
+
+def pre_fork(server, worker):
+    prefork.before_fork()
+
+
+def post_fork(server, worker):
+    prefork.after_fork()
+    # Whichever worker answers a /metrics scrape reports the totals of all of them
+    metrics.share()
+    # Watcher threads of the parent's model reloaders do not survive the fork
+    reload.start_watchers()
+
+
+def post_worker_init(worker):
+    prefork.log_memory(f"Worker {worker.pid}")
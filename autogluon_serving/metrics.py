@@ -0,0 +1,299 @@
+"""Prometheus metrics for the prediction path: per-stage timers, row count histograms and error counters
+
+Every request is split into stages (``queue``, ``decode``, ``transform``, ``predict``, ``postprocess``,
+``encode``, ``compress``) timed with :class:`Timings`. Stage durations, rows per request, rows per
+predictor call and errors are kept in process-local histograms and counters and rendered in the
+Prometheus text format by :func:`render`. With ``AG_SERVER_TIMING=true`` a request's stage
+durations are also returned in its ``Server-Timing`` header.
+
+Processes serving the same endpoint (gunicorn workers, DJL Python workers) call :func:`share`,
+which periodically writes their metrics to ``AG_METRICS_DIR``; :func:`render` adds up those of
+all live processes, so a scrape reports the whole server whichever worker answers it. The process
+serving the metrics port also answers ``GET /profile`` with a profile of itself, see
+:mod:`autogluon_serving.profiling`.
+"""
+
+import bisect
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence
+from urllib.parse import parse_qsl
+
+from autogluon_serving.profiling import TOKEN_HEADER, ProfilingError, capture_profile
+
+logger = logging.getLogger(__name__)
+
+SERVER_TIMING = os.environ.get("AG_SERVER_TIMING", "false").lower() == "true"
+METRICS_DIR = os.environ.get("AG_METRICS_DIR", "/tmp/autogluon-metrics")
+CONTENT_TYPE_METRICS = "text/plain; version=0.0.4; charset=utf-8"
+_SHARE_INTERVAL_S = 5.0
+# Metrics not refreshed for this long belong to a process that is gone (or to an earlier container run)
+_STALE_AFTER_S = 60.0
+
+_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+_ROW_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096, 16384, 65536)
+_LOAD_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+class _Metric:
+    """Counter or histogram with at most one label, cheap enough to update on every call"""
+
+    def __init__(self, name: str, help: str, label: Optional[str] = None, buckets: Optional[Sequence[float]] = None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = tuple(buckets) if buckets is not None else None
+        # label value -> [count per bucket..., count above the last bucket, sum] or [count]
+        self._values: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def _series(self, label_value: str) -> List[float]:
+        series = self._values.get(label_value)
+        if series is None:
+            size = len(self.buckets) + 2 if self.buckets is not None else 1
+            series = self._values.setdefault(label_value, [0] * size)
+        return series
+
+    def inc(self, label_value: str = "", amount: float = 1):
+        with self._lock:
+            self._series(label_value)[0] += amount
+
+    def observe(self, value: float, label_value: str = ""):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series(label_value)
+            series[index] += 1
+            series[-1] += value
+
+    def snapshot(self) -> Dict[str, List[float]]:
+        with self._lock:
+            return {label_value: list(series) for label_value, series in self._values.items()}
+
+    def render(self, values: Dict[str, List[float]]) -> List[str]:
+        kind = "histogram" if self.buckets is not None else "counter"
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {kind}"]
+        for label_value, series in sorted(values.items()):
+            labels = f'{self.label}="{label_value}"' if self.label else ""
+            if self.buckets is None:
+                lines.append(f"{self.name}{{{labels}}} {series[0]:g}" if labels else f"{self.name} {series[0]:g}")
+                continue
+            prefix = labels + "," if labels else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f'{self.name}_bucket{{{prefix}le="{le}"}} {cumulative:g}')
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{suffix} {cumulative:g}")
+        return lines
+
+
+STAGE_SECONDS = _Metric("autogluon_stage_duration_seconds", "Time spent in each stage of the prediction path", "stage", _LATENCY_BUCKETS)
+REQUEST_SECONDS = _Metric("autogluon_request_duration_seconds", "Time to serve a prediction request", buckets=_LATENCY_BUCKETS)
+REQUEST_ROWS = _Metric("autogluon_request_rows", "Rows per prediction request", buckets=_ROW_BUCKETS)
+BATCH_ROWS = _Metric("autogluon_batch_rows", "Rows per predictor call, after micro-batching and prediction cache hits", buckets=_ROW_BUCKETS)
+ERRORS = _Metric("autogluon_errors_total", "Failed requests by the stage that failed", "stage")
+# Multi-model serving, see autogluon_serving.store
+STORE_HITS = _Metric("autogluon_model_store_hits_total", "Requests for a store model already loaded", "model")
+STORE_MISSES = _Metric("autogluon_model_store_misses_total", "Requests for a store model that was not loaded", "model")
+STORE_LOAD_SECONDS = _Metric("autogluon_model_store_load_duration_seconds", "Time to load a store model", "model", _LOAD_BUCKETS)
+STORE_EVICTIONS = _Metric("autogluon_model_store_evictions_total", "Store models evicted to stay within the memory budget", "model")
+REJECTED = _Metric("autogluon_rejected_total", "Requests shed by admission control by reason", "reason")
+METRICS = (STAGE_SECONDS, REQUEST_SECONDS, REQUEST_ROWS, BATCH_ROWS, ERRORS, STORE_HITS, STORE_MISSES, STORE_LOAD_SECONDS, STORE_EVICTIONS, REJECTED)
+
+_current_timings: "contextvars.ContextVar[Optional[Timings]]" = contextvars.ContextVar("autogluon_timings", default=None)
+
+
+class Timings:
+    """Stage durations of one request (or one predictor call), recorded in the stage histograms as they complete"""
+
+    def __init__(self, count_errors: bool = True):
+        # Off for a predictor call shared by several requests, which are retried one by one when it fails
+        self.count_errors = count_errors
+        self.started = time.perf_counter()
+        self.durations: Dict[str, float] = {}
+        self.failed_stage: Optional[str] = None
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            if self.count_errors:
+                ERRORS.inc(name)
+            self.failed_stage = name
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            STAGE_SECONDS.observe(elapsed, name)
+            self.durations[name] = self.durations.get(name, 0.0) + elapsed
+
+    def merge(self, other: "Timings"):
+        """Add the stages of a shared predictor call to this request, without recording them again"""
+        for name, elapsed in other.durations.items():
+            self.durations[name] = self.durations.get(name, 0.0) + elapsed
+
+    def finish(self, rows: Optional[int], failed: bool = False):
+        """Record the request's total duration and rows, counting a failure outside of the timed stages as a request error"""
+        if failed:
+            if self.failed_stage is None:
+                ERRORS.inc("request")
+            return
+        REQUEST_SECONDS.observe(time.perf_counter() - self.started)
+        if rows is not None:
+            REQUEST_ROWS.observe(rows)
+
+    def server_timing(self) -> str:
+        """Server-Timing header value, durations in milliseconds"""
+        entries = [f"{name};dur={elapsed * 1000:.2f}" for name, elapsed in self.durations.items()]
+        entries.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.2f}")
+        return ", ".join(entries)
+
+    @contextmanager
+    def activate(self):
+        """Make these the timings of code that cannot be passed them, e.g. an MLflow pyfunc's predict"""
+        token = _current_timings.set(self)
+        try:
+            yield self
+        finally:
+            _current_timings.reset(token)
+
+
+def current_timings() -> Timings:
+    """Timings of the request being served, or fresh ones outside of a request"""
+    timings = _current_timings.get()
+    return timings if timings is not None else Timings()
+
+
+# Set once this process publishes its metrics for the others, see share()
+_sharing = threading.Event()
+
+
+def snapshot() -> Dict[str, Dict[str, List[float]]]:
+    return {metric.name: metric.snapshot() for metric in METRICS}
+
+
+def _shared_snapshots(directory: str) -> List[Dict]:
+    """Metrics last written by the other live processes sharing directory"""
+    snapshots = []
+    try:
+        filenames = os.listdir(directory)
+    except FileNotFoundError:
+        return snapshots
+    for filename in filenames:
+        pid, ext = os.path.splitext(filename)
+        if ext != ".json" or not pid.isdigit() or int(pid) == os.getpid():
+            continue
+        path = os.path.join(directory, filename)
+        try:
+            if time.time() - os.path.getmtime(path) > _STALE_AFTER_S:
+                # Its counts leave the totals, which Prometheus sees as a counter reset
+                os.remove(path)
+                continue
+            with open(path) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def render(directory: Optional[str] = None) -> str:
+    """All metrics in the Prometheus text format, summed over the processes sharing directory"""
+    totals = snapshot()
+    for shared in _shared_snapshots(directory or METRICS_DIR) if _sharing.is_set() else ():
+        for name, values in shared.items():
+            merged = totals.setdefault(name, {})
+            for label_value, series in values.items():
+                current = merged.setdefault(label_value, [0] * len(series))
+                if len(current) == len(series):
+                    merged[label_value] = [a + b for a, b in zip(current, series)]
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render(totals.get(metric.name, {})))
+    return "\n".join(lines) + "\n"
+
+
+def _write_snapshot(directory: str):
+    path = os.path.join(directory, f"{os.getpid()}.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(snapshot(), f)
+    os.replace(path + ".tmp", path)
+
+
+def share(directory: str = METRICS_DIR, port: int = 0):
+    """Periodically publish this process's metrics for the other processes of the server to render
+
+    With a port, also serve GET /metrics on it from whichever process manages to bind it first;
+    the others keep trying, so another process takes over when that one exits.
+    """
+    if _sharing.is_set():
+        return
+    _sharing.set()
+    os.makedirs(directory, exist_ok=True)
+
+    def run():
+        server = None
+        while True:
+            try:
+                _write_snapshot(directory)
+            except OSError as e:
+                logger.warning(f"Could not write metrics to {directory}: {e}")
+            if port and server is None:
+                server = _start_http_server(port, directory)
+            time.sleep(_SHARE_INTERVAL_S)
+
+    threading.Thread(target=run, name="autogluon-metrics", daemon=True).start()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    directory = METRICS_DIR
+
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        if path == "/profile":
+            self._profile(query)
+            return
+        if path != "/metrics":
+            self.send_error(404)
+            return
+        self._send(render(self.directory).encode("utf-8"), CONTENT_TYPE_METRICS)
+
+    def _profile(self, query: str):
+        try:
+            content, content_type, headers = capture_profile(dict(parse_qsl(query)), self.headers.get(TOKEN_HEADER))
+        except ProfilingError as e:
+            self.send_error(e.status_code, str(e))
+            return
+        self._send(content, content_type, headers)
+
+    def _send(self, content: bytes, content_type: str, headers: Optional[Dict[str, str]] = None):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _start_http_server(port: int, directory: str) -> Optional[ThreadingHTTPServer]:
+    handler = type("MetricsHandler", (_MetricsHandler,), {"directory": directory})
+    try:
+        server = ThreadingHTTPServer(("0.0.0.0", port), handler)
+    except OSError:
+        # Another worker serves the metrics
+        return None
+    threading.Thread(target=server.serve_forever, name="autogluon-metrics-http", daemon=True).start()
+    logger.info(f"Serving Prometheus metrics on port {port}")
+    return server
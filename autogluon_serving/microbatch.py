@@ -0,0 +1,151 @@
+"""Micro-batching of concurrent prediction requests
+
+:class:`MicroBatcher` queues the frames of concurrent requests and serves them with one predictor
+call per batch on a dedicated thread, up to ``max_batch_size`` rows gathered for at most
+``max_batch_delay_ms``. Only frames with identical columns and dtypes, for the same model and
+predictor generation, share a call. A request whose future is cancelled while it is still queued
+(for example because its client disconnected) is dropped without being predicted.
+"""
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import pandas as pd
+
+from autogluon_serving.metrics import Timings
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Coalesce concurrent prediction requests into one predictor call per batch"""
+
+    def __init__(self, predict_fn: Callable[[pd.DataFrame, Optional[str], Timings, Any], pd.DataFrame], max_batch_size: int, max_batch_delay_ms: float):
+        self._predict_fn = predict_fn
+        self._max_batch_size = max_batch_size
+        self._max_batch_delay = max_batch_delay_ms / 1000.0
+        self._queue: "queue.Queue[Tuple[pd.DataFrame, Future, Optional[str], Timings, Any]]" = queue.Queue()
+        self._carry = None
+        # Moving average of the gap between submissions, used to skip waiting when traffic is sparse
+        self._arrival_interval = float("inf")
+        self._last_arrival = None
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name="autogluon-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, data: pd.DataFrame, model: Optional[str] = None, timings: Optional[Timings] = None, served=None) -> Future:
+        """Queue a frame for prediction by model, the returned future resolves to its slice of the batch result
+
+        The stages of the predictor call serving it are added to timings. served is the predictor
+        generation the request started on, requests are only batched with others of the same one.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._last_arrival is not None:
+                gap = now - self._last_arrival
+                if self._arrival_interval == float("inf"):
+                    self._arrival_interval = gap
+                else:
+                    self._arrival_interval = 0.8 * self._arrival_interval + 0.2 * gap
+            self._last_arrival = now
+        future = Future()
+        self._queue.put((data, future, model, timings if timings is not None else Timings(), served))
+        return future
+
+    def _get(self, timeout: Optional[float] = None):
+        """Next queued request that was not cancelled, marked as running so it no longer can be
+
+        Raises queue.Empty if none arrives within timeout, 0 only takes what is already queued.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if deadline is None:
+                item = self._queue.get()
+            else:
+                remaining = deadline - time.monotonic()
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            if item[1].set_running_or_notify_cancel():
+                return item
+
+    def _next_batch(self):
+        """Block for the first request, then collect more until the batch is full or the delay expires"""
+        first = self._carry if self._carry is not None else self._get()
+        self._carry = None
+        batch = [first]
+        rows = len(first[0])
+        # Waiting only pays off when another request is expected before the deadline
+        if self._arrival_interval > self._max_batch_delay and self._queue.empty():
+            return batch
+        deadline = time.monotonic() + self._max_batch_delay
+        while rows < self._max_batch_size:
+            try:
+                item = self._get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if rows + len(item[0]) > self._max_batch_size:
+                self._carry = item
+                break
+            batch.append(item)
+            rows += len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = []
+            try:
+                batch = self._next_batch()
+                # Only frames with identical columns and dtypes are merged so that one request
+                # cannot change how its neighbours' features are interpreted, and only requests
+                # for the same model share a predictor call
+                groups: Dict[tuple, list] = {}
+                for data, future, model, timings, served in batch:
+                    key = (served, model, tuple(zip(data.columns, data.dtypes.astype(str))))
+                    groups.setdefault(key, []).append((data, future, timings))
+                for (served, model, _), items in groups.items():
+                    self._dispatch(items, model, served)
+            except Exception as e:
+                # The thread serves every later request too, so it must outlive any one batch
+                logger.exception("Micro-batch failed")
+                for _, future, _, _, _ in batch:
+                    _fail(future, e)
+
+    def _dispatch(self, items, model, served):
+        if len(items) == 1:
+            data, future, timings = items[0]
+            self._predict_single(data, future, model, timings, served)
+            return
+        batch_timings = Timings(count_errors=False)
+        try:
+            combined = pd.concat([data for data, _, _ in items], ignore_index=True)
+            prediction = self._predict_fn(combined, model, batch_timings, served)
+        except Exception:
+            # Isolate the failing request(s) by predicting each one on its own
+            for data, future, timings in items:
+                self._predict_single(data, future, model, timings, served)
+            return
+        offset = 0
+        for data, future, timings in items:
+            # Every request in the batch waited for the whole predictor call
+            timings.merge(batch_timings)
+            _resolve(future, prediction.iloc[offset:offset + len(data)].reset_index(drop=True))
+            offset += len(data)
+
+    def _predict_single(self, data, future, model, timings, served):
+        try:
+            _resolve(future, self._predict_fn(data, model, timings, served))
+        except Exception as e:
+            _fail(future, e)
+
+
+def _resolve(future: Future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+def _fail(future: Future, error: BaseException):
+    if not future.done():
+        future.set_exception(error)
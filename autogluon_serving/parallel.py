@@ -0,0 +1,119 @@
+"""Parallel ensemble members: the base models of a stack ensemble predicted concurrently for small requests
+
+AutoGluon predicts the models an ensemble depends on one after another, each from the same
+transformed features, before the ensemble combines their outputs, so a request's latency is the sum
+of its members' latencies. With ``AG_PARALLEL_MEMBERS=true`` the trainer's prediction loop is
+replaced in memory by one that predicts every model whose inputs are ready at the same time on a
+thread pool: all base models of a level at once, then the stackers of the next level from their
+outputs. Each model is called exactly as AutoGluon calls it, so predictions are identical to the
+sequential loop. Tree libraries, CatBoost and torch release the GIL while predicting, which lets the
+members overlap on idle cores.
+
+Large calls are already spread over the cores by the members' own thread pools, so calls of more
+than ``AG_PARALLEL_MEMBERS_MAX_ROWS`` rows keep the sequential loop. The pool has
+``AG_PARALLEL_MEMBER_THREADS`` threads, by default the worker's thread budget (see
+``autogluon_serving.threads``).
+"""
+
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import pandas as pd
+from autogluon.core.models import StackerEnsembleModel
+
+from autogluon_serving.prefork import WORKERS
+from autogluon_serving.threads import intra_op_threads
+
+logger = logging.getLogger(__name__)
+
+PARALLEL_MEMBERS = os.environ.get("AG_PARALLEL_MEMBERS", "false").lower() == "true"
+# Threads predicting members at the same time, 0 for the worker's thread budget
+PARALLEL_MEMBER_THREADS = int(os.environ.get("AG_PARALLEL_MEMBER_THREADS", "0"))
+PARALLEL_MEMBERS_MAX_ROWS = int(os.environ.get("AG_PARALLEL_MEMBERS_MAX_ROWS", "64"))
+
+
+class ParallelMembers:
+    """Drop-in for a trainer's get_model_pred_proba_dict predicting independent models concurrently"""
+
+    def __init__(self, trainer, threads: int, max_rows: int = PARALLEL_MEMBERS_MAX_ROWS):
+        self.trainer = trainer
+        self.threads = threads
+        self.max_rows = max_rows
+        # The trainer's own method, bound before it is replaced on the instance
+        self.sequential = trainer.get_model_pred_proba_dict
+        self._executor = None
+        self._pid = None
+
+    def _pool(self) -> ThreadPoolExecutor:
+        # A pool created before a fork (by the warmup of a preloading parent) has no threads in the child
+        if self._executor is None or self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="autogluon-members")
+            self._pid = os.getpid()
+        return self._executor
+
+    def _predict(self, X: pd.DataFrame, model_name: str, model_pred_proba_dict: Dict):
+        start = time.perf_counter()
+        model = self.trainer.load_model(model_name=model_name)
+        if isinstance(model, StackerEnsembleModel):
+            y_pred_proba = model.predict_proba(X, infer=False, model_pred_proba_dict=model_pred_proba_dict)
+        else:
+            y_pred_proba = model.predict_proba(X)
+        return y_pred_proba, time.perf_counter() - start
+
+    def __call__(
+        self,
+        X: pd.DataFrame,
+        models: List[str],
+        model_pred_proba_dict: Optional[Dict] = None,
+        model_pred_time_dict: Optional[Dict] = None,
+        record_pred_time: bool = False,
+        use_val_cache: bool = False,
+    ):
+        if use_val_cache or len(X) > self.max_rows:
+            return self.sequential(X, models, model_pred_proba_dict, model_pred_time_dict, record_pred_time, use_val_cache)
+        if model_pred_proba_dict is None:
+            model_pred_proba_dict = {}
+        if model_pred_time_dict is None:
+            model_pred_time_dict = {}
+        if not model_pred_proba_dict:
+            pending = self.trainer._construct_model_pred_order(models)
+        else:
+            pending = self.trainer._construct_model_pred_order_with_pred_dict(models, models_to_ignore=list(model_pred_proba_dict))
+        graph = self.trainer.model_graph
+        while pending:
+            # Models none of whose inputs are still to be predicted, in AutoGluon's order
+            waiting = set(pending)
+            ready = [m for m in pending if not any(d in waiting for d in graph.predecessors(m))]
+            if len(ready) == 1:
+                results = [self._predict(X, ready[0], model_pred_proba_dict)]
+            else:
+                # The dict is only read while the wave runs, and updated once all of it is done
+                results = list(self._pool().map(lambda m: self._predict(X, m, model_pred_proba_dict), ready))
+            for model_name, (y_pred_proba, seconds) in zip(ready, results):
+                model_pred_proba_dict[model_name] = y_pred_proba
+                if record_pred_time:
+                    model_pred_time_dict[model_name] = seconds
+            pending = [m for m in pending if m not in model_pred_proba_dict]
+        if record_pred_time:
+            return model_pred_proba_dict, model_pred_time_dict
+        return model_pred_proba_dict
+
+
+def install_parallel(predictor, threads: Optional[int] = None) -> Optional[ParallelMembers]:
+    """Predict the predictor's independent models concurrently, when AG_PARALLEL_MEMBERS is enabled"""
+    if not PARALLEL_MEMBERS:
+        return None
+    trainer = predictor._trainer
+    if isinstance(trainer.get_model_pred_proba_dict, ParallelMembers):
+        return trainer.get_model_pred_proba_dict
+    threads = threads or PARALLEL_MEMBER_THREADS or intra_op_threads(WORKERS)
+    if threads < 2:
+        logger.info("Parallel ensemble members disabled, the worker has a single thread")
+        return None
+    parallel = ParallelMembers(trainer, threads)
+    trainer.get_model_pred_proba_dict = parallel
+    logger.info(f"Predicting ensemble members on {threads} threads for calls of up to {parallel.max_rows} rows")
+    return parallel
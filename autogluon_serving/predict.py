@@ -0,0 +1,39 @@
+"""Predictions of a TabularPredictor as a DataFrame, timed stage by stage"""
+
+from typing import Optional
+
+import pandas as pd
+from autogluon.core.constants import REGRESSION
+from autogluon.core.utils import get_pred_from_proba_df
+
+from autogluon_serving.metrics import BATCH_ROWS, Timings, current_timings
+
+
+def predict_frame(predictor, data: pd.DataFrame, model_name: Optional[str] = None, timings: Optional[Timings] = None) -> pd.DataFrame:
+    """Predictions, plus a ``<class>_proba`` column per class for classification
+
+    The predictor's feature transforms, the model call and the post-processing are timed as
+    the ``transform``, ``predict`` and ``postprocess`` stages of timings (by default those of the
+    request being served).
+    """
+    timings = timings if timings is not None else current_timings()
+    BATCH_ROWS.observe(len(data))
+    # The predictor skips its feature transforms for empty frames, which they would reject
+    transformed = not data.empty
+    if transformed:
+        with timings.stage("transform"):
+            data = predictor.transform_features(data)
+    with timings.stage("predict"):
+        if predictor.problem_type == REGRESSION:
+            prediction = predictor.predict(data, model=model_name, as_pandas=True, transform_features=not transformed)
+        else:
+            pred_proba = predictor.predict_proba(data, model=model_name, as_pandas=True, transform_features=not transformed)
+    with timings.stage("postprocess"):
+        if predictor.problem_type != REGRESSION:
+            pred = get_pred_from_proba_df(pred_proba, problem_type=predictor.problem_type)
+            pred_proba.columns = [str(c) + "_proba" for c in pred_proba.columns]
+            pred.name = str(pred.name) + "_pred" if pred.name is not None else "pred"
+            prediction = pd.concat([pred, pred_proba], axis=1)
+        if isinstance(prediction, pd.Series):
+            prediction = prediction.to_frame()
+    return prediction
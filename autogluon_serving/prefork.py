@@ -0,0 +1,126 @@
+"""Preload-then-fork serving: load the predictor once in the parent and share it with forked workers
+
+With ``AG_WORKERS`` > 1 the runtimes serve through gunicorn with ``preload_app``: the parent
+process loads the predictor, keeps its models in memory and warms it up, then forks the workers,
+which share those pages copy-on-write. See ``autogluon_serving.gunicorn_conf`` for the hooks.
+
+Run ``python -m autogluon_serving.prefork`` inside the container to report unique and shared
+memory per worker.
+"""
+
+import argparse
+import gc
+import logging
+import os
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from autogluon_serving.threads import intra_op_threads, limit_threads
+
+logger = logging.getLogger(__name__)
+
+WORKERS = int(os.environ.get("AG_WORKERS", "1"))
+# Models kept in memory in the parent: "best", "all" or a comma-separated list of model names
+PERSIST_MODELS = os.environ.get("AG_PERSIST_MODELS", "best")
+# Thread variables of the environment before preloading set them to 1
+_thread_env: Dict[str, Optional[str]] = {}
+
+
+@contextmanager
+def preloading(workers: int = WORKERS):
+    """Load the predictor for forked workers, a no-op for a single worker"""
+    if workers <= 1:
+        yield
+        return
+    # Objects allocated while the collector is off are not scanned (and their pages not
+    # written) before gc.freeze() moves them out of the collector's reach in pre_fork
+    gc.disable()
+    # OpenMP and BLAS thread pools do not survive fork, so the parent must not start any. The
+    # variables are set before the model libraries are imported, which is when OpenMP reads them
+    for name, value in limit_threads(1).items():
+        _thread_env.setdefault(name, value)
+    yield
+
+
+def persist_models(predictor):
+    """Keep the predictor's models in memory instead of loading them from disk on every call"""
+    models = PERSIST_MODELS if PERSIST_MODELS in ("best", "all") else PERSIST_MODELS.split(",")
+    persisted = predictor.persist(models=models)
+    logger.info(f"Persisted models in memory: {persisted}")
+
+
+def before_fork():
+    gc.freeze()
+
+
+def after_fork(workers: int = WORKERS):
+    """Per-worker setup in a freshly forked worker"""
+    gc.enable()
+    # The parent's own settings, under the worker's budget set below
+    for name, value in _thread_env.items():
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
+    # Each worker gets its share of the thread budget for the thread pools it starts on first use
+    limit_threads(intra_op_threads(workers))
+
+
+def memory_usage(pid="self") -> Dict[str, int]:
+    """Resident memory of a process in bytes, split into memory unique to it and memory shared with others"""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    return {
+        "rss": fields.get("Rss", 0),
+        # Proportional set size: shared pages divided among the processes that map them
+        "pss": fields.get("Pss", 0),
+        "unique": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+        "shared": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+    }
+
+
+def child_pids(parent_pid: int) -> List[int]:
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces, the parent pid is the second field after it
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == parent_pid:
+            children.append(int(entry))
+    return sorted(children)
+
+
+def log_memory(label: str, pid="self"):
+    usage = memory_usage(pid)
+    logger.info(
+        f"{label} memory: {usage['unique'] / 2**20:.1f} MiB unique, {usage['shared'] / 2**20:.1f} MiB shared, "
+        f"{usage['pss'] / 2**20:.1f} MiB PSS"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report unique and shared memory of a serving parent and its workers")
+    parser.add_argument("--pid", type=int, default=1, help="Parent (gunicorn master) process id")
+    args = parser.parse_args()
+    rows = [("parent", args.pid)] + [("worker", pid) for pid in child_pids(args.pid)]
+    total_pss = 0
+    print(f"{'process':<8} {'pid':>7} {'unique MiB':>11} {'shared MiB':>11} {'PSS MiB':>9}")
+    for role, pid in rows:
+        usage = memory_usage(pid)
+        total_pss += usage["pss"]
+        print(f"{role:<8} {pid:>7} {usage['unique'] / 2**20:>11.1f} {usage['shared'] / 2**20:>11.1f} {usage['pss'] / 2**20:>9.1f}")
+    # The PSS of all processes adds up to the memory the instance actually needs
+    print(f"{'total':<8} {'':>7} {'':>11} {'':>11} {total_pss / 2**20:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""On-demand profiles of a live serving process: sampled CPU stacks or traced allocations
+
+With ``AG_PROFILING=true`` each runtime answers ``/profile`` (on the metrics port for DJLServing)
+with a profile of its own process over the next ``seconds``:
+
+- ``kind=cpu`` samples the Python stack of every busy thread every ``AG_PROFILING_INTERVAL_MS``,
+  returned as collapsed stacks (``format=collapsed``, one ``thread;frame;...;frame count`` line
+  per stack, for flamegraph.pl, speedscope or inferno) or as a pstats file (``format=pstats``, for
+  ``python -m pstats`` or snakeviz). Threads waiting in locks, queues, selectors or sockets are left out
+  unless ``idle=true``, and ``thread`` keeps the threads whose name starts with it.
+- ``kind=memory`` traces allocations with tracemalloc, returned as collapsed stacks weighted by
+  the bytes still allocated at the end (``format=collapsed``) or as a tracemalloc snapshot
+  (``format=snapshot``, for ``tracemalloc.Snapshot.load``).
+
+Sampling runs on the thread answering the request and only reads the other threads' frames, so it
+costs one stack walk per thread and interval. Tracing allocations slows every allocation down for
+the duration of the capture. Captures are limited to ``AG_PROFILING_MAX_SECONDS`` and one at a
+time per process, and require the ``X-AG-Profiling-Token`` header when ``AG_PROFILING_TOKEN`` is set.
+"""
+
+import collections
+import hmac
+import logging
+import marshal
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import Dict, Mapping, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PROFILING = os.environ.get("AG_PROFILING", "false").lower() == "true"
+PROFILING_TOKEN = os.environ.get("AG_PROFILING_TOKEN", "")
+PROFILING_MAX_SECONDS = float(os.environ.get("AG_PROFILING_MAX_SECONDS", "60"))
+PROFILING_INTERVAL_MS = float(os.environ.get("AG_PROFILING_INTERVAL_MS", "10"))
+# Frames kept per traced allocation
+PROFILING_TRACEMALLOC_FRAMES = int(os.environ.get("AG_PROFILING_TRACEMALLOC_FRAMES", "32"))
+TOKEN_HEADER = "X-AG-Profiling-Token"
+_DEFAULT_SECONDS = 10.0
+_FORMATS = {"cpu": ("collapsed", "pstats"), "memory": ("collapsed", "snapshot")}
+_CONTENT_TYPE_TEXT = "text/plain; charset=utf-8"
+_CONTENT_TYPE_BINARY = "application/octet-stream"
+# Innermost Python frames of a thread waiting for work rather than running: waits in the standard
+# library, and loops whose waits are C calls (an executor's queue, the watchers' sleep)
+_IDLE_FILES = ("threading.py", "selectors.py", "queue.py", "socket.py")
+_IDLE_LOOPS = {("thread.py", "_worker"), ("reload.py", "_watch"), ("metrics.py", "run")}
+# Worker threads of a pool are reported together: autogluon-inference_0 and _1 as autogluon-inference
+_THREAD_INDEX = re.compile(r"[_-]\d+$")
+
+_capture_lock = threading.Lock()
+
+
+class ProfilingError(RuntimeError):
+    """A profile that cannot be captured, answered with status_code"""
+
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _short_path(filename: str) -> str:
+    """filename relative to the longest sys.path entry containing it, e.g. pandas/core/frame.py"""
+    best = ""
+    for entry in sys.path:
+        if entry and filename.startswith(entry.rstrip(os.sep) + os.sep) and len(entry) > len(best):
+            best = entry.rstrip(os.sep) + os.sep
+    return filename[len(best):]
+
+
+def _is_idle(frame) -> bool:
+    filename = os.path.basename(frame.f_code.co_filename)
+    return filename in _IDLE_FILES or (filename, frame.f_code.co_name) in _IDLE_LOOPS
+
+
+def sample_stacks(seconds: float, interval_s: float, thread: Optional[str] = None, idle: bool = False) -> collections.Counter:
+    """Samples of each (thread name, stack of code objects from the outermost) of the other threads"""
+    own = threading.get_ident()
+    stacks = collections.Counter()
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            name = names.get(ident, str(ident))
+            if ident == own or (thread and not name.startswith(thread)) or (not idle and _is_idle(frame)):
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            stacks[(_THREAD_INDEX.sub("", name), tuple(reversed(stack)))] += 1
+        time.sleep(interval_s)
+    return stacks
+
+
+def _label(code) -> str:
+    return f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+
+def collapsed_stacks(stacks: collections.Counter) -> str:
+    """Sampled stacks in the collapsed format of flamegraph.pl, the thread name as the root frame"""
+    lines = collections.Counter()
+    for (name, stack), count in stacks.items():
+        lines[";".join([name.replace(";", ":")] + [_label(code) for code in stack])] += count
+    return "".join(f"{line} {count}\n" for line, count in sorted(lines.items()))
+
+
+def pstats_dump(stacks: collections.Counter, interval_s: float) -> bytes:
+    """Sampled stacks as the marshalled statistics read by pstats.Stats
+
+    A sample counts as one call of each function on its stack, lasting one interval: internal
+    time for the innermost function, cumulative time for the others.
+    """
+    stats = {}
+
+    def key(code):
+        return (code.co_filename, code.co_firstlineno, code.co_name)
+
+    for (_, stack), count in stacks.items():
+        elapsed = count * interval_s
+        seen = set()
+        for depth, code in enumerate(stack):
+            func = key(code)
+            entry = stats.setdefault(func, [0, 0, 0.0, 0.0, {}])
+            innermost = depth == len(stack) - 1
+            if innermost:
+                entry[2] += elapsed
+            if func in seen:
+                # A recursive call, its time is already counted once for this sample
+                continue
+            seen.add(func)
+            entry[0] += count
+            entry[1] += count
+            entry[3] += elapsed
+            if depth:
+                caller = entry[4].setdefault(key(stack[depth - 1]), [0, 0, 0.0, 0.0])
+                caller[0] += count
+                caller[1] += count
+                caller[2] += elapsed if innermost else 0.0
+                caller[3] += elapsed
+    return marshal.dumps(
+        {
+            func: (cc, nc, tt, ct, {caller: tuple(values) for caller, values in callers.items()})
+            for func, (cc, nc, tt, ct, callers) in stats.items()
+        }
+    )
+
+
+def trace_allocations(seconds: float, frames: int = PROFILING_TRACEMALLOC_FRAMES) -> tracemalloc.Snapshot:
+    """Allocations made over seconds and still alive at the end, or all traced ones when tracing was already on"""
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start(frames)
+    try:
+        time.sleep(seconds)
+        snapshot = tracemalloc.take_snapshot()
+    finally:
+        if started:
+            tracemalloc.stop()
+    return snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+
+
+def collapsed_allocations(snapshot: tracemalloc.Snapshot) -> str:
+    """Traced allocations in the collapsed format, weighted by their size in bytes"""
+    lines = []
+    for statistic in snapshot.statistics("traceback"):
+        # Frames are ordered from the outermost
+        stack = ";".join(f"{_short_path(frame.filename)}:{frame.lineno}".replace(";", ":") for frame in statistic.traceback)
+        lines.append(f"{stack} {statistic.size}\n")
+    return "".join(sorted(lines))
+
+
+def _snapshot_bytes(snapshot: tracemalloc.Snapshot) -> bytes:
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "snapshot")
+        snapshot.dump(path)
+        with open(path, "rb") as f:
+            return f.read()
+
+
+def authorized(token: Optional[str]) -> bool:
+    return not PROFILING_TOKEN or hmac.compare_digest((token or "").encode("utf-8"), PROFILING_TOKEN.encode("utf-8"))
+
+
+def capture_profile(params: Mapping[str, str], token: Optional[str] = None) -> Tuple[bytes, str, Dict[str, str]]:
+    """Capture the profile described by the request's query parameters: content, content type and headers
+
+    Blocks for the duration of the capture, call it off the event loop. Raises ProfilingError.
+    """
+    if not PROFILING:
+        raise ProfilingError("Profiling is disabled (AG_PROFILING)", 404)
+    if not authorized(token):
+        raise ProfilingError(f"Missing or wrong {TOKEN_HEADER} header", 403)
+    kind = params.get("kind", "cpu")
+    if kind not in _FORMATS:
+        raise ProfilingError(f"Unknown profile kind '{kind}', expected one of {sorted(_FORMATS)}", 400)
+    fmt = params.get("format", "collapsed")
+    if fmt not in _FORMATS[kind]:
+        raise ProfilingError(f"Unknown {kind} profile format '{fmt}', expected one of {list(_FORMATS[kind])}", 400)
+    try:
+        seconds = float(params.get("seconds", _DEFAULT_SECONDS))
+    except ValueError:
+        raise ProfilingError(f"Invalid seconds '{params.get('seconds')}'", 400)
+    if not 0 < seconds <= PROFILING_MAX_SECONDS:
+        raise ProfilingError(f"seconds must be in (0, {PROFILING_MAX_SECONDS:g}] (AG_PROFILING_MAX_SECONDS)", 400)
+
+    if not _capture_lock.acquire(blocking=False):
+        raise ProfilingError("Another profile is being captured in this process", 409)
+    try:
+        logger.info(f"Capturing a {kind} profile for {seconds:g} s")
+        start = time.perf_counter()
+        if kind == "cpu":
+            interval_s = PROFILING_INTERVAL_MS / 1000
+            stacks = sample_stacks(seconds, interval_s, params.get("thread"), params.get("idle", "false").lower() == "true")
+            if fmt == "pstats":
+                content, content_type, extension = pstats_dump(stacks, interval_s), _CONTENT_TYPE_BINARY, "pstats"
+            else:
+                content, content_type, extension = collapsed_stacks(stacks).encode("utf-8"), _CONTENT_TYPE_TEXT, "folded"
+            summary = f"{sum(stacks.values())} samples"
+        else:
+            snapshot = trace_allocations(seconds)
+            if fmt == "snapshot":
+                content, content_type, extension = _snapshot_bytes(snapshot), _CONTENT_TYPE_BINARY, "tracemalloc"
+            else:
+                content, content_type, extension = collapsed_allocations(snapshot).encode("utf-8"), _CONTENT_TYPE_TEXT, "folded"
+            summary = f"{sum(trace.size for trace in snapshot.traces) / 2**20:.1f} MB traced"
+    finally:
+        _capture_lock.release()
+    logger.info(f"Captured a {kind} profile in {time.perf_counter() - start:.1f} s, {summary}")
+    headers = {"Content-Disposition": f'attachment; filename="profile-{os.getpid()}-{kind}.{extension}"'}
+    return content, content_type, headers
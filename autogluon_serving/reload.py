@@ -0,0 +1,166 @@
+"""Hot model reload: a new model artifact is loaded and warmed in the background, then swapped in between requests
+
+A ``ModelReloader`` holds the ``ServedModel`` a runtime serves by default. Requests read
+``reloader.served`` once and keep that model until they finish, so a swap never changes the
+predictor under a running request. A new model is picked up in two ways:
+
+- a watcher thread stats the model artifact under the model directory (the archive, or the
+  predictor files of an extracted model) every ``AG_MODEL_RELOAD_INTERVAL_S`` seconds (``0``
+  disables it) and reloads once a change has been stable for a whole interval, so that a file
+  still being copied is not loaded
+- with ``AG_RELOAD_ENDPOINT=true``, the runtimes' ``POST /reload`` endpoints call ``reload()``
+  directly, and require the ``X-AG-Reload-Token`` header when ``AG_RELOAD_TOKEN`` is set
+
+The new model goes through the same steps as at startup (extraction cache, compiled members,
+thread budget, warmup and calibration) while the old one keeps serving. A failed load leaves the
+old model in place, and the same artifact is not retried until it changes again. Once requests
+still running on the old model have finished, its memory is collected.
+"""
+
+import gc
+import hmac
+import logging
+import os
+import threading
+import time
+import weakref
+from typing import Dict, List, Optional
+
+from autogluon_serving.cache import artifact_fingerprint
+from autogluon_serving.prefork import memory_usage
+from autogluon_serving.store import ServedModel
+
+logger = logging.getLogger(__name__)
+
+MODEL_RELOAD_INTERVAL_S = float(os.environ.get("AG_MODEL_RELOAD_INTERVAL_S", "10"))
+# POST /reload swaps the served model, so it is off unless enabled
+RELOAD_ENDPOINT = os.environ.get("AG_RELOAD_ENDPOINT", "false").lower() == "true"
+RELOAD_TOKEN = os.environ.get("AG_RELOAD_TOKEN", "")
+RELOAD_TOKEN_HEADER = "X-AG-Reload-Token"
+# How long the old model is waited for (requests still running on it) before giving up collecting it
+_RELEASE_TIMEOUT_S = 300.0
+
+# Reloaders of this process, their watcher threads are restarted in forked workers
+_reloaders: List["ModelReloader"] = []
+
+
+class ReloadInProgress(RuntimeError):
+    pass
+
+
+class ReloadNotAllowed(RuntimeError):
+    """A POST /reload request refused, answered with status_code"""
+
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def check_reload_request(token: Optional[str]):
+    """Raise ReloadNotAllowed unless POST /reload is enabled and the request carries the token, if one is set"""
+    if not RELOAD_ENDPOINT:
+        raise ReloadNotAllowed("The reload endpoint is disabled (AG_RELOAD_ENDPOINT)", 404)
+    if RELOAD_TOKEN and not hmac.compare_digest((token or "").encode("utf-8"), RELOAD_TOKEN.encode("utf-8")):
+        raise ReloadNotAllowed(f"Missing or wrong {RELOAD_TOKEN_HEADER} header", 403)
+
+
+class ModelReloader:
+    """The model served by default, replaced by a freshly loaded one when its artifact changes"""
+
+    def __init__(self, model_dir: str, served: ServedModel, interval_s: float = MODEL_RELOAD_INTERVAL_S):
+        self.model_dir = model_dir
+        self.served = served
+        self.interval_s = interval_s
+        self.generation = 1
+        self.last_reload: Optional[Dict] = None
+        self._fingerprint = artifact_fingerprint(model_dir)
+        # A changed fingerprint is loaded when it is seen again unchanged at the next check
+        self._pending = None
+        self._failed = None
+        self._lock = threading.Lock()
+        self._thread = None
+        _reloaders.append(self)
+
+    def start(self):
+        """Start watching the model directory, unless disabled or already watching in this process"""
+        if self.interval_s <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._thread = threading.Thread(target=self._watch, name="autogluon-reload", daemon=True)
+        self._thread.start()
+        logger.info(f"Watching {self.model_dir} for new models every {self.interval_s:g} s")
+
+    def _watch(self):
+        while True:
+            time.sleep(self.interval_s)
+            try:
+                self.check()
+            except ReloadInProgress:
+                continue
+            except Exception as e:
+                logger.error(f"Reloading the model from {self.model_dir} failed, still serving generation {self.generation}: {e}")
+
+    def check(self) -> bool:
+        """Reload if the artifact changed and has stayed the same since the previous check"""
+        fingerprint = artifact_fingerprint(self.model_dir)
+        if fingerprint is None or fingerprint in (self._fingerprint, self._failed):
+            self._pending = None
+            return False
+        if fingerprint != self._pending:
+            # Possibly still being written, wait for it to settle
+            self._pending = fingerprint
+            return False
+        self.reload(fingerprint)
+        return True
+
+    def reload(self, fingerprint=None) -> Dict:
+        """Load the model directory's current model and swap it in; raises ReloadInProgress during another reload"""
+        if not self._lock.acquire(blocking=False):
+            raise ReloadInProgress(f"A reload of {self.model_dir} is already in progress")
+        try:
+            fingerprint = fingerprint or artifact_fingerprint(self.model_dir)
+            start = time.perf_counter()
+            try:
+                served = ServedModel.load(self.model_dir)
+            except Exception as e:
+                self._failed = fingerprint
+                self.last_reload = {"generation": self.generation, "error": str(e), "time": time.time()}
+                raise
+            old, self.served = self.served, served
+            self._fingerprint, self._pending = fingerprint, None
+            self.generation += 1
+            self.last_reload = {"generation": self.generation, "load_seconds": time.perf_counter() - start, "time": time.time()}
+        finally:
+            self._lock.release()
+        logger.info(f"Swapped in model generation {self.generation} from {self.model_dir}, loaded in {self.last_reload['load_seconds']:.2f} s")
+        threading.Thread(target=_release, args=(weakref.ref(old.predictor),), name="autogluon-release", daemon=True).start()
+        return self.stats()
+
+    def stats(self) -> Dict:
+        return {
+            "model_dir": self.model_dir,
+            "generation": self.generation,
+            "watch_interval_s": self.interval_s,
+            "reloading": self._lock.locked(),
+            "last_reload": self.last_reload,
+        }
+
+
+def _release(predictor_ref):
+    """Collect the swapped out predictor once the requests still using it are done"""
+    rss = memory_usage()["rss"]
+    # A predictor loaded before fork was frozen out of the collector's reach, see prefork.before_fork
+    gc.unfreeze()
+    deadline = time.monotonic() + _RELEASE_TIMEOUT_S
+    while predictor_ref() is not None and time.monotonic() < deadline:
+        time.sleep(1.0)
+        gc.collect()
+    if predictor_ref() is not None:
+        logger.warning(f"Previous model still referenced after {_RELEASE_TIMEOUT_S:g} s, not released")
+        return
+    logger.info(f"Released the previous model, RSS {rss / 1024 ** 2:,.0f} MB -> {memory_usage()['rss'] / 1024 ** 2:,.0f} MB")
+
+
+def start_watchers():
+    """Restart the watcher threads of reloaders inherited from the parent, in a forked worker"""
+    for reloader in _reloaders:
+        reloader.start()
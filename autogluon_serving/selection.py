@@ -0,0 +1,168 @@
+"""Per-request model selection by name, latency tier or deadline
+
+Requests can name a member of the predictor (``model=LightGBM``), a latency tier
+(``tier=fast``) or a latency budget (``deadline_ms=50``). For a deadline, the selector picks
+the most accurate model whose measured p99 latency for the request's batch size fits in the
+remaining budget. Latencies are recorded for every predictor call and seeded at startup by
+``calibrate``.
+"""
+
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from autogluon.core.constants import REGRESSION
+
+from autogluon_serving.warmup import WARMUP_BATCH_SIZES, synthetic_rows
+
+logger = logging.getLogger(__name__)
+
+TIERS = ("best", "fast")
+# Deployment-wide defaults, used when a request does not select a model itself
+DEFAULT_MODEL = os.environ.get("AG_DEFAULT_MODEL") or None
+DEFAULT_TIER = os.environ.get("AG_DEFAULT_TIER") or None
+DEFAULT_DEADLINE_MS = float(os.environ["AG_DEFAULT_DEADLINE_MS"]) if os.environ.get("AG_DEFAULT_DEADLINE_MS") else None
+# Latency samples kept per (model, batch size bucket)
+LATENCY_WINDOW = int(os.environ.get("AG_LATENCY_WINDOW", "512"))
+
+
+def _validation_rows(predictor) -> Optional[int]:
+    """Rows pred_time_val was measured on: the validation data, or the out-of-fold training rows of a bagged predictor"""
+    trainer = predictor._trainer
+    return getattr(trainer, "_num_rows_val", None) or getattr(trainer, "_num_rows_train", None)
+
+
+def _bucket(rows: int) -> int:
+    """Power-of-two batch size bucket, so 1, 2, 3-4, 5-8, ... rows share latency statistics"""
+    return max(rows - 1, 0).bit_length()
+
+
+class ModelSelector:
+    """Chooses which predictor member serves a request and tracks per-model latency"""
+
+    def __init__(self, predictor):
+        self.predictor = predictor
+        self.best = predictor.model_best
+        leaderboard = predictor.leaderboard(silent=True)
+        leaderboard = leaderboard[leaderboard["can_infer"]]
+        self.scores = dict(zip(leaderboard["model"], leaderboard["score_val"]))
+        # Seconds per row predicting the validation data, missing when unknown
+        val_rows = _validation_rows(predictor)
+        self._val_latency = {}
+        if val_rows:
+            for model, seconds in zip(leaderboard["model"], leaderboard["pred_time_val"]):
+                if seconds is not None and math.isfinite(seconds):
+                    self._val_latency[model] = seconds / val_rows
+        self._latencies = {}  # (model, bucket) -> deque of seconds
+        self._lock = threading.Lock()
+        self._sort_candidates()
+
+    def _sort_candidates(self):
+        # Most accurate first, the default model first among equally accurate ones
+        self.candidates = sorted(self.scores, key=lambda m: (-self.scores[m], m != self.best))
+
+    def record(self, model: str, rows: int, seconds: float):
+        key = (model, _bucket(rows))
+        with self._lock:
+            samples = self._latencies.get(key)
+            if samples is None:
+                samples = self._latencies[key] = deque(maxlen=LATENCY_WINDOW)
+            samples.append(seconds)
+
+    def p99(self, model: str, rows: int) -> Optional[float]:
+        """p99 latency in seconds for a batch of rows, extrapolated from the nearest measured batch size"""
+        bucket = _bucket(rows)
+        with self._lock:
+            measured = {b: list(s) for (m, b), s in self._latencies.items() if m == model and s}
+        if not measured:
+            return None
+        nearest = min(measured, key=lambda b: (abs(b - bucket), -b))
+        latency = float(np.percentile(measured[nearest], 99))
+        if nearest < bucket:
+            # Assume latency grows linearly with rows beyond the largest measured batch
+            latency *= 2 ** (bucket - nearest)
+        return latency
+
+    def _estimate(self, model: str, rows: int) -> float:
+        latency = self.p99(model, rows)
+        if latency is None:
+            # Not measured yet, fall back on the validation-time prediction cost, scaled to the request's rows
+            per_row = self._val_latency.get(model)
+            latency = per_row * rows if per_row is not None else math.inf
+        return latency
+
+    def select(
+        self,
+        rows: int,
+        model: Optional[str] = None,
+        tier: Optional[str] = None,
+        deadline_ms: Optional[float] = None,
+        elapsed_ms: float = 0.0,
+    ) -> str:
+        """Name of the model that serves a request, raises ValueError for an unknown model or tier"""
+        if model is None and tier is None and deadline_ms is None:
+            model, tier, deadline_ms = DEFAULT_MODEL, DEFAULT_TIER, DEFAULT_DEADLINE_MS
+        if model is not None:
+            if model not in self.scores:
+                raise ValueError(f"Unknown model '{model}', expected one of {self.candidates}")
+            return model
+        if tier is not None and tier not in TIERS:
+            raise ValueError(f"Unknown tier '{tier}', expected one of {TIERS}")
+        if tier == "fast":
+            return min(self.candidates, key=lambda m: self._estimate(m, rows))
+        if deadline_ms is not None:
+            budget = (deadline_ms - elapsed_ms) / 1000
+            for candidate in self.candidates:
+                if self._estimate(candidate, rows) <= budget:
+                    return candidate
+            # Nothing fits, answer as fast as possible rather than fail
+            return min(self.candidates, key=lambda m: self._estimate(m, rows))
+        return self.best
+
+    def calibrate(self, batch_sizes: Optional[List[int]] = None):
+        """Measure every candidate on synthetic rows, dropping the ones that cannot predict"""
+        if batch_sizes is None:
+            batch_sizes = WARMUP_BATCH_SIZES
+        for model in list(self.candidates):
+            for num_rows in batch_sizes:
+                data = synthetic_rows(self.predictor, num_rows)
+                try:
+                    # The first call loads the model, only the second one is timed
+                    for record in (False, True):
+                        start = time.perf_counter()
+                        if self.predictor.problem_type != REGRESSION:
+                            self.predictor.predict_proba(data, model=model, as_pandas=True)
+                        else:
+                            self.predictor.predict(data, model=model, as_pandas=True)
+                        if record:
+                            self.record(model, num_rows, time.perf_counter() - start)
+                except Exception as e:
+                    logger.warning(f"Model {model} failed on {num_rows} synthetic rows, not selectable: {e}")
+                    self.scores.pop(model, None)
+                    self._sort_candidates()
+                    break
+        for model in self.candidates:
+            latencies = ", ".join(
+                f"{n} rows {self.p99(model, n) * 1000:.1f} ms" for n in batch_sizes if self.p99(model, n) is not None
+            )
+            logger.info(f"Model {model} (score_val {self.scores[model]:.4f}): {latencies}")
+
+    def stats(self) -> Dict[str, Dict]:
+        """Validation score and p50/p99 latency in ms per measured batch size bucket for each model"""
+        with self._lock:
+            snapshot = {key: list(samples) for key, samples in self._latencies.items() if samples}
+        stats = {model: {"score_val": float(self.scores[model]), "latency_ms": {}} for model in self.candidates}
+        for (model, bucket), samples in sorted(snapshot.items()):
+            if model in stats:
+                stats[model]["latency_ms"][f"<={2 ** bucket}"] = {
+                    "p50": float(np.percentile(samples, 50)) * 1000,
+                    "p99": float(np.percentile(samples, 99)) * 1000,
+                    "count": len(samples),
+                }
+        return stats
@@ -0,0 +1,274 @@
+"""Slim serving artifacts: the predictor without its training-only state
+
+A trained predictor keeps everything it needs to fit more models: the internal training and
+validation data (``utils/data``), out-of-fold predictions of stacked models, validation predictions
+(``utils/attr``) and every model trained, including the ones no ensemble served depends on. A
+serving container extracts all of it and loads part of it on every start. With
+``AG_SLIM_MODEL=true`` the predictor returned by ``autogluon_serving.extract.prepare_model`` is
+instead a clone of it keeping only what predicting needs:
+
+- the models of ``AG_SLIM_MODELS`` (``best``, ``all`` or a comma-separated list of model names)
+  and the models they depend on, the others are deleted
+- with ``AG_SLIM_REFIT_FULL=true``, those models refit on the training and validation data first
+  (the original models are then deleted, and predictions change)
+- no training data, out-of-fold or validation predictions (AutoGluon's ``save_space``)
+
+The clone is built once per model and options into ``AG_MODEL_CACHE_DIR/slim/<key>``, and only used
+when the predictions of its models on synthetic rows and on the predictor's internal data are
+identical to the original's (refit models are compared to the original best model, but not
+required to match). Its ``slim.json`` reports the differences in size, load time and resident
+memory; otherwise the full predictor is served. As the clone is a regular predictor, every runtime
+loads it as is, and only the models it keeps can be selected per request.
+
+Run ``python -m autogluon_serving.slim --model-dir <model> --output <dir>`` to build a slim
+artifact ahead of time and ship it instead of the full one.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+from autogluon_serving.extract import MODEL_CACHE_DIR, PREDICTOR_FILES, extract_model
+
+logger = logging.getLogger(__name__)
+
+SLIM_MODEL = os.environ.get("AG_SLIM_MODEL", "false").lower() == "true"
+# Models kept: "best", "all" or a comma-separated list of model names
+SLIM_MODELS = os.environ.get("AG_SLIM_MODELS", "best")
+SLIM_REFIT_FULL = os.environ.get("AG_SLIM_REFIT_FULL", "false").lower() == "true"
+SLIM_DIR = "slim"
+_REPORT = "slim.json"
+_COMPLETE_MARKER = ".complete"
+# Rows of the internal training data cached with the predictor the predictions are compared on
+_CHECK_ROWS = 1000
+
+
+def slim_key(model_path: str, models: str = SLIM_MODELS, refit_full: bool = SLIM_REFIT_FULL) -> str:
+    """Key of the slim artifact of model_path: the predictor's location and files, and the options"""
+    digest = hashlib.sha256(os.path.realpath(model_path).encode("utf-8"))
+    for name in PREDICTOR_FILES:
+        stat = os.stat(os.path.join(model_path, name))
+        digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+    digest.update(f"models={models},refit_full={refit_full}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def directory_size(path: str) -> int:
+    """Bytes of the files under path, links not followed"""
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            size += os.lstat(os.path.join(root, name)).st_size
+    return size
+
+
+def _load(path: str):
+    from autogluon.tabular import TabularPredictor
+
+    return TabularPredictor.load(path, require_py_version_match=False)
+
+
+def _kept_models(predictor, models: str) -> Optional[List[str]]:
+    """Models named by models, None for all of them"""
+    if models == "all":
+        return None
+    if models == "best":
+        return [predictor.model_best]
+    names = [m.strip() for m in models.split(",") if m.strip()]
+    unknown = sorted(set(names) - set(predictor.model_names()))
+    if unknown:
+        raise ValueError(f"Unknown models {unknown}, the predictor has {predictor.model_names()}")
+    return names
+
+
+def _check_frames(predictor) -> List[Dict]:
+    """Rows to compare predictions on, as predict_proba keyword arguments"""
+    from autogluon_serving.warmup import synthetic_rows
+
+    frames = [{"data": synthetic_rows(predictor, 64)}]
+    # Rows of the internal training data, already transformed, when the artifact keeps them
+    for load in ("load_X_val", "load_X"):
+        try:
+            frames.append({"data": getattr(predictor._trainer, load)().head(_CHECK_ROWS), "transform_features": False})
+            break
+        except Exception:
+            continue
+    return frames
+
+
+def _predict(predictor, model: str, frame: Dict):
+    import numpy as np
+    from autogluon.core.constants import QUANTILE, REGRESSION
+
+    if predictor.problem_type in (REGRESSION, QUANTILE):
+        return np.asarray(predictor.predict(model=model, **frame), dtype=np.float64)
+    return np.asarray(predictor.predict_proba(model=model, as_multiclass=True, **frame), dtype=np.float64)
+
+
+def _max_difference(original, slim, pairs: Dict[str, str], frames: List[Dict]) -> Dict[str, float]:
+    """Largest absolute difference between the predictions of each original model and its slim counterpart"""
+    import numpy as np
+
+    differences = {}
+    for model, slim_model in pairs.items():
+        difference = 0.0
+        for frame in frames:
+            expected = _predict(original, model, frame)
+            actual = _predict(slim, slim_model, frame)
+            if expected.shape != actual.shape or not np.array_equal(np.isnan(expected), np.isnan(actual)):
+                difference = float("inf")
+                break
+            difference = max(difference, float(np.nanmax(np.abs(expected - actual), initial=0.0)))
+        differences[model] = difference
+    return differences
+
+
+def measure(path: str) -> Dict[str, float]:
+    """Seconds to load the predictor in path and keep its best model in memory, and the resident memory it adds
+
+    Measured in a fresh interpreter, so that neither artifact benefits from the other's imports and caches.
+    """
+    code = (
+        "import json, sys, time; import autogluon.tabular; "
+        "from autogluon_serving.prefork import memory_usage; "
+        "from autogluon_serving.slim import _load; "
+        "rss = memory_usage()['rss']; start = time.perf_counter(); "
+        "predictor = _load(sys.argv[1]); predictor.persist(models='best'); "
+        "print(json.dumps({'load_s': time.perf_counter() - start, 'rss_mb': (memory_usage()['rss'] - rss) / 2**20}))"
+    )
+    # The child imports this package from wherever the parent did
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [package_root, os.environ.get("PYTHONPATH")])))
+    result = subprocess.run([sys.executable, "-c", code, path], capture_output=True, text=True, check=True, env=env)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def build_slim(model_path: str, target: str, models: str = SLIM_MODELS, refit_full: bool = SLIM_REFIT_FULL) -> Dict:
+    """Write the slim clone of the predictor in model_path to target, returning its report
+
+    Raises ValueError when the clone's predictions differ from the original's.
+    """
+    start = time.perf_counter()
+    original = _load(model_path)
+    # The original is never modified: the clone is pruned and refit, staged next to target and
+    # renamed, so that a concurrent or interrupted build is never picked up
+    staging = f"{target}.tmp-{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    try:
+        # Compiled members of refit models would be stale, they are compiled again for the clone
+        ignore = (_COMPLETE_MARKER, _REPORT) + (("compiled",) if refit_full else ())
+        shutil.copytree(model_path, staging, symlinks=True, ignore=shutil.ignore_patterns(*ignore))
+        slim = _load(staging)
+        kept = _kept_models(slim, models)
+        pairs = {m: m for m in (kept if kept is not None else slim.model_names())}
+        if refit_full:
+            refit = slim.refit_full(model=kept if kept is not None else "all", set_best_to_refit_full=True)
+            # Refit models are compared to the original best model, their predictions are expected to change
+            pairs = {original.model_best: slim.model_best}
+            kept = [refit[m] for m in kept] if kept is not None else list(refit.values())
+        if kept is not None:
+            best = slim.model_best
+            slim.delete_models(models_to_keep=kept, dry_run=False)
+            if best not in slim.model_names():
+                slim.set_model_best(model=kept[0], save_trainer=True)
+        slim.save_space(remove_data=True, remove_fit_stack=True)
+        slim = _load(staging)
+
+        frames = _check_frames(original)
+        differences = _max_difference(original, slim, pairs, frames)
+        changed = {m: d for m, d in differences.items() if d > 0}
+        if changed and not refit_full:
+            raise ValueError(f"Predictions of the slim artifact differ from the original's: {changed}")
+
+        report = {
+            "models": slim.model_names(),
+            "model_best": slim.model_best,
+            "refit_full": refit_full,
+            "max_abs_diff": differences,
+            "size_mb": {"original": directory_size(model_path) / 2**20, "slim": directory_size(staging) / 2**20},
+            "build_s": time.perf_counter() - start,
+        }
+        for name, path in (("original", model_path), ("slim", staging)):
+            try:
+                for metric, value in measure(path).items():
+                    report.setdefault(metric, {})[name] = value
+            except (subprocess.CalledProcessError, ValueError, IndexError) as e:
+                logger.warning(f"Cannot measure loading the {name} predictor: {e}")
+        with open(os.path.join(staging, _REPORT), "w") as f:
+            json.dump(report, f, indent=2)
+        open(os.path.join(staging, _COMPLETE_MARKER), "w").close()
+        try:
+            os.rename(staging, target)
+        except OSError:
+            # Another process built the same artifact first
+            shutil.rmtree(staging, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return report
+
+
+def _log_report(report: Dict):
+    def delta(metric: str, unit: str) -> str:
+        values = report.get(metric, {})
+        if "original" not in values or "slim" not in values:
+            return f"{metric} not measured"
+        return f"{metric} {values['original']:.2f} -> {values['slim']:.2f} {unit}"
+
+    logger.info(
+        f"Slim artifact keeps {report['models']} (best {report['model_best']}): "
+        f"{delta('size_mb', 'MB')}, {delta('load_s', 's')}, {delta('rss_mb', 'MB')}, max abs diff {report['max_abs_diff']}"
+    )
+
+
+def slim_model(model_path: str, timings: Optional[Dict[str, float]] = None, cache_dir: str = MODEL_CACHE_DIR) -> str:
+    """Directory of the slim artifact of the predictor in model_path, built on first use
+
+    The phase is added to timings as ``slim``. Falls back to model_path when the artifact cannot be built.
+    """
+    start = time.perf_counter()
+    target = os.path.join(cache_dir, SLIM_DIR, slim_key(model_path))
+    if os.path.exists(os.path.join(target, _COMPLETE_MARKER)):
+        logger.info(f"Slim artifact cache hit in {target}")
+        path = target
+    else:
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            _log_report(build_slim(model_path, target))
+            path = target
+        except Exception as e:
+            logger.warning(f"Cannot build a slim artifact of {model_path}, serving the full predictor: {e}")
+            path = model_path
+    if timings is not None:
+        timings["slim"] = time.perf_counter() - start
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a slim serving artifact of an AutoGluon predictor")
+    parser.add_argument("--model-dir", default=os.environ.get("MODEL_PATH", "/opt/ml/model"))
+    parser.add_argument("--output", required=True, help="Directory to write the slim predictor to")
+    parser.add_argument("--models", default=SLIM_MODELS, help="Models to keep: best, all or a comma-separated list")
+    parser.add_argument("--refit-full", action="store_true", default=SLIM_REFIT_FULL)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    output = os.path.abspath(args.output)
+    if os.path.exists(output):
+        parser.error(f"{output} already exists")
+    # The full predictor, even when AG_SLIM_MODEL is set
+    model_path, _ = extract_model(args.model_dir)
+    report = build_slim(model_path, output, args.models, args.refit_full)
+    _log_report(report)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
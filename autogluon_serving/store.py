@@ -0,0 +1,331 @@
+"""Multi-model serving: predictors of a model store loaded on demand into a memory-budgeted LRU
+
+With ``AG_MODEL_STORE_DIR`` set, a container serves the models of that directory next to its own.
+Each subdirectory is a model, laid out like ``/opt/ml/model`` (a model archive or an extracted
+predictor), or holds one such directory per version::
+
+    store/
+      tenant-a/model.tar.gz
+      tenant-b/1/model.tar.gz
+      tenant-b/2/model.tar.gz
+
+A request names its model with the ``target_model`` query parameter or the ``X-AG-Target-Model``
+header: ``tenant-b/1`` for a version, ``tenant-b`` for its latest (highest) version. Requests
+without one are served by the container's own model.
+
+A model that is not loaded yet is loaded on the store's loader thread: extracted through the
+model cache, kept in memory, compiled, warmed up and calibrated like the container's own model.
+Its requests wait for it at most ``AG_MODEL_STORE_LOAD_TIMEOUT_S`` and are otherwise answered with
+503 and a ``Retry-After`` while the load goes on. Loaded models stay in memory, least recently
+used first out, within ``AG_MODEL_STORE_MEMORY_MB`` per process. A model's size is the growth of
+the process's resident memory while it loads (loads run one at a time), at least its size on disk.
+Models listed in ``AG_MODEL_STORE_PINNED`` are loaded at startup and never evicted.
+"""
+
+import gc
+import logging
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from autogluon_serving.cache import PredictionCache
+from autogluon_serving.compiled import install_compiled
+from autogluon_serving.decoding import InputDecoder
+from autogluon_serving.extract import find_model_archive, is_extracted_model, prepare_model
+from autogluon_serving.metrics import STORE_EVICTIONS, STORE_HITS, STORE_LOAD_SECONDS, STORE_MISSES, Timings
+from autogluon_serving.parallel import install_parallel
+from autogluon_serving.predict import predict_frame
+from autogluon_serving.prefork import WORKERS, memory_usage, persist_models
+from autogluon_serving.selection import ModelSelector
+from autogluon_serving.threads import configure_models, intra_op_threads
+from autogluon_serving.warmup import warmup
+
+logger = logging.getLogger(__name__)
+
+MODEL_STORE_DIR = os.environ.get("AG_MODEL_STORE_DIR") or None
+# Memory for the store's models in each worker process, 0 for half of the container's memory
+MODEL_STORE_MEMORY_MB = float(os.environ.get("AG_MODEL_STORE_MEMORY_MB", "0"))
+MODEL_STORE_PINNED = [m.strip() for m in os.environ.get("AG_MODEL_STORE_PINNED", "").split(",") if m.strip()]
+MODEL_STORE_LOAD_TIMEOUT_S = float(os.environ.get("AG_MODEL_STORE_LOAD_TIMEOUT_S", "30"))
+TARGET_MODEL_PARAM = "target_model"
+TARGET_MODEL_HEADER = "x-ag-target-model"
+# How long a listing of the store directory is reused, new models and versions show up after this
+_SCAN_INTERVAL_S = 10.0
+
+
+class ModelLoading(RuntimeError):
+    """The requested model is still loading, retry after retry_after seconds"""
+
+    def __init__(self, key: str, retry_after: int):
+        super().__init__(f"Model '{key}' is loading, retry in {retry_after} s")
+        self.key = key
+        self.retry_after = retry_after
+
+
+class ServedModel:
+    """A predictor with what serves it: model selection, request decoding and the prediction cache"""
+
+    def __init__(self, predictor, model_dir: str, name: Optional[str] = None):
+        self.name = name
+        self.predictor = predictor
+        self.path = predictor.path
+        self.selector = ModelSelector(predictor)
+        self.decoder = InputDecoder.from_env(predictor)
+        self.cache = PredictionCache.from_env(predictor, model_dir)
+
+    @classmethod
+    def load(cls, model_dir: str, name: Optional[str] = None) -> "ServedModel":
+        """Extract and load the predictor in model_dir, keep it in memory, compile, warm up and calibrate it"""
+        model_path, _ = prepare_model(model_dir)
+        from autogluon.tabular import TabularPredictor
+
+        predictor = TabularPredictor.load(model_path, require_py_version_match=False)
+        persist_models(predictor)
+        install_compiled(predictor)
+        configure_models(predictor, intra_op_threads(WORKERS))
+        install_parallel(predictor)
+        warmup(predictor)
+        served = cls(predictor, model_dir, name)
+        served.selector.calibrate()
+        return served
+
+    def predict(self, data: pd.DataFrame, model_name: Optional[str] = None, timings: Optional[Timings] = None) -> pd.DataFrame:
+        """Predict data, serving repeated rows of the default model from the prediction cache when it is enabled"""
+        model_name = model_name or self.selector.best
+        if self.cache is not None and model_name == self.selector.best:
+            return self.cache.predict(data, lambda missing: self.predict_frame(missing, model_name, timings))
+        return self.predict_frame(data, model_name, timings)
+
+    def predict_frame(self, data: pd.DataFrame, model_name: Optional[str] = None, timings: Optional[Timings] = None) -> pd.DataFrame:
+        """Predict data with the predictor, recording the latency for model selection"""
+        model_name = model_name or self.selector.best
+        start = time.perf_counter()
+        prediction = predict_frame(self.predictor, data, model_name, timings)
+        self.selector.record(model_name, len(data), time.perf_counter() - start)
+        return prediction
+
+
+def memory_limit() -> int:
+    """Memory available to the container in bytes: its cgroup limit, or the machine's memory"""
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        # cgroup v1 reports an unlimited group as a huge number
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value)
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+def _version_key(version: str):
+    """Sort key comparing the numeric parts of versions as numbers, so that 10 comes after 9"""
+    return [(0, int(part), "") if part.isdigit() else (1, 0, part) for part in re.split(r"[._-]", version)]
+
+
+def _disk_usage(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+
+def _is_model_dir(path: str) -> bool:
+    if is_extracted_model(path):
+        return True
+    return any(f.endswith(".tar.gz") and "model" in f and os.path.isfile(os.path.join(path, f)) for f in os.listdir(path))
+
+
+class ModelStore:
+    """Predictors of a model store directory, loaded on first use and evicted least recently used"""
+
+    def __init__(self, root: str, max_bytes: int, pinned: List[str] = (), load_timeout_s: float = MODEL_STORE_LOAD_TIMEOUT_S):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.load_timeout_s = load_timeout_s
+        self._models: "OrderedDict[str, ServedModel]" = OrderedDict()
+        self._loading: Dict[str, Future] = {}
+        self._stats: Dict[str, Dict] = {}
+        self._catalog: Dict[str, str] = {}
+        self._latest: Dict[str, str] = {}
+        self._scanned_at = -math.inf
+        self._lock = threading.Lock()
+        # Loads run one at a time, so that each one's memory growth is its own
+        self._load_lock = threading.Lock()
+        self._executor = None
+        self.pinned = set()
+        for target in pinned:
+            try:
+                self.pinned.add(self.resolve(target))
+            except ValueError as e:
+                logger.warning(f"Cannot pin {target}: {e}")
+
+    @classmethod
+    def from_env(cls) -> Optional["ModelStore"]:
+        """Store of AG_MODEL_STORE_DIR, None when multi-model serving is disabled"""
+        if MODEL_STORE_DIR is None:
+            return None
+        max_bytes = int(MODEL_STORE_MEMORY_MB * 1024 * 1024) if MODEL_STORE_MEMORY_MB > 0 else memory_limit() // 2
+        logger.info(f"Model store {MODEL_STORE_DIR}: {max_bytes / 1024 ** 2:,.0f} MB per process, pinned {MODEL_STORE_PINNED}")
+        return cls(MODEL_STORE_DIR, max_bytes, MODEL_STORE_PINNED)
+
+    def scan(self) -> Dict[str, str]:
+        """{key: model directory} of the store's models, keyed name or name/version"""
+        catalog = {}
+        for name in sorted(os.listdir(self.root)):
+            path = os.path.join(self.root, name)
+            if name.startswith(".") or not os.path.isdir(path):
+                continue
+            if _is_model_dir(path):
+                catalog[name] = path
+                continue
+            for version in sorted(os.listdir(path)):
+                version_path = os.path.join(path, version)
+                if not version.startswith(".") and os.path.isdir(version_path) and _is_model_dir(version_path):
+                    catalog[f"{name}/{version}"] = version_path
+        return catalog
+
+    def _refresh(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._scanned_at < _SCAN_INTERVAL_S:
+            return
+        catalog = self.scan()
+        latest = {}
+        for key in catalog:
+            name, _, version = key.partition("/")
+            if version and (name not in latest or _version_key(version) > _version_key(latest[name].partition("/")[2])):
+                latest[name] = key
+        with self._lock:
+            self._catalog, self._latest, self._scanned_at = catalog, latest, now
+
+    def resolve(self, target: str) -> str:
+        """Key of the model a request names, its latest version for a name alone; raises ValueError when unknown"""
+        for force in (False, True):
+            self._refresh(force)
+            key = target if target in self._catalog else self._latest.get(target)
+            if key is not None:
+                return key
+        raise ValueError(f"Unknown target model '{target}', expected one of {sorted(self._catalog)}")
+
+    def _model_stats(self, key: str) -> Dict:
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = {"hits": 0, "misses": 0, "loads": 0, "load_failures": 0, "evictions": 0, "load_seconds": None, "bytes": 0, "last_used": None}
+        return stats
+
+    def get(self, target: str, timeout: Optional[float] = None) -> ServedModel:
+        """The served model a request names, loading it if needed; raises ModelLoading if it is not ready within timeout"""
+        key = self.resolve(target)
+        with self._lock:
+            stats = self._model_stats(key)
+            stats["last_used"] = time.time()
+            served = self._models.get(key)
+            if served is not None:
+                self._models.move_to_end(key)
+                stats["hits"] += 1
+                STORE_HITS.inc(key)
+                return served
+            stats["misses"] += 1
+            STORE_MISSES.inc(key)
+            future = self._submit(key)
+        try:
+            return future.result(timeout=self.load_timeout_s if timeout is None else timeout)
+        except FutureTimeoutError:
+            raise ModelLoading(key, self._retry_after(key))
+
+    def _submit(self, key: str) -> Future:
+        # Called with self._lock held
+        future = self._loading.get(key)
+        if future is None:
+            if self._executor is None:
+                # Created on first use, after a preloading parent has forked its workers
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="autogluon-store")
+            future = self._loading[key] = self._executor.submit(self._load, key)
+        return future
+
+    def _retry_after(self, key: str) -> int:
+        with self._lock:
+            durations = [s["load_seconds"] for s in self._stats.values() if s["load_seconds"] is not None]
+        # Loads queue behind each other on the loader thread
+        queued = max(len(self._loading), 1)
+        return max(1, math.ceil(queued * (sum(durations) / len(durations) if durations else self.load_timeout_s)))
+
+    def _load(self, key: str) -> ServedModel:
+        with self._load_lock:
+            with self._lock:
+                served = self._models.get(key)
+            if served is not None:
+                return served
+            path = self._catalog[key]
+            before = memory_usage()["rss"]
+            start = time.perf_counter()
+            try:
+                served = ServedModel.load(path, key)
+            except Exception as e:
+                logger.error(f"Loading store model {key} from {path} failed: {e}")
+                with self._lock:
+                    self._model_stats(key)["load_failures"] += 1
+                    self._loading.pop(key, None)
+                raise
+            elapsed = time.perf_counter() - start
+            # Memory freed earlier may be reused by the load, the predictor's files are its smallest size
+            size = max(memory_usage()["rss"] - before, _disk_usage(served.path))
+        STORE_LOAD_SECONDS.observe(elapsed, key)
+        with self._lock:
+            stats = self._model_stats(key)
+            stats.update(loads=stats["loads"] + 1, load_seconds=elapsed, bytes=size)
+            self._models[key] = served
+            self._loading.pop(key, None)
+            evicted = self._evict(keep=key)
+        if evicted:
+            # Free the evicted predictors now rather than at the next collection
+            gc.collect()
+        logger.info(f"Loaded store model {key} in {elapsed:.2f} s, {size / 1024 ** 2:,.0f} MB, evicted {evicted}")
+        return served
+
+    def _evict(self, keep: str) -> List[str]:
+        """Evict least recently used models until the loaded ones fit in the budget; called with self._lock held"""
+        evicted = []
+        while self.used_bytes() > self.max_bytes:
+            victim = next((k for k in self._models if k != keep and k not in self.pinned), None)
+            if victim is None:
+                logger.warning(f"Store models {list(self._models)} use {self.used_bytes() / 1024 ** 2:,.0f} MB, over the budget, but none can be evicted")
+                break
+            del self._models[victim]
+            self._stats[victim]["evictions"] += 1
+            STORE_EVICTIONS.inc(victim)
+            evicted.append(victim)
+        return evicted
+
+    def used_bytes(self) -> int:
+        return sum(self._stats[key]["bytes"] for key in self._models)
+
+    def load_pinned(self):
+        """Load the pinned models now, on the calling thread"""
+        for key in sorted(self.pinned):
+            try:
+                self._load(key)
+            except Exception:
+                continue
+
+    def stats(self) -> Dict:
+        """Memory budget and use, and per model its state, size and load, hit and eviction counts"""
+        self._refresh()
+        with self._lock:
+            models = {}
+            for key in self._catalog:
+                state = "loaded" if key in self._models else "loading" if key in self._loading else "unloaded"
+                models[key] = {"state": state, "pinned": key in self.pinned, **self._stats.get(key, {})}
+            return {
+                "root": self.root,
+                "max_bytes": self.max_bytes,
+                "used_bytes": self.used_bytes(),
+                "latest": dict(self._latest),
+                "models": models,
+            }
@@ -0,0 +1,196 @@
+"""Streaming inference over CSV and JSON Lines bodies of any size
+
+The body is parsed in chunks of ``AG_STREAM_CHUNK_ROWS`` rows. Parsing, prediction and
+serialization each run in their own thread, connected by queues holding at most
+``AG_STREAM_QUEUE_DEPTH`` chunks, so peak memory depends on the chunk size and not on the size of
+the input. Serialized chunks are yielded as soon as they are ready.
+"""
+
+import asyncio
+import io
+import logging
+import os
+import queue
+import threading
+from typing import AsyncIterator, Callable, Iterator, Optional
+
+import pandas as pd
+
+from autogluon_serving.formats import CONTENT_TYPE_CSV, media_type
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE_JSONL = "application/jsonl"
+JSONL_CONTENT_TYPES = (CONTENT_TYPE_JSONL, "application/x-ndjson", "application/jsonlines")
+STREAM_CONTENT_TYPES = (CONTENT_TYPE_CSV,) + JSONL_CONTENT_TYPES
+STREAM_CHUNK_ROWS = int(os.environ.get("AG_STREAM_CHUNK_ROWS", "10000"))
+STREAM_QUEUE_DEPTH = int(os.environ.get("AG_STREAM_QUEUE_DEPTH", "2"))
+# How often blocked pipeline threads check whether the consumer went away
+_POLL_INTERVAL_S = 0.1
+_END = object()
+
+
+class _Failure:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=_POLL_INTERVAL_S)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _drain(q: queue.Queue, stop: threading.Event) -> Iterator:
+    """Yield queued items until the end marker, re-raising an upstream failure"""
+    while not stop.is_set():
+        try:
+            item = q.get(timeout=_POLL_INTERVAL_S)
+        except queue.Empty:
+            continue
+        if item is _END:
+            return
+        if isinstance(item, _Failure):
+            raise item.error
+        yield item
+
+
+class QueueReader(io.RawIOBase):
+    """Binary stream read by the parser thread and fed chunk by chunk, e.g. from a request body"""
+
+    def __init__(self, depth: int = STREAM_QUEUE_DEPTH):
+        super().__init__()
+        self._queue = queue.Queue(maxsize=depth)
+        self._buffer = memoryview(b"")
+        self._eof = False
+        self.aborted = threading.Event()
+
+    def readable(self) -> bool:
+        return True
+
+    def feed(self, data: bytes) -> bool:
+        """Queue data for the parser, blocking while it is behind, False once the pipeline stopped"""
+        return _put(self._queue, data, self.aborted)
+
+    def feed_nowait(self, data: bytes) -> bool:
+        try:
+            self._queue.put_nowait(data)
+            return True
+        except queue.Full:
+            return False
+
+    def end(self):
+        _put(self._queue, _END, self.aborted)
+
+    def abort(self):
+        self.aborted.set()
+
+    def readinto(self, b) -> int:
+        while not self._buffer and not self._eof:
+            try:
+                item = self._queue.get(timeout=_POLL_INTERVAL_S)
+            except queue.Empty:
+                if self.aborted.is_set():
+                    raise IOError("Stream aborted")
+                continue
+            if item is _END:
+                self._eof = True
+            else:
+                self._buffer = memoryview(item)
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+async def feed_async(chunks: AsyncIterator[bytes], reader: QueueReader):
+    """Feed an async byte stream (e.g. Starlette's request.stream()) into reader"""
+    try:
+        async for chunk in chunks:
+            if not chunk:
+                continue
+            # Only hop to a thread when the parser is behind and the queue is full
+            if not reader.feed_nowait(chunk) and not await asyncio.to_thread(reader.feed, chunk):
+                return
+    finally:
+        await asyncio.to_thread(reader.end)
+
+
+def is_streamable(content_type: Optional[str]) -> bool:
+    return media_type(content_type) in STREAM_CONTENT_TYPES
+
+
+def read_frames(stream, content_type: str, chunk_rows: int = STREAM_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """Parse a binary CSV or JSON Lines stream into DataFrames of at most chunk_rows rows"""
+    if isinstance(stream, io.RawIOBase):
+        stream = io.BufferedReader(stream)
+    if media_type(content_type) in JSONL_CONTENT_TYPES:
+        with pd.read_json(io.TextIOWrapper(stream, encoding="utf-8"), lines=True, chunksize=chunk_rows) as reader:
+            yield from reader
+    else:
+        with pd.read_csv(stream, chunksize=chunk_rows) as reader:
+            yield from reader
+
+
+def chunk_encoder(response_type: str) -> Callable[[pd.DataFrame], bytes]:
+    """Serializer for consecutive prediction chunks, writing the CSV header only once"""
+    first = True
+
+    def encode(prediction: pd.DataFrame) -> bytes:
+        nonlocal first
+        if media_type(response_type) in JSONL_CONTENT_TYPES:
+            content = prediction.to_json(orient="records", lines=True, double_precision=15)
+            if content and not content.endswith("\n"):
+                content += "\n"
+        else:
+            content = prediction.to_csv(index=False, header=first)
+        first = False
+        return content.encode("utf-8")
+
+    return encode
+
+
+def stream_predictions(
+    stream,
+    content_type: str,
+    predict_fn: Callable[[pd.DataFrame], pd.DataFrame],
+    response_type: Optional[str] = None,
+    chunk_rows: int = STREAM_CHUNK_ROWS,
+    depth: int = STREAM_QUEUE_DEPTH,
+) -> Iterator[bytes]:
+    """Yield serialized predictions chunk by chunk, with parse, predict and serialize running concurrently"""
+    stop = threading.Event()
+    stages = [
+        (lambda frame: frame, read_frames(stream, content_type, chunk_rows)),
+        (predict_fn, None),
+        (chunk_encoder(response_type or content_type), None),
+    ]
+    queues = [queue.Queue(maxsize=depth) for _ in stages]
+
+    def run(fn, source, sink):
+        try:
+            for item in source:
+                if not _put(sink, fn(item), stop):
+                    return
+            _put(sink, _END, stop)
+        except BaseException as e:
+            _put(sink, _Failure(e), stop)
+
+    for i, (fn, source) in enumerate(stages):
+        if source is None:
+            source = _drain(queues[i - 1], stop)
+        threading.Thread(target=run, args=(fn, source, queues[i]), name=f"autogluon-stream-{i}", daemon=True).start()
+    try:
+        yield from _drain(queues[-1], stop)
+    except Exception as e:
+        # The status line has already been sent, ending the stream early is the only way to report it
+        logger.error(f"Streaming prediction failed: {e}")
+        raise
+    finally:
+        stop.set()
+        if isinstance(stream, QueueReader):
+            stream.abort()
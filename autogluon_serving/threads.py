@@ -0,0 +1,215 @@
+"""CPU thread budget: how a server's cores are divided between worker processes and the threads inside each
+
+Every worker process runs the thread pools of the predictor's models: OpenMP for LightGBM and
+XGBoost, CatBoost's own pool and torch's intra-op pool for NeuralNetTorch. Each sizes itself to all
+cores by default, so with several workers (``AG_WORKERS``, or several DJL Python workers) there are
+many more busy threads than cores whenever requests overlap, which shows as tail latency. Instead,
+every worker gets ``AG_INTRA_OP_THREADS`` threads, by default its share of the ``AG_CPU_BUDGET``
+cores (all cores available to the process by default), applied when the model is loaded:
+
+- OpenMP and BLAS pools already loaded are capped with threadpoolctl, libraries loaded later read
+  ``OMP_NUM_THREADS``, ``OPENBLAS_NUM_THREADS`` and ``MKL_NUM_THREADS``
+- torch uses that many intra-op threads and a single inter-op thread
+- CatBoost models in memory predict with that many threads (CatBoost ignores the OpenMP settings);
+  LightGBM and XGBoost predict with the OpenMP default, and so follow the cap
+
+Run ``python -m autogluon_serving.threads --model-dir /opt/ml/model`` to measure the loaded predictor's
+throughput and latency for every split of the cores into workers and threads and get a recommendation.
+"""
+
+import argparse
+import functools
+import gc
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from threadpoolctl import threadpool_limits
+
+from autogluon_serving.compiled import install_compiled
+from autogluon_serving.extract import prepare_model
+from autogluon_serving.predict import predict_frame
+from autogluon_serving.warmup import synthetic_rows
+
+logger = logging.getLogger(__name__)
+
+# Cores shared by all workers, 0 for all cores available to the process
+CPU_BUDGET = int(os.environ.get("AG_CPU_BUDGET", "0"))
+# Threads per worker, 0 for the worker's share of the budget
+INTRA_OP_THREADS = int(os.environ.get("AG_INTRA_OP_THREADS", "0"))
+_THREAD_ENV_VARS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+
+
+def available_cpus() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def cpu_budget() -> int:
+    cpus = available_cpus()
+    return min(CPU_BUDGET, cpus) if CPU_BUDGET > 0 else cpus
+
+
+def intra_op_threads(workers: int) -> int:
+    """Threads for each of workers worker processes"""
+    if INTRA_OP_THREADS > 0:
+        return INTRA_OP_THREADS
+    return max(1, cpu_budget() // max(1, workers))
+
+
+def limit_threads(threads: int) -> Dict[str, Optional[str]]:
+    """Cap the OpenMP, BLAS and torch thread pools of this process, including those started later
+
+    Returns the previous values of the thread variables of the environment, None for those unset.
+    """
+    previous = {name: os.environ.get(name) for name in _THREAD_ENV_VARS}
+    for name in _THREAD_ENV_VARS:
+        os.environ[name] = str(threads)
+    threadpool_limits(limits=threads)
+    torch = sys.modules.get("torch")
+    if torch is not None:
+        torch.set_num_threads(threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            # Only possible before torch's first parallel operation
+            pass
+    return previous
+
+
+def _members(model):
+    yield model
+    # Bagged and ensemble models hold their children as names, or as models once persisted
+    for child in getattr(model, "models", None) or ():
+        if not isinstance(child, str):
+            yield from _members(child)
+
+
+def configure_models(predictor, threads: int) -> List[str]:
+    """Make the predictor's models in memory predict with threads threads, returning the models changed"""
+    configured = []
+    for model in predictor._trainer.models.values():
+        for member in _members(model):
+            booster = getattr(member, "model", None)
+            if type(booster).__module__.startswith("catboost"):
+                # AutoGluon calls predict/predict_proba without a thread count, which CatBoost reads as all cores
+                cls = type(booster)
+                booster.predict = functools.partial(cls.predict, booster, thread_count=threads)
+                if hasattr(cls, "predict_proba"):
+                    booster.predict_proba = functools.partial(cls.predict_proba, booster, thread_count=threads)
+                configured.append(member.name)
+    return configured
+
+
+def apply_thread_budget(predictor, workers: int) -> int:
+    """Apply the thread budget of one of workers worker processes to this process and the predictor"""
+    threads = intra_op_threads(workers)
+    limit_threads(threads)
+    configure_models(predictor, threads)
+    logger.info(f"Thread budget: {threads} threads per worker, {workers} workers, {available_cpus()} cores available")
+    return threads
+
+
+def splits(cpus: int) -> List[Tuple[int, int]]:
+    """(workers, threads per worker) pairs using all cpus: 1 x cpus, 2 x cpus/2, ..., cpus x 1"""
+    workers = sorted({w for w in range(1, cpus + 1) if w & (w - 1) == 0} | {cpus})
+    return [(w, cpus // w) for w in workers]
+
+
+# Set in the parent before forking the measuring workers
+_predictor = None
+
+
+def _measure(threads: int, data, model_name: Optional[str], seconds: float, barrier, results):
+    gc.enable()
+    limit_threads(threads)
+    configure_models(_predictor, threads)
+    predict_frame(_predictor, data, model_name)
+    barrier.wait()
+    latencies = []
+    end = time.perf_counter() + seconds
+    while True:
+        start = time.perf_counter()
+        if start >= end:
+            break
+        predict_frame(_predictor, data, model_name)
+        latencies.append(time.perf_counter() - start)
+    results.put(latencies)
+
+
+def measure(workers: int, threads: int, batch_size: int, seconds: float, model_name: Optional[str] = None) -> Dict:
+    """Throughput and latency of workers forked processes predicting batch_size rows in a loop for seconds"""
+    context = multiprocessing.get_context("fork")
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    data = synthetic_rows(_predictor, batch_size)
+    processes = [
+        context.Process(target=_measure, args=(threads, data, model_name, seconds, barrier, results), daemon=True)
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    latencies = np.concatenate([results.get() for _ in processes])
+    for process in processes:
+        process.join()
+    return {
+        "workers": workers,
+        "threads": threads,
+        "rows_per_s": len(latencies) * batch_size / seconds,
+        "p50_ms": float(np.percentile(latencies, 50)) * 1000,
+        "p99_ms": float(np.percentile(latencies, 99)) * 1000,
+    }
+
+
+def recommend(results: List[Dict], max_p99_ms: Optional[float] = None) -> Optional[Dict]:
+    """Highest throughput split, among those meeting max_p99_ms if given"""
+    candidates = [r for r in results if max_p99_ms is None or r["p99_ms"] <= max_p99_ms]
+    return max(candidates, key=lambda r: r["rows_per_s"]) if candidates else None
+
+
+def main():
+    from autogluon.tabular import TabularPredictor
+
+    # prefork imports this module
+    from autogluon_serving.prefork import before_fork, persist_models, preloading
+
+    global _predictor
+    parser = argparse.ArgumentParser(description="Measure throughput and latency for each split of the cores into workers x threads")
+    parser.add_argument("--model-dir", default=os.environ.get("MODEL_PATH", "/opt/ml/model"))
+    parser.add_argument("--model", default=None, help="Model to predict with instead of the predictor's best model")
+    parser.add_argument("--batch-size", type=int, default=1, help="Rows per predictor call")
+    parser.add_argument("--seconds", type=float, default=5.0, help="Measuring time per split")
+    parser.add_argument("--cpus", type=int, default=None, help="Cores to divide, defaults to AG_CPU_BUDGET or all available cores")
+    parser.add_argument("--max-p99-ms", type=float, default=None, help="Only recommend splits within this p99 latency")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    cpus = args.cpus or cpu_budget()
+    with preloading(workers=2):
+        model_path, _ = prepare_model(args.model_dir)
+        _predictor = TabularPredictor.load(model_path, require_py_version_match=False)
+        persist_models(_predictor)
+        install_compiled(_predictor)
+    before_fork()
+
+    results = []
+    print(f"{'workers':>7} {'threads':>7} {'rows/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+    for workers, threads in splits(cpus):
+        result = measure(workers, threads, args.batch_size, args.seconds, args.model)
+        results.append(result)
+        print(f"{workers:>7} {threads:>7} {result['rows_per_s']:>10,.0f} {result['p50_ms']:>8.2f} {result['p99_ms']:>8.2f}")
+    best = recommend(results, args.max_p99_ms)
+    if best is None:
+        print(f"No split meets a p99 latency of {args.max_p99_ms} ms")
+        sys.exit(1)
+    print(f"Recommended for {args.batch_size}-row calls: AG_WORKERS={best['workers']} AG_INTRA_OP_THREADS={best['threads']}")
+
+
+if __name__ == "__main__":
+    main()
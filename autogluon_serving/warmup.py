@@ -0,0 +1,57 @@
+"""Startup warmup for AutoGluon predictors"""
+
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from autogluon.core.constants import REGRESSION
+
+logger = logging.getLogger(__name__)
+
+# Batch sizes pushed through the predictor before it is reported ready, "" disables warmup
+WARMUP_BATCH_SIZES = [int(b) for b in os.environ.get("AG_WARMUP_BATCH_SIZES", "1,8,64").split(",") if b.strip()]
+
+
+def synthetic_rows(predictor, num_rows: int) -> pd.DataFrame:
+    """Build rows matching the predictor's feature_metadata_in with type-appropriate placeholder values"""
+    feature_metadata = predictor.feature_metadata_in
+    index = np.arange(num_rows)
+    columns = {}
+    for feature in feature_metadata.get_features():
+        raw_type = feature_metadata.get_feature_type_raw(feature)
+        if raw_type == "int":
+            columns[feature] = (index % 10).astype(np.int64)
+        elif raw_type == "float":
+            columns[feature] = (index % 10).astype(np.float64)
+        elif raw_type == "bool":
+            columns[feature] = (index % 2).astype(bool)
+        elif raw_type == "datetime":
+            columns[feature] = pd.Timestamp("2020-01-01") + pd.to_timedelta(index, unit="D")
+        else:
+            columns[feature] = pd.Series([f"value_{i % 10}" for i in index], dtype="object")
+    return pd.DataFrame(columns)
+
+
+def warmup(predictor, batch_sizes: Optional[List[int]] = None) -> Dict[int, float]:
+    """Run synthetic batches through the predictor so the first live request does not pay first-call costs"""
+    if batch_sizes is None:
+        batch_sizes = WARMUP_BATCH_SIZES
+    timings = {}
+    for num_rows in batch_sizes:
+        data = synthetic_rows(predictor, num_rows)
+        start = time.perf_counter()
+        try:
+            if predictor.problem_type != REGRESSION:
+                predictor.predict_proba(data, as_pandas=True)
+            else:
+                predictor.predict(data, as_pandas=True)
+        except Exception as e:
+            # A predictor that cannot score placeholder rows can still serve real traffic
+            logger.warning(f"Warmup with {num_rows} synthetic rows failed: {e}")
+            continue
+        timings[num_rows] = time.perf_counter() - start
+        logger.info(f"Warmup batch of {num_rows} rows took {timings[num_rows] * 1000:.1f} ms")
+    return timings
@@ -0,0 +1,576 @@
+#!/usr/bin/env python3
+"""Cross-runtime benchmark of the DJLServing, BentoML and MLflow images with the bundled model
+
+Sweeps payload format, batch size and client concurrency against each runtime and reports
+throughput, p50/p95/p99 latency, cold-start time and peak RSS as JSON, so that runs can be
+compared with --compare.
+
+Modes:
+  inprocess  calls each runtime's handler directly, one subprocess per runtime, no Docker
+  docker     starts each runtime's image with the model mounted and benchmarks it over HTTP
+  http       benchmarks endpoints that are already running (--url runtime=http://host:port)
+
+Request rows are synthesized from the model's feature metadata.
+"""
+
+import argparse
+import http.client
+import io
+import json
+import logging
+import os
+import pickle
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+DEFAULT_MODEL = os.path.join(REPO_ROOT, "model_1.3.1.tar.gz")
+RUNTIMES = ("djl", "bentoml", "mlflow")
+FORMATS = ("json", "csv", "parquet")
+DEFAULT_IMAGES = {
+    "djl": "autogluon-djlserve:1.3.1-cpu",
+    "bentoml": "autogluon-bentoml:1.3.1-cpu",
+    "mlflow": "autogluon-mlflow:1.3.1-cpu",
+}
+# Container port and readiness route of each image
+CONTAINER_PORTS = {"djl": 8080, "bentoml": 5000, "mlflow": 5000}
+READY_PATHS = {"djl": "/ping", "bentoml": "/readyz", "mlflow": "/ping"}
+CONTENT_TYPES = {"json": "application/json", "csv": "text/csv", "parquet": "application/x-parquet"}
+STARTUP_TIMEOUT_S = 600
+
+# (status, error) for one request
+Send = Callable[[bytes, Dict[str, str]], Tuple[int, Optional[str]]]
+
+
+def link_model(model_archive: str, workdir: str) -> str:
+    """Model directory under workdir holding (a link to) the model archive, as mounted at /opt/ml/model"""
+    model_dir = os.path.join(workdir, "model")
+    os.makedirs(model_dir, exist_ok=True)
+    link = os.path.join(model_dir, os.path.basename(model_archive))
+    if not os.path.exists(link):
+        os.symlink(os.path.abspath(model_archive), link)
+    return model_dir
+
+
+def load_predictor(model_archive: str, workdir: str):
+    """Extract the model archive (through the shared extraction cache) and load it"""
+    from autogluon.tabular import TabularPredictor
+    from autogluon_serving.extract import prepare_model
+
+    model_path, _ = prepare_model(link_model(model_archive, workdir))
+    return TabularPredictor.load(model_path, require_py_version_match=False)
+
+
+def synthetic_frames(predictor, batch_sizes: List[int]) -> Dict:
+    """Request rows of each batch size, synthesized from the predictor's feature metadata"""
+    from autogluon_serving.warmup import synthetic_rows
+
+    return {batch_size: synthetic_rows(predictor, batch_size) for batch_size in batch_sizes}
+
+
+def build_payload(runtime: str, payload_format: str, frame) -> Tuple[bytes, Dict[str, str]]:
+    """Request body and headers for a DataFrame in the given format, as the runtime expects it"""
+    headers = {"Content-Type": CONTENT_TYPES[payload_format]}
+    if payload_format == "csv":
+        return frame.to_csv(index=False).encode("utf-8"), headers
+    if payload_format == "parquet":
+        return frame.to_parquet(index=False), headers
+    records = json.loads(frame.to_json(orient="records", date_format="iso"))
+    if runtime == "mlflow":
+        return json.dumps({"dataframe_records": records}).encode("utf-8"), headers
+    return json.dumps(records).encode("utf-8"), headers
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return float("nan")
+    rank = q / 100 * (len(ordered) - 1)
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def run_cell(send: Send, body: bytes, headers: Dict[str, str], concurrency: int, requests: int, warmup: int) -> Dict:
+    """Send requests with concurrency clients and summarize latency and throughput"""
+    for _ in range(warmup):
+        send(body, headers)
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    remaining = [requests]
+
+    def client():
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            start = time.perf_counter()
+            status, error = send(body, headers)
+            elapsed = time.perf_counter() - start
+            with lock:
+                if status == 200 and error is None:
+                    latencies.append(elapsed)
+                else:
+                    errors.append(error or f"HTTP {status}")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(client)
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": requests,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "seconds": elapsed,
+        "throughput_rps": len(latencies) / elapsed,
+        "latency_ms": {
+            "mean": sum(latencies) / len(latencies) * 1000 if latencies else float("nan"),
+            "p50": percentile(latencies, 50) * 1000,
+            "p95": percentile(latencies, 95) * 1000,
+            "p99": percentile(latencies, 99) * 1000,
+        },
+    }
+
+
+def sweep(runtime: str, send: Send, frames: Dict, args) -> List[Dict]:
+    results = []
+    for batch_size in args.batch_sizes:
+        frame = frames[batch_size]
+        for payload_format in args.formats:
+            body, headers = build_payload(runtime, payload_format, frame)
+            for concurrency in args.concurrency:
+                cell = run_cell(send, body, headers, concurrency, args.requests, args.warmup_requests)
+                cell.update(
+                    runtime=runtime,
+                    format=payload_format,
+                    batch_size=batch_size,
+                    concurrency=concurrency,
+                    payload_bytes=len(body),
+                    throughput_rows_s=cell["throughput_rps"] * batch_size,
+                )
+                results.append(cell)
+                print(
+                    f"{runtime:<8} {payload_format:<8} batch {batch_size:>5} conc {concurrency:>3}: "
+                    f"{cell['throughput_rps']:8.1f} req/s {cell['throughput_rows_s']:10.1f} rows/s "
+                    f"p50 {cell['latency_ms']['p50']:7.2f} p99 {cell['latency_ms']['p99']:7.2f} ms, "
+                    f"{cell['errors']} errors",
+                    file=sys.stderr,
+                )
+    return results
+
+
+# In-process mode: each runtime is benchmarked in its own subprocess so that cold start and peak RSS
+# are measured in isolation. The subprocess extracts and loads the model itself, into an extraction
+# cache of its own, and gets its request rows from the parent, so that neither the harness's copy of
+# the predictor nor a warm cache is counted.
+
+
+class _DjlInput:
+    """Minimal stand-in for djl_python.Input, with the methods model.py uses"""
+
+    def __init__(self, body: bytes, headers: Dict[str, str]):
+        self._body = body
+        self._properties = {k.lower(): v for k, v in headers.items()}
+
+    def is_empty(self):
+        return not self._body
+
+    def is_batch(self):
+        return False
+
+    def get_property(self, key):
+        return self._properties.get(key)
+
+    def get_as_bytes(self):
+        return self._body
+
+    def get_as_string(self):
+        return self._body.decode("utf-8")
+
+    def get_as_json(self):
+        return json.loads(self._body)
+
+
+def _asgi_sender(client) -> Send:
+    def send(body, headers):
+        response = client.post("/invocations", content=body, headers=headers)
+        return response.status_code, None if response.status_code == 200 else response.text[:200]
+
+    return send
+
+
+def start_inprocess(runtime: str, model_archive: str, workdir: str) -> Send:
+    """Load the runtime's handler in this process and return a function that sends it one request"""
+    from autogluon_serving.extract import prepare_model
+
+    model_dir = link_model(model_archive, workdir)
+    if runtime == "bentoml":
+        # The service extracts the model itself
+        model_path = None
+    else:
+        # As setup_model.sh and setup_mlflow_model.py do in the images
+        model_path, _ = prepare_model(model_dir)
+
+    if runtime == "djl":
+        import importlib.util
+        from autogluon_serving.extract import link_tree
+
+        # model.py loads the predictor from its own directory, as in the DJL image
+        djl_model_dir = os.path.join(workdir, "djl_model")
+        link_tree(model_path, djl_model_dir)
+        shutil.copy(os.path.join(REPO_ROOT, "autogluon-djlserve", "model.py"), djl_model_dir)
+        spec = importlib.util.spec_from_file_location("model", os.path.join(djl_model_dir, "model.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+
+        def send(body, headers):
+            try:
+                module.handle(_DjlInput(body, headers))
+                return 200, None
+            except Exception as e:
+                return 500, str(e)[:200]
+
+        return send
+
+    from starlette.testclient import TestClient
+
+    if runtime == "bentoml":
+        os.environ["MODEL_PATH"] = model_dir
+        sys.path.insert(0, os.path.join(REPO_ROOT, "autogluon-bentoml"))
+        from service import AutoGluonService
+
+        client = TestClient(AutoGluonService.to_asgi()).__enter__()
+        deadline = time.monotonic() + STARTUP_TIMEOUT_S
+        while client.get("/readyz").status_code != 200:
+            if time.monotonic() > deadline:
+                raise TimeoutError("BentoML service did not become ready")
+            time.sleep(0.05)
+        return _asgi_sender(client)
+
+    if runtime == "mlflow":
+        import mlflow.pyfunc
+
+        sys.path.insert(0, os.path.join(REPO_ROOT, "autogluon-mlflow"))
+        from autogluon_model import AutoGluonMLflowModel
+
+        mlflow_model = os.path.join(workdir, "mlflow_model")
+        if not os.path.exists(mlflow_model):
+            mlflow.pyfunc.save_model(
+                path=mlflow_model,
+                python_model=AutoGluonMLflowModel(),
+                artifacts={"model": model_path},
+                code_paths=[os.path.join(REPO_ROOT, "autogluon-mlflow", "autogluon_model.py")],
+            )
+        os.environ["AG_MLFLOW_MODEL_URI"] = mlflow_model
+        import scoring_app
+
+        return _asgi_sender(TestClient(scoring_app.app).__enter__())
+
+    raise ValueError(f"Unknown runtime {runtime}")
+
+
+def inprocess_worker(args):
+    """Body of the per-runtime subprocess, prints its results as JSON on stdout"""
+    workdir = args.workdir
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    send = start_inprocess(args.runtime, args.model, workdir)
+    # From the parent spawning this process, interpreter start and imports included
+    cold_start = time.time() - args.started
+    with open(args.frames, "rb") as f:
+        frames = pickle.load(f)
+    results = sweep(args.runtime, send, frames, args)
+    print(json.dumps({
+        "runtime": args.runtime,
+        "mode": "inprocess",
+        "cold_start_s": cold_start,
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "results": results,
+    }))
+    # Runtime threads (batchers, servers) are daemons, do not wait for them
+    sys.stdout.flush()
+    os._exit(0)
+
+
+def run_inprocess(runtime: str, args, workdir: str, frames_path: str) -> Dict:
+    runtime_workdir = os.path.join(workdir, runtime)
+    os.makedirs(runtime_workdir)
+    # A cold extraction cache, as on the first start of a container
+    env = dict(os.environ, AG_MODEL_CACHE_DIR=os.path.join(runtime_workdir, "cache"))
+    command = [
+        sys.executable, os.path.abspath(__file__), "_inprocess",
+        "--runtime", runtime,
+        "--workdir", runtime_workdir,
+        "--frames", frames_path,
+        "--started", repr(time.time()),
+        "--model", args.model,
+        "--formats", ",".join(args.formats),
+        "--batch-sizes", ",".join(map(str, args.batch_sizes)),
+        "--concurrency", ",".join(map(str, args.concurrency)),
+        "--requests", str(args.requests),
+        "--warmup-requests", str(args.warmup_requests),
+    ]
+    process = subprocess.run(command, stdout=subprocess.PIPE, text=True, env=env)
+    if process.returncode != 0:
+        # e.g. djl_python is not installed outside the DJL image
+        print(f"{runtime} benchmark failed with exit code {process.returncode}, skipping it", file=sys.stderr)
+        return {"runtime": runtime, "mode": "inprocess", "error": f"exit code {process.returncode}", "results": []}
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+# HTTP modes
+
+
+def http_sender(base_url: str) -> Send:
+    """Send requests over one keep-alive connection per client thread"""
+    url = urllib.parse.urlsplit(base_url)
+    local = threading.local()
+
+    def send(body, headers):
+        connection = getattr(local, "connection", None)
+        if connection is None:
+            connection = local.connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=300)
+        try:
+            connection.request("POST", url.path.rstrip("/") + "/invocations", body=body, headers=headers)
+            response = connection.getresponse()
+            content = response.read()
+            return response.status, None if response.status == 200 else content[:200].decode("utf-8", "replace")
+        except (OSError, http.client.HTTPException) as e:
+            connection.close()
+            local.connection = None
+            return 0, str(e)
+
+    return send
+
+
+def _wait_ready(url: str, path: str, timeout: float = STARTUP_TIMEOUT_S):
+    parts = urllib.parse.urlsplit(url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=5)
+            connection.request("GET", path)
+            if connection.getresponse().status == 200:
+                return
+        except (OSError, http.client.HTTPException):
+            pass
+        time.sleep(0.1)
+    raise TimeoutError(f"{url}{path} did not become ready within {timeout} s")
+
+
+class _PeakMemory:
+    """Poll the container's memory use while it runs, for cgroups without memory.peak"""
+
+    def __init__(self, container: str):
+        self.container = container
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+        self._thread.start()
+
+    def _poll(self):
+        while not self._stop.wait(0.5):
+            try:
+                current = subprocess.run(
+                    ["docker", "exec", self.container, "cat", "/sys/fs/cgroup/memory.current"],
+                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True,
+                ).stdout
+                self.peak = max(self.peak, int(current))
+            except (subprocess.CalledProcessError, ValueError):
+                pass
+
+    def stop(self) -> int:
+        self._stop.set()
+        try:
+            # cgroup v2 tracks the high-water mark itself
+            peak = subprocess.run(
+                ["docker", "exec", self.container, "cat", "/sys/fs/cgroup/memory.peak"],
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True,
+            ).stdout
+            return max(self.peak, int(peak))
+        except (subprocess.CalledProcessError, ValueError):
+            return self.peak
+
+
+def run_docker(runtime: str, args, workdir: str, port: int) -> Dict:
+    model_dir = os.path.join(workdir, "docker_model")
+    os.makedirs(model_dir, exist_ok=True)
+    shutil.copy(args.model, model_dir)
+    image = args.images.get(runtime, DEFAULT_IMAGES[runtime])
+    start = time.perf_counter()
+    container = subprocess.run(
+        ["docker", "run", "-d", "--rm", "-p", f"{port}:{CONTAINER_PORTS[runtime]}",
+         "-v", f"{model_dir}:/opt/ml/model", image, "serve"],
+        check=True, stdout=subprocess.PIPE, text=True,
+    ).stdout.strip()
+    memory = _PeakMemory(container)
+    try:
+        url = f"http://127.0.0.1:{port}"
+        _wait_ready(url, READY_PATHS[runtime])
+        cold_start = time.perf_counter() - start
+        frames = synthetic_frames(load_predictor(args.model, workdir), args.batch_sizes)
+        results = sweep(runtime, http_sender(url), frames, args)
+        peak_rss = memory.stop()
+    finally:
+        subprocess.run(["docker", "stop", container], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return {
+        "runtime": runtime,
+        "mode": "docker",
+        "image": image,
+        "cold_start_s": cold_start,
+        "peak_rss_bytes": peak_rss,
+        "results": results,
+    }
+
+
+def run_http(runtime: str, url: str, args, workdir: str) -> Dict:
+    frames = synthetic_frames(load_predictor(args.model, workdir), args.batch_sizes)
+    return {
+        "runtime": runtime,
+        "mode": "http",
+        "url": url,
+        "cold_start_s": None,
+        "peak_rss_bytes": None,
+        "results": sweep(runtime, http_sender(url), frames, args),
+    }
+
+
+# Reporting
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "-C", REPO_ROOT, "rev-parse", "HEAD"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline: Dict, current: Dict, max_regression: Optional[float]) -> bool:
+    """Print throughput and p99 changes per cell, False if any cell regressed by more than max_regression percent"""
+    def cells(report):
+        return {
+            (r["runtime"], r["format"], r["batch_size"], r["concurrency"]): r
+            for runtime in report["runtimes"] for r in runtime["results"]
+        }
+
+    old_cells = cells(baseline)
+    ok = True
+    print(f"{'runtime':<8} {'format':<8} {'batch':>5} {'conc':>4} {'rows/s':>22} {'p99 ms':>22}")
+    for key, new in sorted(cells(current).items()):
+        old = old_cells.get(key)
+        if old is None:
+            continue
+        throughput_change = (new["throughput_rows_s"] / old["throughput_rows_s"] - 1) * 100 if old["throughput_rows_s"] else 0.0
+        p99_change = (new["latency_ms"]["p99"] / old["latency_ms"]["p99"] - 1) * 100 if old["latency_ms"]["p99"] else 0.0
+        regressed = max_regression is not None and (throughput_change < -max_regression or p99_change > max_regression)
+        ok = ok and not regressed
+        print(
+            f"{key[0]:<8} {key[1]:<8} {key[2]:>5} {key[3]:>4} "
+            f"{old['throughput_rows_s']:>9.0f} -> {new['throughput_rows_s']:>9.0f} "
+            f"{throughput_change:+6.1f}% {old['latency_ms']['p99']:>7.2f} -> {new['latency_ms']['p99']:>7.2f} "
+            f"{p99_change:+6.1f}%{'  REGRESSION' if regressed else ''}"
+        )
+    return ok
+
+
+def _csv_list(cast=str):
+    return lambda value: [cast(v) for v in value.split(",") if v]
+
+
+def _mapping(value: str) -> Dict[str, str]:
+    return dict(item.split("=", 1) for item in value.split(",") if item)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", choices=("inprocess", "docker", "http", "_inprocess"))
+    parser.add_argument("--runtimes", type=_csv_list(), default=list(RUNTIMES))
+    parser.add_argument("--runtime", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    parser.add_argument("--frames", help=argparse.SUPPRESS)
+    parser.add_argument("--started", type=float, help=argparse.SUPPRESS)
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="Model archive (default: the bundled model)")
+    parser.add_argument("--formats", type=_csv_list(), default=list(FORMATS))
+    parser.add_argument("--batch-sizes", type=_csv_list(int), default=[1, 16, 256])
+    parser.add_argument("--concurrency", type=_csv_list(int), default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per cell")
+    parser.add_argument("--warmup-requests", type=int, default=10, help="Unmeasured requests before each cell")
+    parser.add_argument("--images", type=_mapping, default={}, help="runtime=image overrides for docker mode")
+    parser.add_argument("--url", type=_mapping, default={}, help="runtime=base URL for http mode")
+    parser.add_argument("--port", type=int, default=18080, help="Host port for docker mode")
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    parser.add_argument("--compare", help="Baseline JSON report to compare against")
+    parser.add_argument("--max-regression", type=float, help="Exit with 1 if a cell regressed by more than this percent")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.mode == "_inprocess":
+        inprocess_worker(args)
+        return
+
+    workdir = tempfile.mkdtemp(prefix="autogluon-benchmark-")
+    runtimes = []
+    try:
+        if args.mode == "http":
+            for runtime, url in args.url.items():
+                runtimes.append(run_http(runtime, url, args, workdir))
+        if args.mode == "inprocess":
+            # Written by this process so that the subprocesses do not load a predictor of their own for it
+            frames_path = os.path.join(workdir, "frames.pkl")
+            with open(frames_path, "wb") as f:
+                pickle.dump(synthetic_frames(load_predictor(args.model, workdir), args.batch_sizes), f)
+        for runtime in args.runtimes if args.mode != "http" else ():
+            if args.mode == "inprocess":
+                runtimes.append(run_inprocess(runtime, args, workdir, frames_path))
+            else:
+                runtimes.append(run_docker(runtime, args, workdir, args.port))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_commit": _git_commit(),
+            "mode": args.mode,
+            "model": os.path.basename(args.model),
+            "host": platform.node(),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "requests_per_cell": args.requests,
+        },
+        "runtimes": runtimes,
+    }
+    content = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(content)
+    else:
+        print(content)
+
+    if args.compare:
+        with open(args.compare) as f:
+            if not compare(json.load(f), report, args.max_regression):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip("autogluon.core")
+
+from autogluon_serving import admission as admission_module
+from autogluon_serving.admission import AdmissionControl, Rejected
+from autogluon_serving.metrics import Timings
+
+
+async def _hold(admission, entered, release, deadline_ms=None):
+    async with admission.admit(Timings(), deadline_ms):
+        entered.set()
+        await release.wait()
+
+
+async def _wait_for(predicate):
+    for _ in range(100):
+        if predicate():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not reached")
+
+
+def test_requests_beyond_the_queue_are_rejected_with_429():
+    async def scenario():
+        admission = AdmissionControl(1, max_queue_depth=1, max_queue_wait_ms=5000)
+        release = asyncio.Event()
+        entered = asyncio.Event()
+        holder = asyncio.create_task(_hold(admission, entered, release))
+        await entered.wait()
+        queued = asyncio.create_task(_hold(admission, asyncio.Event(), release))
+        await _wait_for(lambda: admission.waiting == 1)
+        with pytest.raises(Rejected) as error:
+            await _hold(admission, asyncio.Event(), release)
+        release.set()
+        await asyncio.gather(holder, queued)
+        return admission, error.value
+
+    admission, error = asyncio.run(scenario())
+    assert error.status_code == 429
+    assert error.retry_after >= 1
+    assert admission.rejected["queue_full"] == 1
+    assert admission.in_flight == 0
+    assert admission.waiting == 0
+
+
+def test_queue_wait_is_bounded_with_503():
+    async def scenario():
+        admission = AdmissionControl(1, max_queue_depth=10, max_queue_wait_ms=20)
+        release = asyncio.Event()
+        entered = asyncio.Event()
+        holder = asyncio.create_task(_hold(admission, entered, release))
+        await entered.wait()
+        with pytest.raises(Rejected) as error:
+            await _hold(admission, asyncio.Event(), release)
+        release.set()
+        await holder
+        return admission, error.value
+
+    admission, error = asyncio.run(scenario())
+    assert error.status_code == 503
+    assert admission.rejected["queue_timeout"] == 1
+
+
+def test_deadline_that_cannot_be_met_is_rejected_without_queueing():
+    async def scenario():
+        admission = AdmissionControl(1, max_queue_depth=10)
+        admission.service_s = 0.5
+        release = asyncio.Event()
+        entered = asyncio.Event()
+        holder = asyncio.create_task(_hold(admission, entered, release))
+        await entered.wait()
+        with pytest.raises(Rejected) as error:
+            await _hold(admission, asyncio.Event(), release, deadline_ms=100)
+        waiting = admission.waiting
+        release.set()
+        await holder
+        return admission, error.value, waiting
+
+    admission, error, waiting = asyncio.run(scenario())
+    assert error.status_code == 503
+    assert admission.rejected["deadline"] == 1
+    assert waiting == 0
+
+
+def test_retry_after_follows_the_service_time():
+    admission = AdmissionControl(2, max_queue_depth=10)
+    assert admission.retry_after() == 1
+    admission.service_s = 3.0
+    admission.waiting = 3
+    # The 4th request in the queue gets a slot after two rounds of the 2 slots
+    assert admission.expected_wait(4) == 6.0
+    assert admission.retry_after() == 6
+
+
+def test_service_time_is_averaged():
+    async def scenario():
+        admission = AdmissionControl(1)
+        async with admission.admit(Timings()):
+            await asyncio.sleep(0.02)
+        first = admission.service_s
+        async with admission.admit(Timings()):
+            pass
+        return first, admission.service_s
+
+    first, second = asyncio.run(scenario())
+    assert first >= 0.02
+    assert 0 < second < first
+
+
+def test_run_uses_the_inference_executor():
+    async def scenario():
+        admission = AdmissionControl(1)
+        return await admission.run(lambda: threading.current_thread().name)
+
+    assert asyncio.run(scenario()).startswith("autogluon-inference")
+
+
+def test_streams_have_their_own_limit_without_a_queue(monkeypatch):
+    monkeypatch.setattr(admission_module, "MAX_STREAMS", 1)
+    streams = AdmissionControl.streams_from_env()
+
+    async def scenario():
+        release = asyncio.Event()
+        entered = asyncio.Event()
+        holder = asyncio.create_task(_hold(streams, entered, release))
+        await entered.wait()
+        with pytest.raises(Rejected) as error:
+            await _hold(streams, asyncio.Event(), release)
+        release.set()
+        await holder
+        return error.value
+
+    assert asyncio.run(scenario()).status_code == 429
+    monkeypatch.setattr(admission_module, "MAX_STREAMS", 0)
+    assert AdmissionControl.streams_from_env() is None
@@ -0,0 +1,56 @@
+import contextlib
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("autogluon.core")
+pytest.importorskip("starlette")
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from autogluon_serving.admission import AdmissionControl, Rejected
+from autogluon_serving.asgi import stream_response
+from autogluon_serving.metrics import Timings
+
+
+def _app(admission):
+    async def stream(request):
+        try:
+            return await stream_response(request, "text/csv", lambda frame: frame * 2, "text/csv", admission)
+        except Rejected as e:
+            return JSONResponse({"error": str(e)}, status_code=e.status_code, headers={"Retry-After": str(e.retry_after)})
+
+    return Starlette(routes=[Route("/stream", stream, methods=["POST"])])
+
+
+def test_stream_predicts_and_releases_its_slot():
+    admission = AdmissionControl(1, max_queue_depth=0)
+    with TestClient(_app(admission)) as client:
+        for _ in range(2):
+            response = client.post("/stream", content=b"x\n1\n2\n")
+            assert response.status_code == 200
+            assert response.text.split() == ["x", "2", "4"]
+    assert admission.in_flight == 0
+    assert admission.service_s is not None
+
+
+def test_stream_beyond_the_limit_is_rejected():
+    admission = AdmissionControl(1, max_queue_depth=0)
+    with TestClient(_app(admission)) as client:
+        # The only slot is held by another stream
+        other = contextlib.AsyncExitStack()
+        client.portal.call(other.enter_async_context, admission.admit(Timings()))
+        response = client.post("/stream", content=b"x\n1\n")
+        client.portal.call(other.aclose)
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "1"
+    assert admission.rejected["queue_full"] == 1
+
+
+def test_stream_without_admission():
+    with TestClient(_app(None)) as client:
+        response = client.post("/stream", content=b"x\n1\n")
+    assert pd.Series(response.text.split()[1:], dtype=float).tolist() == [2.0]
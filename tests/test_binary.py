@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from autogluon_serving.admission import Rejected
+from autogluon_serving.binary import (
+    STATUS_BAD_REQUEST,
+    STATUS_ERROR,
+    STATUS_UNAVAILABLE,
+    BinaryClient,
+    BinaryError,
+    BinaryServer,
+    _REQUEST,
+    encode_request,
+)
+from autogluon_serving.formats import CONTENT_TYPE_ARROW, decode_columnar, encode_columnar
+
+
+def _echo(body, selection, timings):
+    """Handler answering with the request's rows, doubled, or failing as its metadata asks"""
+    if selection.get("fail") == "bad":
+        raise ValueError("bad rows")
+    if selection.get("fail") == "busy":
+        raise Rejected("queue_full", 429, 3)
+    if selection.get("fail") == "error":
+        raise RuntimeError("boom")
+    data = decode_columnar(body, CONTENT_TYPE_ARROW)
+    return encode_columnar(data * 2, CONTENT_TYPE_ARROW), len(data), {"model": selection.get("model")}
+
+
+@pytest.fixture
+def address(tmp_path):
+    path = str(tmp_path / "binary.sock")
+    BinaryServer(_echo, port=0, socket_path=path, max_pipeline=2, threads=2).start_in_thread()
+    return path
+
+
+def test_request_framing():
+    data = pd.DataFrame({"x": [1.0, 2.0]})
+    frame = encode_request(7, data, {"model": "LightGBM"})
+    assert int.from_bytes(frame[:4], "big") == len(frame) - 4
+    request_id, metadata_length = _REQUEST.unpack_from(frame, 4)
+    assert request_id == 7
+    assert frame[4 + _REQUEST.size : 4 + _REQUEST.size + metadata_length] == b'{"model": "LightGBM"}'
+    body = frame[4 + _REQUEST.size + metadata_length :]
+    pd.testing.assert_frame_equal(decode_columnar(body, CONTENT_TYPE_ARROW), data)
+
+
+def test_round_trip(address):
+    data = pd.DataFrame({"x": [1.0, 2.0], "y": [3, 4]})
+    with BinaryClient(address, timeout=10) as client:
+        pd.testing.assert_frame_equal(client.predict(data, model="LightGBM"), data * 2)
+        client.send(data, model="LightGBM", tier=None)
+        _, status, metadata, _ = client.receive()
+    assert status == 0
+    assert metadata == {"model": "LightGBM"}
+
+
+@pytest.mark.parametrize(
+    "fail, status, retry_after",
+    [("bad", STATUS_BAD_REQUEST, None), ("busy", STATUS_UNAVAILABLE, 3), ("error", STATUS_ERROR, None)],
+)
+def test_failed_request_status(address, fail, status, retry_after):
+    with BinaryClient(address, timeout=10) as client:
+        with pytest.raises(BinaryError) as error:
+            client.predict(pd.DataFrame({"x": [1.0]}), fail=fail)
+        # The connection stays usable after a failed request
+        pd.testing.assert_frame_equal(client.predict(pd.DataFrame({"x": [1.0]})), pd.DataFrame({"x": [2.0]}))
+    assert error.value.status == status
+    assert error.value.retry_after == retry_after
+
+
+def test_predict_many_keeps_order_and_errors(address):
+    frames = [pd.DataFrame({"x": [float(i)] * (i + 1)}) for i in range(10)]
+    with BinaryClient(address, timeout=10) as client:
+        results = client.predict_many(frames, pipeline=2)
+        failed = client.predict_many(frames[:3], pipeline=2, fail="bad")
+    for frame, result in zip(frames, results):
+        pd.testing.assert_frame_equal(result, frame * 2)
+    assert all(isinstance(result, BinaryError) for result in failed)
+
+
+def test_predict_many_large_frames_do_not_deadlock(address):
+    # Each frame and response is larger than the socket buffers, so a client that sent every
+    # request before reading a response would block against a server that stopped reading
+    frames = [pd.DataFrame({"x": np.arange(500_000, dtype=float) + i}) for i in range(6)]
+    with BinaryClient(address, timeout=30) as client:
+        results = client.predict_many(frames, pipeline=2)
+    for frame, result in zip(frames, results):
+        pd.testing.assert_frame_equal(result, frame * 2)
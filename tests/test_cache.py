@@ -0,0 +1,101 @@
+import os
+
+import pandas as pd
+import pytest
+
+from autogluon_serving import cache as cache_module
+from autogluon_serving.cache import PredictionCache
+
+
+class Predictor:
+    """predict_fn recording the rows it is asked for"""
+
+    def __init__(self):
+        self.rows = []
+
+    def __call__(self, data):
+        self.rows.append(len(data))
+        return pd.DataFrame({"label": [f"y{x}" for x in data["x"]], "p": data["x"] / 10}, index=data.index)
+
+
+def _frame(*xs, index=None):
+    return pd.DataFrame({"x": list(xs), "city": [f"c{x}" for x in xs]}, index=index)
+
+
+def test_only_uncached_rows_are_predicted_and_merged_in_order():
+    cache = PredictionCache(["x", "city"], max_bytes=1 << 20)
+    predict = Predictor()
+    cache.predict(_frame(1, 2), predict)
+    merged = cache.predict(_frame(3, 1, 4, 2, index=[10, 11, 12, 13]), predict)
+    assert predict.rows == [2, 2]
+    expected = predict(_frame(3, 1, 4, 2, index=[10, 11, 12, 13]))
+    pd.testing.assert_frame_equal(merged, expected)
+    assert cache.stats()["hits"] == 2
+
+
+def test_fully_cached_request_keeps_the_prediction_dtypes():
+    cache = PredictionCache(["x", "city"], max_bytes=1 << 20)
+    predict = Predictor()
+    first = cache.predict(_frame(1, 2), predict)
+    second = cache.predict(_frame(1, 2), predict)
+    assert predict.rows == [2]
+    pd.testing.assert_frame_equal(second, first)
+
+
+def test_keys_follow_the_feature_order_and_include_the_dtypes():
+    cache = PredictionCache(["x", "city"])
+    frame = _frame(1, 2)
+    assert cache.row_keys(frame) == cache.row_keys(frame[["city", "x"]])
+    # 1 and "1" never share an entry
+    assert cache.row_keys(frame) != cache.row_keys(frame.astype({"x": str}))
+    assert cache.row_keys(frame[["x"]]) is None
+
+
+def test_request_missing_a_feature_is_predicted_without_caching():
+    cache = PredictionCache(["x", "city", "other"], max_bytes=1 << 20)
+    predict = Predictor()
+    cache.predict(_frame(1), predict)
+    cache.predict(_frame(1), predict)
+    assert predict.rows == [1, 1]
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_rows_are_evicted_within_the_budget():
+    cache = PredictionCache(["x", "city"], max_bytes=1 << 20)
+    predict = Predictor()
+    cache.predict(_frame(1), predict)
+    entry_bytes = cache.stats()["bytes"]
+    cache.max_bytes = 2 * entry_bytes
+    cache.predict(_frame(2), predict)
+    cache.predict(_frame(1), predict)
+    cache.predict(_frame(3), predict)
+    # 2 was the least recently used
+    keys, rows = cache.lookup(_frame(1, 2, 3))
+    assert [row is not None for row in rows] == [True, False, True]
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entries_expire(monkeypatch):
+    cache = PredictionCache(["x", "city"], max_bytes=1 << 20, ttl_s=60)
+    predict = Predictor()
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, "monotonic", lambda: now[0])
+    cache.predict(_frame(1), predict)
+    now[0] += 61
+    cache.predict(_frame(1), predict)
+    assert predict.rows == [1, 1]
+    assert cache.stats()["expirations"] == 1
+
+
+def test_changed_model_artifact_clears_the_cache(tmp_path, monkeypatch):
+    for name in ("predictor.pkl", "learner.pkl"):
+        (tmp_path / name).write_bytes(b"v1")
+    monkeypatch.setattr(cache_module, "_ARTIFACT_CHECK_INTERVAL_S", 0.0)
+    cache = PredictionCache(["x", "city"], model_path=str(tmp_path), max_bytes=1 << 20)
+    predict = Predictor()
+    cache.predict(_frame(1), predict)
+    (tmp_path / "learner.pkl").write_bytes(b"version 2")
+    os.utime(tmp_path / "learner.pkl", ns=(0, 0))
+    cache.predict(_frame(1), predict)
+    assert predict.rows == [1, 1]
+    assert cache.stats()["invalidations"] == 1
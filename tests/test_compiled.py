@@ -0,0 +1,47 @@
+import json
+import types
+
+import pytest
+
+pytest.importorskip("autogluon.tabular")
+treelite = pytest.importorskip("treelite")
+
+from autogluon_serving import compiled
+from autogluon_serving.compiled import COMPILED_DIR, _digest, _load_models
+
+
+def test_digest_of_the_member_model_file(tmp_path):
+    (tmp_path / "model.pkl").write_bytes(b"trees")
+    member = types.SimpleNamespace(path=str(tmp_path), model_file_name="model.pkl")
+    digest = _digest(member)
+    assert digest == _digest(member)
+    (tmp_path / "model.pkl").write_bytes(b"other trees")
+    assert _digest(member) != digest
+    assert _digest(types.SimpleNamespace(path=str(tmp_path), model_file_name="missing.pkl")) is None
+    assert _digest(types.SimpleNamespace(path=None, model_file_name="model.pkl")) is None
+
+
+def _manifest(path, **fields):
+    directory = path / COMPILED_DIR
+    directory.mkdir()
+    manifest = {"treelite": treelite.__version__, "tolerance": compiled.COMPILED_TOLERANCE, "members": {"LightGBM": {"compiled": False, "digest": "abc"}}}
+    manifest.update(fields)
+    (directory / "manifest.json").write_text(json.dumps(manifest))
+
+
+def test_stored_report_is_verified_with_the_same_tolerance(tmp_path):
+    _manifest(tmp_path)
+    models, verified = _load_models(str(tmp_path))
+    assert models == {}
+    assert verified["LightGBM"]["digest"] == "abc"
+
+
+def test_stored_report_with_another_tolerance_is_checked_again(tmp_path):
+    _manifest(tmp_path, tolerance=1.0)
+    assert _load_models(str(tmp_path)) == ({}, {})
+
+
+def test_stale_or_missing_compiled_directory(tmp_path):
+    assert _load_models(str(tmp_path)) == (None, {})
+    _manifest(tmp_path, treelite="0.0")
+    assert _load_models(str(tmp_path)) == (None, {})
@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("autogluon.common")
+
+from autogluon_serving.decoding import InputDecoder
+from autogluon_serving.formats import CONTENT_TYPE_ARROW, decode_columnar, encode_columnar
+
+FEATURES = {"age": "int", "income": "float", "city": "category", "note": "object"}
+
+
+@pytest.fixture
+def decoder():
+    return InputDecoder(FEATURES)
+
+
+def _dtypes(frame):
+    return {column: str(dtype) for column, dtype in frame.dtypes.items()}
+
+
+def test_records_are_typed_by_the_schema(decoder):
+    frame = decoder.decode_json([
+        {"age": 30, "income": 1, "city": 7, "note": "x", "unused": True},
+        {"age": "41", "income": "2.5", "city": "Paris", "note": None},
+    ])
+    assert list(frame.columns) == list(FEATURES)
+    assert _dtypes(frame) == {"age": "int64", "income": "float64", "city": "object", "note": "object"}
+    assert frame["income"].tolist() == [1.0, 2.5]
+    # A number matches the string category seen in training
+    assert frame["city"].tolist() == ["7", "Paris"]
+
+
+def test_single_record_and_columns_match_records(decoder):
+    record = {"age": 30, "income": 1.5, "city": "Paris", "note": "x"}
+    expected = decoder.records([record, record]).head(1)
+    pd.testing.assert_frame_equal(decoder.decode_json(record), expected)
+    columns = {feature: [value] for feature, value in record.items()}
+    pd.testing.assert_frame_equal(decoder.decode_json(columns), expected)
+    pd.testing.assert_frame_equal(decoder.split(list(record), [list(record.values())]), expected)
+
+
+def test_missing_values(decoder):
+    frame = decoder.records([
+        {"age": 30, "income": None, "city": None, "note": "x"},
+        {"age": None, "income": "", "city": "Paris"},
+    ])
+    # An int feature with a missing value is float64
+    assert frame["age"].dtype == np.float64 and np.isnan(frame["age"][1])
+    assert frame["income"].isna().all()
+    assert frame["note"].tolist() == ["x", None]
+
+
+def test_invalid_input_names_the_feature_and_row(decoder):
+    with pytest.raises(ValueError, match="Feature 'income' expects a number, got 'abc' in row 1"):
+        decoder.records([{"age": 1, "income": 1, "city": "a", "note": ""}, {"age": 1, "income": "abc", "city": "a", "note": ""}])
+    with pytest.raises(ValueError, match="Missing features: \\['note'\\]"):
+        decoder.decode_json({"age": 1, "income": 1, "city": "a"})
+    with pytest.raises(ValueError, match="different numbers of values"):
+        decoder.columns({"age": [1, 2], "income": [1], "city": ["a"], "note": ["b"]})
+    with pytest.raises(ValueError):
+        decoder.decode_json("not a frame")
+
+
+def test_csv_matches_json(decoder):
+    csv = "note,age,income,city,unused\nx,30,1,7,u\n,41,2.5,Paris,v\n"
+    frame = decoder.decode_csv(csv)
+    expected = decoder.records([
+        {"age": 30, "income": 1, "city": "7", "note": "x"},
+        {"age": 41, "income": 2.5, "city": "Paris", "note": None},
+    ])
+    pd.testing.assert_frame_equal(frame, expected)
+
+
+def test_csv_float_feature_of_integers_is_float(decoder):
+    frame = decoder.decode_csv(b"age,income,city,note\n1,2,a,b\n3,4,c,d\n")
+    assert _dtypes(frame)["income"] == "float64"
+    assert _dtypes(frame)["age"] == "int64"
+
+
+def test_csv_invalid_number(decoder):
+    with pytest.raises(ValueError, match="Feature 'age' expects a number"):
+        decoder.decode_csv(b"age,income,city,note\n1,2,a,b\nold,4,c,d\n")
+
+
+def test_arrow_round_trip_keeps_the_decoded_types(decoder):
+    frame = decoder.records([
+        {"age": 30, "income": 1.5, "city": "Paris", "note": "x"},
+        {"age": 41, "income": None, "city": "Lyon", "note": None},
+    ])
+    pd.testing.assert_frame_equal(decode_columnar(encode_columnar(frame, CONTENT_TYPE_ARROW), CONTENT_TYPE_ARROW), frame)
@@ -0,0 +1,87 @@
+import gzip
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from autogluon_serving import formats
+from autogluon_serving.formats import (
+    CONTENT_TYPE_ARROW,
+    CONTENT_TYPE_PARQUET,
+    compress,
+    decode_columnar,
+    encode_columnar,
+    encode_json,
+    media_type,
+    negotiate_columnar,
+    negotiate_encoding,
+    negotiate_orient,
+)
+
+
+@pytest.fixture(params=["orjson", "json"])
+def encoder(request, monkeypatch):
+    """Run a test with orjson and with the standard library fallback"""
+    if request.param == "orjson":
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(formats, "orjson", None)
+    return request.param
+
+
+def _prediction():
+    return pd.DataFrame({"label": ["a", None], "p_a": [0.25, np.nan], "count": [1, 2]})
+
+
+def test_records_orient(encoder):
+    assert json.loads(encode_json(_prediction(), "records")) == [
+        {"label": "a", "p_a": 0.25, "count": 1},
+        {"label": None, "p_a": None, "count": 2},
+    ]
+
+
+def test_split_orient_is_row_major(encoder):
+    body = json.loads(encode_json(_prediction(), "split"))
+    assert body == {"columns": ["label", "p_a", "count"], "data": [["a", 0.25, 1], [None, None, 2]]}
+
+
+def test_values_orient_is_column_major(encoder):
+    assert json.loads(encode_json(_prediction(), "values")) == [["a", None], [0.25, None], [1, 2]]
+
+
+def test_nan_is_never_written_as_bare_nan(encoder):
+    for orient in ("records", "split", "values"):
+        body = encode_json(_prediction(), orient, envelope={"model": "LightGBM"})
+        assert b"NaN" not in body
+        assert json.loads(body)["model"] == "LightGBM"
+
+
+def test_negotiate_orient():
+    assert negotiate_orient("application/json; orient=split") == "split"
+    assert negotiate_orient('text/csv, application/json;orient="VALUES"') == "values"
+    assert negotiate_orient("application/json", default="records") == "records"
+    with pytest.raises(ValueError):
+        negotiate_orient("application/json; orient=table")
+
+
+@pytest.mark.parametrize("content_type", [CONTENT_TYPE_ARROW, CONTENT_TYPE_PARQUET])
+def test_columnar_round_trip(content_type):
+    frame = pd.DataFrame({"x": [1.5, np.nan], "y": ["a", "b"], "z": [1, 2]})
+    pd.testing.assert_frame_equal(decode_columnar(encode_columnar(frame, content_type), content_type), frame)
+
+
+def test_content_negotiation():
+    assert media_type("text/CSV; charset=utf-8") == "text/csv"
+    assert media_type(None) == "application/json"
+    assert negotiate_columnar("application/json, application/vnd.apache.arrow.stream") == CONTENT_TYPE_ARROW
+    assert negotiate_columnar("application/json") is None
+
+
+def test_encoding_negotiation_and_compression():
+    assert negotiate_encoding("gzip;q=0, br") is None
+    assert negotiate_encoding("gzip") == "gzip"
+    body = b"x" * formats.COMPRESSION_MIN_BYTES
+    compressed, encoding = compress(body, "gzip")
+    assert encoding == "gzip" and gzip.decompress(compressed) == body
+    assert compress(b"small", "gzip") == (b"small", None)
@@ -0,0 +1,126 @@
+import threading
+
+import pandas as pd
+import pytest
+
+from autogluon_serving.microbatch import MicroBatcher
+
+
+class Recorder:
+    """predict_fn that records the frames it is called with, blocking while release is cleared"""
+
+    def __init__(self):
+        self.calls = []
+        self.release = threading.Event()
+        self.release.set()
+        self.started = threading.Event()
+
+    def __call__(self, data, model, timings, served):
+        self.calls.append((len(data), model, served))
+        self.started.set()
+        self.release.wait(5)
+        if "bad" in data.columns:
+            raise KeyError("bad")
+        return pd.DataFrame({"prediction": data.iloc[:, 0].to_numpy()})
+
+
+def _frame(*values, column="x"):
+    return pd.DataFrame({column: list(values)})
+
+
+def _submit_blocked(predict, batcher, *frames, **kwargs):
+    """Submit frames while the worker is held in a first call, so they are batched together"""
+    predict.release.clear()
+    blocker = batcher.submit(_frame(0.0))
+    assert predict.started.wait(5)
+    futures = [batcher.submit(frame, **kwargs) for frame in frames]
+    predict.calls.clear()
+    predict.release.set()
+    blocker.result(5)
+    return futures
+
+
+def test_concurrent_requests_share_one_call():
+    predict = Recorder()
+    batcher = MicroBatcher(predict, max_batch_size=100, max_batch_delay_ms=50)
+    futures = _submit_blocked(predict, batcher, _frame(1.0, 2.0), _frame(3.0))
+    assert futures[0].result(5)["prediction"].tolist() == [1.0, 2.0]
+    assert futures[1].result(5)["prediction"].tolist() == [3.0]
+    assert predict.calls == [(3, None, None)]
+
+
+def test_frames_are_grouped_by_schema_model_and_generation():
+    predict = Recorder()
+    batcher = MicroBatcher(predict, max_batch_size=100, max_batch_delay_ms=50)
+    predict.release.clear()
+    blocker = batcher.submit(_frame(0.0))
+    assert predict.started.wait(5)
+    futures = [
+        batcher.submit(_frame(1.0)),
+        batcher.submit(_frame(2.0)),
+        batcher.submit(_frame(1, column="x")),
+        batcher.submit(_frame(4.0), model="LightGBM"),
+        batcher.submit(_frame(5.0), served="next"),
+    ]
+    predict.calls.clear()
+    predict.release.set()
+    blocker.result(5)
+    assert [future.result(5)["prediction"].tolist() for future in futures] == [[1.0], [2.0], [1], [4.0], [5.0]]
+    assert sorted(predict.calls, key=str) == sorted([(2, None, None), (1, None, None), (1, "LightGBM", None), (1, None, "next")], key=str)
+
+
+def test_batch_size_is_respected():
+    predict = Recorder()
+    batcher = MicroBatcher(predict, max_batch_size=3, max_batch_delay_ms=50)
+    futures = _submit_blocked(predict, batcher, _frame(1.0, 2.0), _frame(3.0, 4.0), _frame(5.0))
+    for future in futures:
+        future.result(5)
+    assert [rows for rows, _, _ in predict.calls] == [2, 3]
+
+
+def test_failing_batch_is_isolated_per_request():
+    predict = Recorder()
+    batcher = MicroBatcher(predict, max_batch_size=100, max_batch_delay_ms=50)
+    good, bad = _submit_blocked(predict, batcher, _frame(1.0), _frame(2.0, column="bad"))
+    assert good.result(5)["prediction"].tolist() == [1.0]
+    with pytest.raises(KeyError):
+        bad.result(5)
+
+
+def test_cancelled_request_is_dropped_and_worker_survives():
+    predict = Recorder()
+    batcher = MicroBatcher(predict, max_batch_size=100, max_batch_delay_ms=50)
+    predict.release.clear()
+    blocker = batcher.submit(_frame(0.0))
+    assert predict.started.wait(5)
+    cancelled = batcher.submit(_frame(1.0))
+    kept = batcher.submit(_frame(2.0))
+    assert cancelled.cancel()
+    predict.calls.clear()
+    predict.release.set()
+    blocker.result(5)
+    assert kept.result(5)["prediction"].tolist() == [2.0]
+    assert predict.calls == [(1, None, None)]
+    # The worker thread still serves later requests
+    assert batcher.submit(_frame(3.0)).result(5)["prediction"].tolist() == [3.0]
+
+
+def test_running_request_cannot_be_cancelled():
+    predict = Recorder()
+    batcher = MicroBatcher(predict, max_batch_size=100, max_batch_delay_ms=0)
+    predict.release.clear()
+    future = batcher.submit(_frame(1.0))
+    assert predict.started.wait(5)
+    assert not future.cancel()
+    predict.release.set()
+    assert future.result(5)["prediction"].tolist() == [1.0]
+
+
+def test_worker_survives_an_unexpected_error():
+    predict = Recorder()
+    batcher = MicroBatcher(predict, max_batch_size=100, max_batch_delay_ms=0)
+    # A request that is not a frame breaks grouping itself rather than the predictor call
+    broken = batcher.submit([1.0])
+    with pytest.raises(AttributeError):
+        broken.result(5)
+    assert batcher.submit(_frame(1.0)).result(5)["prediction"].tolist() == [1.0]
@@ -0,0 +1,42 @@
+import gc
+import os
+
+import pytest
+
+pytest.importorskip("autogluon.common")
+
+from autogluon_serving import prefork
+
+
+def test_preloading_sets_thread_variables_and_after_fork_restores_them(monkeypatch):
+    monkeypatch.setenv("OMP_NUM_THREADS", "7")
+    monkeypatch.delenv("MKL_NUM_THREADS", raising=False)
+    monkeypatch.setattr(prefork, "_thread_env", {})
+    monkeypatch.setattr(prefork, "intra_op_threads", lambda workers: 3)
+    restored = {}
+    monkeypatch.setattr(prefork, "limit_threads", _recording(restored, prefork.limit_threads))
+    with prefork.preloading(workers=2):
+        assert os.environ["OMP_NUM_THREADS"] == "1"
+        assert os.environ["MKL_NUM_THREADS"] == "1"
+        assert not gc.isenabled()
+    prefork.after_fork(workers=2)
+    assert gc.isenabled()
+    # The worker's budget is applied on top of the parent's own settings
+    assert restored == {"OMP_NUM_THREADS": "7", "MKL_NUM_THREADS": None}
+    assert os.environ["OMP_NUM_THREADS"] == "3"
+
+
+def test_preloading_is_a_no_op_for_one_worker(monkeypatch):
+    monkeypatch.setenv("OMP_NUM_THREADS", "7")
+    with prefork.preloading(workers=1):
+        assert os.environ["OMP_NUM_THREADS"] == "7"
+        assert gc.isenabled()
+
+
+def _recording(restored, limit_threads):
+    def record(threads):
+        if threads != 1:
+            restored.update({name: os.environ.get(name) for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS")})
+        return limit_threads(threads)
+
+    return record
@@ -0,0 +1,31 @@
+import pytest
+
+pytest.importorskip("autogluon.common")
+
+from autogluon_serving import reload
+from autogluon_serving.reload import ReloadNotAllowed, check_reload_request
+
+
+def test_reload_endpoint_is_disabled_by_default(monkeypatch):
+    monkeypatch.setattr(reload, "RELOAD_ENDPOINT", False)
+    with pytest.raises(ReloadNotAllowed) as error:
+        check_reload_request(None)
+    assert error.value.status_code == 404
+
+
+@pytest.mark.parametrize("token, allowed", [("secret", True), ("wrong", False), (None, False)])
+def test_reload_token(monkeypatch, token, allowed):
+    monkeypatch.setattr(reload, "RELOAD_ENDPOINT", True)
+    monkeypatch.setattr(reload, "RELOAD_TOKEN", "secret")
+    if allowed:
+        check_reload_request(token)
+    else:
+        with pytest.raises(ReloadNotAllowed) as error:
+            check_reload_request(token)
+        assert error.value.status_code == 403
+
+
+def test_reload_without_token(monkeypatch):
+    monkeypatch.setattr(reload, "RELOAD_ENDPOINT", True)
+    monkeypatch.setattr(reload, "RELOAD_TOKEN", "")
+    check_reload_request(None)